@@ -7,7 +7,7 @@ files can be uploaded to s3
 """
 
 import time
-import json
+import jsoncodec
 import argparse
 import re
 import secrets
@@ -32,7 +32,7 @@ def main():
     for line in stdin:
         # find timestamp
         if line[:1] == '{':
-            record = json.loads(line)
+            record = jsoncodec.loads(line)
             tstamp = int(record['retrevial_time'])
             # print('time is {}'.format(record.get('retrevial_time')))
         if line[:1] == '#':
@@ -0,0 +1,47 @@
+######################################################################
+#
+# JSON encoding and decoding with the fastest available backend
+#
+# orjson is used when it is installed, otherwise the standard library.
+# loads() takes str or bytes, so network and file data need not be
+# decoded first; dumps() returns str and dumpb() bytes, e.g. for
+# writer.Writer, which takes either.  Output is compact (no spaces after
+# separators) and UTF-8 rather than escaped with either backend.
+#
+
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Raw UTF-8 like orjson rather than \u escapes
+_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=False)
+
+if orjson is not None:
+    BACKEND = 'orjson'
+
+    loads = orjson.loads
+
+    def dumpb(obj):
+        """Encode obj as JSON bytes"""
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # Types orjson refuses (e.g. non-str keys, huge ints)
+            return _encoder.encode(obj).encode('utf-8')
+
+    def dumps(obj):
+        """Encode obj as a JSON str"""
+        return dumpb(obj).decode('utf-8')
+else:
+    BACKEND = 'json'
+
+    loads = json.loads
+
+    def dumpb(obj):
+        """Encode obj as JSON bytes"""
+        return _encoder.encode(obj).encode('utf-8')
+
+    dumps = _encoder.encode
@@ -0,0 +1,54 @@
+######################################################################
+#
+# Reading the files writer.Writer writes to an outdir
+#
+# open_gzip() reads a gzip file written with compress 'gzip' up to its
+# last sync point, so files still being written by the poller can be
+# read, where gzip.open fails at the unfinished member at their end.
+#
+
+import io
+import zlib
+
+
+class _GzipReader(io.RawIOBase):
+    """The data of a gzip file as far as it goes, member after member"""
+
+    def __init__(self, filename):
+        self._file = open(filename, 'rb')
+        self._inflate = zlib.decompressobj(31)
+        self._data = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._data:
+            data = b''
+            if self._inflate.eof:
+                data = self._inflate.unused_data
+                self._inflate = zlib.decompressobj(31)
+            data = data or self._file.read(1 << 16)
+            if not data:
+                # Ends short of a member end when still being written
+                return 0
+            try:
+                self._data = self._inflate.decompress(data)
+            except zlib.error:
+                # A torn tail, repaired when the poller next opens it
+                return 0
+        count = min(len(buffer), len(self._data))
+        buffer[:count] = self._data[:count]
+        self._data = self._data[count:]
+        return count
+
+    def close(self):
+        self._file.close()
+        super(_GzipReader, self).close()
+
+
+def open_gzip(filename):
+    """Open gzip file filename for reading text, up to the last sync
+    point of a file still being written, unlike gzip.open"""
+    return io.TextIOWrapper(io.BufferedReader(_GzipReader(filename)),
+                            encoding='utf-8')
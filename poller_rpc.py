@@ -1,4 +1,10 @@
 #!/usr/bin/python
+"""Send tesla_poller a control message and print its reply
+
+./poller_rpc.py --cmd_address 127.0.0.1:7654 --variables command=dump
+./poller_rpc.py --cmd_address 127.0.0.1:7654 --variables command=poll --variables vid=12345
+./poller_rpc.py --cmd_address 127.0.0.1:7654 --variables command=intervals --variables inactive=120
+"""
 import json
 import socket
 import argparse
@@ -7,9 +13,15 @@ parser = argparse.ArgumentParser()
 parser.add_argument('--verbose', action='count', help='Increasing levels of verbosity')
 parser.add_argument('--cmd_address', help='address:Port number to send UDP commands to')
 parser.add_argument('--variables', action='append',type=lambda x: x.split('='))
+parser.add_argument('--timeout', default=5, type=float, help='Seconds to wait for the reply')
 args = parser.parse_args()
 
 sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
 dest = args.cmd_address.split(":")
 dest[1] = int(dest[1])
-sock.sendto(json.dumps(dict(args.variables)), tuple(dest))
+sock.sendto(json.dumps(dict(args.variables)).encode('utf-8'), tuple(dest))
+sock.settimeout(args.timeout)
+try:
+    print(sock.recv(65536).decode('utf-8'))
+except socket.timeout:
+    print("No reply from {}".format(args.cmd_address))
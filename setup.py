@@ -19,9 +19,12 @@ setup(name='teslajson',
       version=get_version(),
       description='Manipulate tesla API, send commands, poll data',
       url='https://github.com/SethRobertson/teslajson',
-      py_modules=['teslajson','tesla_parselib'],
+      py_modules=['teslajson','tesla_parselib','tesla_pollerlib',
+                  'jsoncodec','logfile','writer'],
       scripts=['tesla_poller','tesla-parser.py','poller_rpc.py'],
       author='Greg Glockner, Seth Robertson, Pedro Mendes',
       license='MIT',
-      install_requires=['pytz','psycopg2-binary','Request']
+      python_requires='>=3.6',
+      install_requires=['pytz','psycopg2-binary','Request'],
+      extras_require={'fast': ['orjson']}
       )
@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+""" Benchmarks for the teslajson transport against local stand-ins
+
+pool: compare a fresh urllib opener per request (the old teslajson
+behavior) with the keep-alive teslajson.ConnectionPool against a local
+HTTPS server that counts TLS handshakes.
+
+codec: time the standard library json against jsoncodec at each place
+JSON is encoded or decoded, on a vehicle_data sized record.
+
+firehose: compare a PutRecord call per record with the Writer's batched
+firehose channel against a local stand-in for the Firehose API, which
+can fail a fraction of the records in each batch (needs boto3).
+
+Examples:
+
+./tesla-bench.py pool --threads 8 --requests 50
+./tesla-bench.py codec --number 5000
+./tesla-bench.py firehose --records 5000 --fail 0.05
+"""
+
+import argparse
+import base64
+import json
+import multiprocessing
+import os
+import socket
+import ssl
+import subprocess
+import tempfile
+import threading
+import random
+import time
+import timeit
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.request import Request, build_opener, HTTPSHandler
+
+import jsoncodec
+import teslajson
+from writer import Writer
+
+# A vehicle_data sized response body
+BODY = json.dumps({'response': {'id': 1, 'state': 'online',
+                                'charge_state': {'battery_level': 80,
+                                                 'charger_power': 0},
+                                'padding': 'x' * 4000}}).encode('utf-8')
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answer every request with BODY over a keep-alive connection"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(BODY)))
+        self.end_headers()
+        self.wfile.write(BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_cert(tmpdir):
+    """Create a self-signed certificate for localhost, return its path"""
+    pem = os.path.join(tmpdir, 'localhost.pem')
+    subprocess.check_call(
+        ['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes',
+         '-days', '1', '-subj', '/CN=localhost',
+         '-addext', 'subjectAltName=DNS:localhost',
+         '-keyout', pem, '-out', pem],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return pem
+
+
+def serve(pem, port, handshakes):
+    """Run the HTTPS stand-in, counting completed TLS handshakes"""
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(pem)
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+        def get_request(self):
+            sock, addr = self.socket.accept()
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            sock = context.wrap_socket(sock, server_side=True)
+            with handshakes.get_lock():
+                handshakes.value += 1
+            return sock, addr
+
+    httpd = Server(('localhost', 0), StandInHandler)
+    port.value = httpd.server_address[1]
+    httpd.serve_forever()
+
+
+def run_threads(threads, requests, fetch):
+    """Run fetch() requests times in each of threads threads"""
+    def worker():
+        for i in range(requests):
+            fetch()
+
+    tlist = [threading.Thread(target=worker) for i in range(threads)]
+    wall, cpu = time.perf_counter(), time.process_time()
+    for t in tlist:
+        t.start()
+    for t in tlist:
+        t.join()
+    return time.perf_counter() - wall, time.process_time() - cpu
+
+
+def bench_pool(args):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        pem = make_cert(tmpdir)
+        handshakes = multiprocessing.Value('i', 0)
+        port = multiprocessing.Value('i', 0)
+        server = multiprocessing.Process(target=serve,
+                                         args=(pem, port, handshakes),
+                                         daemon=True)
+        server.start()
+        while not port.value:
+            time.sleep(0.05)
+        context = ssl.create_default_context(cafile=pem)
+        host = 'localhost:{}'.format(port.value)
+
+        def urllib_fetch():
+            opener = build_opener(HTTPSHandler(context=context))
+            json.loads(opener.open(Request('https://{}/api/1/vehicles/1/data'
+                                           .format(host))).read())
+
+        pool = teslajson.ConnectionPool(host, maxsize=args.threads,
+                                        context=context)
+
+        def pool_fetch():
+            resp = pool.request('GET', '/api/1/vehicles/1/data')
+            json.loads(resp.body)
+
+        total = args.threads * args.requests
+        for name, fetch in (('urllib opener', urllib_fetch),
+                            ('ConnectionPool', pool_fetch)):
+            handshakes.value = 0
+            wall, cpu = run_threads(args.threads, args.requests, fetch)
+            print('{:15s} {:5d} requests {:5d} handshakes {:8.2f} ms/req '
+                  '{:8.2f} cpu-ms/req'.format(name, total, handshakes.value,
+                                              wall * 1000 / total,
+                                              cpu * 1000 / total))
+        pool.close()
+        server.terminate()
+
+
+def vehicle_data():
+    """A vehicle_data response shaped record with realistic field counts"""
+    def section(prefix, count):
+        fields = {}
+        for i in range(count):
+            kind = i % 4
+            if kind == 0:
+                fields['{}_level_{}'.format(prefix, i)] = i * 1.25
+            elif kind == 1:
+                fields['{}_state_{}'.format(prefix, i)] = 'Disconnected'
+            elif kind == 2:
+                fields['{}_enabled_{}'.format(prefix, i)] = i % 3 == 0
+            else:
+                fields['{}_power_{}'.format(prefix, i)] = None
+        fields['timestamp'] = 1546300800000
+        return fields
+
+    data = {'id': 12345678901234567, 'vehicle_id': 1234567890,
+            'vin': '5YJ3E1EA7KF000000', 'display_name': 'car',
+            'option_codes': ','.join('OPT{}'.format(i) for i in range(60)),
+            'color': None, 'tokens': ['abcdef0123456789', '0123456789abcdef'],
+            'state': 'online', 'in_service': False,
+            'id_s': '12345678901234567', 'calendar_enabled': True,
+            'api_version': 6,
+            'charge_state': section('charge', 50),
+            'climate_state': section('climate', 30),
+            'drive_state': dict(section('drive', 10), latitude=37.4919,
+                                longitude=-121.9455, heading=180),
+            'gui_settings': section('gui', 8),
+            'vehicle_config': section('config', 30),
+            'vehicle_state': section('vehicle', 50)}
+    data['retrevial_time'] = 1546300800
+    return data
+
+
+def bench_codec(args):
+    record = vehicle_data()
+    body = json.dumps({'response': record}).encode('utf-8')
+    line = json.dumps(record) + '\n'
+    sites = (
+        ('teslajson response decode',
+         lambda: json.loads(body.decode('utf-8')),
+         lambda: jsoncodec.loads(body)),
+        ('tesla_poller record encode',
+         lambda: json.dumps(record).encode('utf-8') + b'\n',
+         lambda: jsoncodec.dumpb(record) + b'\n'),
+        ('TeslaRecord line decode',
+         lambda: json.loads(line),
+         lambda: jsoncodec.loads(line)),
+        ('json2s3 line decode',
+         lambda: line[:1] == '{' and json.loads(line)['retrevial_time'],
+         lambda: line[:1] == '{' and jsoncodec.loads(line)['retrevial_time']),
+    )
+    print('{} byte body, jsoncodec backend {}'.format(len(body),
+                                                      jsoncodec.BACKEND))
+    for name, stdlib, codec in sites:
+        base = min(timeit.repeat(stdlib, number=args.number, repeat=3))
+        fast = min(timeit.repeat(codec, number=args.number, repeat=3))
+        print('{:28s} json {:8.2f} us  jsoncodec {:8.2f} us  {:5.1f}x'.format(
+            name, base * 1e6 / args.number, fast * 1e6 / args.number,
+            base / fast))
+
+
+class FirehoseHandler(BaseHTTPRequestHandler):
+    """Answer PutRecord and PutRecordBatch like Firehose, failing a
+    fraction of the records of each batch, after a delay"""
+    protocol_version = 'HTTP/1.1'
+    fail = 0.0
+    latency = 0.0
+    calls = None
+    records = None
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        action = self.headers['X-Amz-Target'].split('.')[-1]
+        time.sleep(self.latency)
+        with self.calls.get_lock():
+            self.calls.value += 1
+        if action == 'PutRecord':
+            entries = [body['Record']]
+        else:
+            entries = body['Records']
+        results = []
+        for entry in entries:
+            if action == 'PutRecordBatch' and random.random() < self.fail:
+                results.append({'ErrorCode': 'ServiceUnavailableException',
+                                'ErrorMessage': 'Slow down.'})
+                continue
+            base64.b64decode(entry['Data'])
+            with self.records.get_lock():
+                self.records.value += 1
+            results.append({'RecordId': str(self.records.value)})
+        if action == 'PutRecord':
+            reply = {'RecordId': results[0]['RecordId'], 'Encrypted': False}
+        else:
+            reply = {'FailedPutCount': sum('ErrorCode' in result
+                                           for result in results),
+                     'Encrypted': False, 'RequestResponses': results}
+        data = json.dumps(reply).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-amz-json-1.1')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_firehose(port, calls, records, fail, latency):
+    """Run the Firehose stand-in"""
+    FirehoseHandler.calls, FirehoseHandler.records = calls, records
+    FirehoseHandler.fail, FirehoseHandler.latency = fail, latency
+
+    class Server(ThreadingMixIn, HTTPServer):
+        daemon_threads = True
+
+    httpd = Server(('localhost', 0), FirehoseHandler)
+    port.value = httpd.server_address[1]
+    httpd.serve_forever()
+
+
+def bench_firehose(args):
+    try:
+        import boto3
+    except ImportError:
+        raise SystemExit('The firehose benchmark needs boto3')
+    # The stand-in ignores credentials
+    for name in ('AWS_ACCESS_KEY_ID', 'AWS_SECRET_ACCESS_KEY'):
+        os.environ.setdefault(name, 'bench')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    calls = multiprocessing.Value('i', 0)
+    records = multiprocessing.Value('i', 0)
+    port = multiprocessing.Value('i', 0)
+    server = multiprocessing.Process(
+        target=serve_firehose,
+        args=(port, calls, records, args.fail, args.latency / 1000.0),
+        daemon=True)
+    server.start()
+    while not port.value:
+        time.sleep(0.05)
+    endpoint = 'http://localhost:{}'.format(port.value)
+    line = jsoncodec.dumpb(vehicle_data()) + b'\n'
+
+    def put_record():
+        client = boto3.client('firehose', endpoint_url=endpoint)
+        for i in range(args.records):
+            client.put_record(DeliveryStreamName='bench',
+                              Record={'Data': line})
+
+    def batched():
+        W = Writer()
+        W.add_channel('firehose', 'bench', interval=args.interval,
+                      endpoint_url=endpoint)
+        W.start(flush_interval=args.interval)
+        for i in range(args.records):
+            W.write(line)
+        W.close()
+        return W.metrics()['channels']['0-firehose']['firehose']
+
+    for name, run in (('PutRecord', put_record), ('PutRecordBatch', batched)):
+        calls.value = records.value = 0
+        wall = time.perf_counter()
+        stats = run()
+        wall = time.perf_counter() - wall
+        print('{:15s} {:6d} records {:5d} calls {:6d} stored {:8.3f} '
+              'ms/record{}'.format(name, args.records, calls.value,
+                                   records.value,
+                                   wall * 1000 / args.records,
+                                   ' {}'.format(stats) if stats else ''))
+    server.terminate()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest='bench')
+    sub.required = True
+    p = sub.add_parser('pool', help='Keep-alive pool vs opener per request')
+    p.add_argument('--threads', default=8, type=int,
+                   help='Concurrent callers, e.g. vehicle threads')
+    p.add_argument('--requests', default=50, type=int,
+                   help='Requests issued by each thread')
+    p.set_defaults(func=bench_pool)
+    p = sub.add_parser('codec', help='json vs jsoncodec per call site')
+    p.add_argument('--number', default=2000, type=int,
+                   help='Calls timed per call site')
+    p.set_defaults(func=bench_codec)
+    p = sub.add_parser('firehose', help='PutRecord per record vs batched')
+    p.add_argument('--records', default=2000, type=int,
+                   help='Records written')
+    p.add_argument('--fail', default=0.0, type=float,
+                   help='Fraction of batched records the stand-in fails')
+    p.add_argument('--latency', default=20, type=float,
+                   help='Milliseconds the stand-in takes per call')
+    p.add_argument('--interval', default=1.0, type=float,
+                   help='Writer flush interval')
+    p.set_defaults(func=bench_firehose)
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
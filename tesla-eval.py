@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+""" Compare polling policies by replaying archived tesla_poller logs
+
+Each vehicle's records are taken as the truth about what it was doing
+(asleep or awake, climate, charging and driving), carried forward between
+records.  tesla_poller's polling is then simulated over that history with
+the static intervals and with --adaptive, counting the API calls each
+makes and how long after the vehicle became active (drove, charged or
+turned on climate) the poller noticed.
+
+The archive's own polling limits what can be seen: activity shorter than
+its poll intervals is missing from the truth for both policies.
+
+Examples:
+
+./tesla-eval.py poller.log.2021-*
+./tesla-eval.py outdir/*/2021-*.json.gz
+bzcat poller.log.bz2 | ./tesla-eval.py --warmup_days 14 --max_latency 600
+"""
+
+import argparse
+import bisect
+import fileinput
+import sys
+
+import jsoncodec
+from logfile import open_gzip
+from tesla_pollerlib import (INTERVALS, AdaptiveIntervals, VehicleState,
+                             next_state, plan_poll)
+
+ASLEEP = ("asleep", "offline", "inactive")
+SECTIONS = ("climate_state", "charge_state", "drive_state")
+# The fields of each section next_state() looks at, when not yet seen
+IDLE_FIELDS = {"is_climate_on": False, "charger_power": None,
+               "shift_state": None}
+
+
+def openhook(filename, mode):
+    """Open compressed logs, gzip ones even while still being written"""
+    if filename.endswith(".gz"):
+        return open_gzip(filename)
+    return fileinput.hook_compressed(filename, mode)
+
+
+def load_timelines(files):
+    """Read poller logs into a timeline per vehicle id
+
+    A timeline is a sorted list of (time, state, climate_state,
+    charge_state, drive_state), sections carried forward from the last
+    record that had them.
+    """
+    records = {}
+    for line in fileinput.input(files, openhook=openhook):
+        if line.startswith("#") or not line.strip():
+            continue
+        try:
+            record = jsoncodec.loads(line)
+        except ValueError:
+            continue
+        if "id" not in record or "retrevial_time" not in record:
+            continue
+        records.setdefault(record["id"], []).append(record)
+
+    timelines = {}
+    for vid, vrecords in records.items():
+        vrecords.sort(key=lambda r: r["retrevial_time"])
+        sections = dict.fromkeys(SECTIONS, IDLE_FIELDS)
+        timeline = []
+        for record in vrecords:
+            for section in SECTIONS:
+                if section in record:
+                    sections[section] = dict(IDLE_FIELDS,
+                                             **record[section])
+            timeline.append((record["retrevial_time"], record["state"]) +
+                            tuple(sections[s] for s in SECTIONS))
+        timelines[vid] = timeline
+    return timelines
+
+
+def active(point):
+    """Whether the vehicle was driving, charging or running climate"""
+    t, state, climate, charge, drive = point
+    if state in ASLEEP:
+        return False
+    return bool(climate.get("is_climate_on") or
+                (charge.get("charger_power") or 0) > 0 or
+                drive.get("shift_state") is not None)
+
+
+def activity(timeline):
+    """The (start, end) times of each spell of activity in a timeline"""
+    spells = []
+    start = None
+    for point in timeline:
+        if active(point):
+            if start is None:
+                start = point[0]
+        elif start is not None:
+            spells.append((start, point[0]))
+            start = None
+    if start is not None:
+        spells.append((start, timeline[-1][0]))
+    return spells
+
+
+def answer(point, what, awake):
+    """What the API would have returned when asked for what at point"""
+    t, state, climate, charge, drive = point
+    if awake and state in ASLEEP:
+        state = "online"
+    vdata = {"state": state}
+    if what is None or state in ASLEEP:
+        return vdata
+    sections = dict(zip(SECTIONS, (climate, charge, drive)))
+    if what != "all":
+        sections = {what: sections[what]}
+    vdata.update(sections)
+    return vdata
+
+
+def simulate(timeline, intervals, policy, measure_from):
+    """Poll one vehicle's timeline as tesla_poller would
+
+    Returns the API calls made from measure_from on and the times a poll
+    saw the vehicle active.
+    """
+    times = [point[0] for point in timeline]
+    vs = VehicleState({"id": None})
+    calls = 0
+    seen = []
+    now = times[0]
+    wake = True
+    while now <= times[-1]:
+        point = timeline[bisect.bisect(times, now) - 1]
+        what, ourstate, wake_first = plan_poll(vs, intervals, now)
+        wake = wake or wake_first
+        cost = 1
+        if wake:
+            # wake_up, then about two data requests while it comes up
+            cost += 3 if point[1] in ASLEEP else 1
+        vdata = answer(point, what, wake)
+        wake = False
+        if now >= measure_from:
+            calls += cost
+        last_active = vs.last_active
+        ourstate = next_state(vs, ourstate, what, vdata, intervals, now)
+        if vs.last_active != last_active:
+            seen.append(now)
+        interval = intervals[ourstate]
+        if policy is not None:
+            policy.observe(vs, vs.ourstate, ourstate, now)
+            interval = policy.interval(vs, ourstate, now)
+        vs.ourstate = ourstate
+        now += interval
+    return calls, seen
+
+
+def lags(spells, seen, measure_from):
+    """Detection lag of each spell measured, None for those never seen"""
+    result = []
+    for start, end in spells:
+        if start < measure_from:
+            continue
+        i = bisect.bisect_left(seen, start)
+        if i < len(seen) and seen[i] <= end:
+            result.append(seen[i] - start)
+        else:
+            result.append(None)
+    return result
+
+
+def percentile(values, fraction):
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def report(name, calls, days, detected):
+    lagged = sorted(lag for lag in detected if lag is not None)
+    missed = len(detected) - len(lagged)
+    print("{:8s} calls={} per_vehicle_day={:.1f} starts={} missed={}".format(
+        name, calls, calls / days if days else 0, len(detected), missed),
+        end="")
+    if lagged:
+        print(" lag_mean={:.0f} p50={:.0f} p90={:.0f} max={:.0f}".format(
+            sum(lagged) / len(lagged), percentile(lagged, 0.5),
+            percentile(lagged, 0.9), lagged[-1]), end="")
+    print()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument('files', nargs='*',
+                        help='Poller logs, stdin if none')
+    parser.add_argument('--intervals', action='append',
+                        type=lambda x: x.split('='),
+                        help="Set important intervals name=secs as for "
+                        "tesla_poller")
+    parser.add_argument('--max_latency', default=900, type=float,
+                        help='As for tesla_poller --adaptive')
+    parser.add_argument('--adaptive_miss', default=0.02, type=float,
+                        help='As for tesla_poller --adaptive')
+    parser.add_argument('--warmup_days', default=7, type=float,
+                        help='Days of each vehicle\'s history to learn '
+                        'from before counting')
+    args = parser.parse_args()
+
+    intervals = dict(INTERVALS)
+    if args.intervals:
+        intervals.update((x, int(secs)) for x, secs in args.intervals)
+
+    timelines = load_timelines(args.files)
+    if not timelines:
+        print("No vehicle records found", file=sys.stderr)
+        sys.exit(1)
+
+    totals = {"static": [0, []], "adaptive": [0, []]}
+    days = 0
+    for vid, timeline in sorted(timelines.items()):
+        measure_from = timeline[0][0] + args.warmup_days * 86400
+        if timeline[-1][0] <= measure_from:
+            print("# Vehicle {} has too little history".format(vid),
+                  file=sys.stderr)
+            continue
+        days += (timeline[-1][0] - measure_from) / 86400
+        spells = activity(timeline)
+        policies = {"static": None,
+                    "adaptive": AdaptiveIntervals(
+                        intervals, max_latency=args.max_latency,
+                        miss=args.adaptive_miss)}
+        for name, policy in policies.items():
+            calls, seen = simulate(timeline, intervals, policy, measure_from)
+            totals[name][0] += calls
+            totals[name][1] += lags(spells, seen, measure_from)
+
+    print("# {} vehicles, {:.1f} vehicle days measured".format(
+        len(timelines), days))
+    for name, (calls, detected) in totals.items():
+        report(name, calls, days, detected)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ import sys
 import logging
 import verbosity
 from tesla_parselib import TeslaRecord, TeslaSession
+from logfile import open_gzip
 
 logger = logging.getLogger(__name__)
 args = None
@@ -25,6 +26,10 @@ class openfile(object):
         if filename == '-':
             self.fd = sys.stdin
             self.sub = None
+        elif filename and filename.endswith(".gz"):
+            # tesla_poller --outdir_compress gzip, maybe still written
+            self.fd = open_gzip(filename)
+            self.sub = None
         elif filename:
             self.fd = open(filename, "r")
             self.sub = None
@@ -3,7 +3,7 @@
 # Parse the tesla json records
 #
 
-import json
+import jsoncodec
 import copy
 from datetime import datetime, timedelta
 import pytz
@@ -133,7 +133,7 @@ class TeslaRecord(object):
             return instance
 
         try:
-            instance.jline = json.loads(line)
+            instance.jline = jsoncodec.loads(line)
         except Exception as e:
             print("JSON parsing failed. Ignoring:{}".format(line),
                   file=sys.stderr)
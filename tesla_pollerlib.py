@@ -0,0 +1,540 @@
+######################################################################
+#
+# Scheduling for tesla_poller
+#
+
+import asyncio
+import base64
+import bisect
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import sys
+import time
+import traceback
+from array import array
+
+from teslajson import _atomic_write
+
+try:
+    current_task = asyncio.current_task
+except AttributeError:
+    # Python 3.6
+    current_task = asyncio.Task.current_task
+
+# Settings an account in a fleet file may have
+ACCOUNT_KEYS = ('name', 'tokenfile', 'token', 'vids', 'vehicle_cache',
+                'proxy_url', 'proxy_user', 'proxy_password')
+
+# Polling time intervals based on the current state
+# the _poll times are intervals for a periodic "all-data" refresh
+# when in that state
+INTERVALS = {
+    "inactive": 60,
+    "to_sleep": 150,
+    "charging": 90,
+    "running": 30,
+    "recent": 60,
+    "prep": 60,
+    "Unknown": 15,
+    "any_poll": 10000,
+    "running_poll": 300,
+    "charging_poll": 900,
+    "recent_interval": 500
+}
+
+
+def load_fleet(filename):
+    """Read the accounts of a fleet file, returned as a dict by name
+
+    The file is json, {"accounts": [{"name": "home", "tokenfile":
+    "home.json"}, ...]}, with the settings in ACCOUNT_KEYS.  Each account
+    needs a tokenfile or token, its name defaults to the tokenfile.
+    Raises ValueError for a file that cannot be used.
+    """
+    with open(filename, "r") as R:
+        fleet = json.load(R)
+    accounts = {}
+    for account in fleet.get('accounts', []):
+        unknown = set(account) - set(ACCOUNT_KEYS)
+        if unknown:
+            raise ValueError('Unknown account settings {}'.format(
+                sorted(unknown)))
+        if not account.get('tokenfile') and not account.get('token'):
+            raise ValueError('Account {} needs a tokenfile or token'.format(
+                account))
+        name = account.setdefault('name', account.get('tokenfile'))
+        if name in accounts:
+            raise ValueError('Duplicate account {}'.format(name))
+        accounts[name] = account
+    return accounts
+
+
+class VehicleState(object):
+    """Polling state of one vehicle
+
+    ourstate is "inactive", "to_sleep", "running", "charging", "prep",
+    "recent", "error" or "Unknown".  A paused vehicle is not polled.
+    Slots keep thousands of these small.
+    """
+
+    __slots__ = ('vehicle', 'ourstate', 'last_all', 'last_active',
+                 'backoff', 'started', 'last_poll', 'profile', 'paused')
+
+    def __init__(self, vehicle, ourstate="Unknown"):
+        self.vehicle = vehicle
+        self.ourstate = ourstate
+        self.last_all = 0
+        self.last_active = 0
+        self.backoff = 1
+        self.started = False
+        self.last_poll = None
+        self.profile = None
+        self.paused = False
+
+    def __repr__(self):
+        return 'VehicleState({}, {})'.format(self.vehicle['id'],
+                                             self.ourstate)
+
+
+def plan_poll(vs, intervals, now):
+    """Decide what to ask Tesla for on the next poll of a vehicle
+
+    Returns (what, ourstate, wake): "all", a sub-state name or None for
+    the basic data, the state the poll is made in, and whether to wake
+    the vehicle first.
+    """
+    ourstate = vs.ourstate
+    wake = False
+    what = "all"
+    if ourstate == "Unknown":
+        what = "all"
+    elif ourstate == "charging":
+        what = "charge_state"
+    elif ourstate == "running":
+        what = "drive_state"
+    elif ourstate == "inactive":
+        what = None
+    elif ourstate == "prep":
+        what = "all"
+    elif ourstate == "recent":
+        what = "all"
+    elif ourstate == "to_sleep":
+        what = None
+    elif ourstate == "error":
+        # In an error state, wake vehicle and then get all data
+        wake = True
+        what = "all"
+        ourstate = "recent"
+
+    # Handle periodic all-data info refresh
+    all_interval = intervals.get(ourstate + "_poll", intervals["any_poll"])
+    if vs.last_all + all_interval <= now:
+        what = "all"
+
+    if what == "all":
+        vs.last_all = now
+
+    # Handle asleep vehicles - if it's time to get something
+    # wake it up.
+    if ourstate == "inactive" and what is not None:
+        wake = True
+    return what, ourstate, wake
+
+
+def next_state(vs, ourstate, what, vdata, intervals, now):
+    """The state of a vehicle after a poll in ourstate for what got vdata"""
+    # Figure out what state we are now in
+    if vdata["state"] in ("asleep", "offline", "inactive"):
+        # Car is asleep
+        ourstate = "inactive"
+    elif ourstate == "to_sleep":
+        # It appeared we were trying to go to sleep during last
+        # check but did not, why?
+        ourstate = "Unknown"
+    elif ourstate == "inactive" and what != 'all':
+        # Car was asleep, figure out what it is doing now
+        ourstate = "Unknown"
+    else:
+        # Assume we are parked somewhere trying to go to sleep
+        ourstate = "to_sleep"
+
+    # If we have recently been doing something interesting
+    if vs.last_active + intervals["recent_interval"] > now:
+        ourstate = "recent"
+
+    # If we are currently preparing (or actually) doing something
+    # interesting
+    if ("climate_state" in vdata and
+            vdata["climate_state"]["is_climate_on"]):
+        ourstate = "recent"
+        vs.last_active = now
+
+    # If we are currently charging
+    if ("charge_state" in vdata and
+            vdata["charge_state"]["charger_power"] is not None and
+            vdata["charge_state"]["charger_power"] > 0):
+        ourstate = "charging"
+        vs.last_active = now
+
+    # If we are currently driving
+    if ("drive_state" in vdata and
+            vdata["drive_state"]["shift_state"] is not None):
+        ourstate = "running"
+        vs.last_active = now
+
+    return ourstate
+
+
+class AdaptiveIntervals(object):
+    """Polling intervals learned from when each vehicle becomes active
+
+    For every hour of the week a vehicle's profile counts the times it
+    became active (driving, charging or preparing) and the seconds it was
+    seen idle, giving the rate activity starts in that hour.  Idle
+    vehicles (IDLE states) are next polled after the interval in which
+    activity starts with probability miss, at least tighten times the
+    static interval and at most max_latency, the longest a start may go
+    unseen.  Until it has history a vehicle keeps the static intervals,
+    other states always do.
+    """
+
+    IDLE = ('inactive', 'to_sleep')
+    ACTIVE = ('running', 'charging', 'recent')
+    HOURS = 7 * 24
+
+    def __init__(self, intervals, max_latency=900, miss=0.02, tighten=0.5,
+                 prior_hours=1, window_hours=8):
+        self.intervals = intervals
+        self.max_latency = max_latency
+        self.miss = miss
+        self.tighten = tighten
+        self.prior = prior_hours * 3600.0
+        self.window = window_hours * 3600.0
+
+    def _hour(self, now):
+        local = time.localtime(now)
+        return local.tm_wday * 24 + local.tm_hour
+
+    def observe(self, vs, previous, ourstate, now):
+        """Learn from a poll of vs which moved it from previous to ourstate
+
+        The profile is an array of activity starts then idle seconds per
+        hour of the week.
+        """
+        last, vs.last_poll = vs.last_poll, now
+        if last is None or previous in self.ACTIVE:
+            return
+        if vs.profile is None:
+            vs.profile = array('f', bytes(4 * 2 * self.HOURS))
+        profile = vs.profile
+        hour = self._hour(now)
+        profile[self.HOURS + hour] += min(now - last, self.max_latency)
+        if ourstate in self.ACTIVE:
+            profile[hour] += 1
+        if profile[self.HOURS + hour] > self.window:
+            # Forget old habits
+            profile[hour] /= 2
+            profile[self.HOURS + hour] /= 2
+
+    def interval(self, vs, ourstate, now):
+        """Seconds until vs, now in ourstate, should be polled again"""
+        static = self.intervals[ourstate]
+        if ourstate not in self.IDLE or vs.profile is None:
+            return static
+        # Starts per second this hour, smoothed with its neighbours and
+        # a prior matching the static interval
+        target = -math.log(1 - self.miss)
+        hour = self._hour(now)
+        starts = idle = 0.0
+        for offset, weight in ((-1, 0.5), (0, 1.0), (1, 0.5)):
+            h = (hour + offset) % self.HOURS
+            starts += weight * vs.profile[h]
+            idle += weight * vs.profile[self.HOURS + h]
+        rate = (starts + target * self.prior / static) / (idle + self.prior)
+        return max(static * self.tighten,
+                   min(target / rate, self.max_latency))
+
+
+class Checkpoint(object):
+    """Polling state of every vehicle, kept in a file for warm restarts
+
+    load() reads the file, then restore(vs) gives a vehicle its saved
+    state and returns the seconds until it is due.  To save, dumps(states,
+    due) gives the text for the state of each VehicleState, due(vs) being
+    the seconds until it is next due (None for now), or None when nothing
+    has changed since the last write(text), which atomically replaces the
+    file and may be run in another thread.
+    """
+
+    FIELDS = ('ourstate', 'last_all', 'last_active', 'backoff', 'last_poll',
+              'paused')
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.saved = {}
+        self._text = None
+
+    def load(self):
+        """Read the saved states, returns how many there are"""
+        try:
+            with open(self.filename, "r") as R:
+                self.saved = json.load(R)['vehicles']
+        except FileNotFoundError:
+            self.saved = {}
+        return len(self.saved)
+
+    def restore(self, vs):
+        """Give vs its saved state, returns the seconds until it is due, or
+        None if it has none (saved states are used once)"""
+        saved = self.saved.pop(str(vs.vehicle['id']), None)
+        if saved is None:
+            return None
+        for field in self.FIELDS:
+            setattr(vs, field, saved[field])
+        if saved.get('profile'):
+            vs.profile = array('f', base64.b64decode(saved['profile']))
+        # Its state is known, so no need to wake it to find out
+        vs.started = True
+        return max(0, saved['due'] - time.time())
+
+    def dumps(self, states, due):
+        """The text to save for states, None if unchanged"""
+        now = time.time()
+        vehicles = {}
+        for vs in states:
+            saved = {field: getattr(vs, field) for field in self.FIELDS}
+            if vs.profile is not None:
+                saved['profile'] = base64.b64encode(
+                    vs.profile.tobytes()).decode('ascii')
+            saved['due'] = round(now + (due(vs) or 0))
+            vehicles[str(vs.vehicle['id'])] = saved
+        text = json.dumps({'vehicles': vehicles}, sort_keys=True)
+        if text == self._text:
+            return None
+        return text
+
+    def write(self, text):
+        """Replace the file with text from dumps()"""
+        _atomic_write(self.filename, text)
+        self._text = text
+
+
+class Scheduler(object):
+    """Run a step for each item when its next deadline comes up
+
+    Waiting items sit in one heap of (deadline, sequence, item), so an
+    idle vehicle costs a heap entry rather than a thread or sleeping task.
+    run(step) starts a task running step(item) for each item as it comes
+    due; step returns the seconds until the item is due again, or None to
+    drop it.  Delays are divided by time_scale.  run() returns once no
+    items are left, unless forever is set so more can be scheduled later.
+    Rescheduling a waiting item replaces its deadline, the old heap entry
+    is skipped when it comes up, as is that of a removed item.
+    """
+
+    def __init__(self, time_scale=1.0):
+        self.time_scale = time_scale
+        self._heap = []
+        self._seq = itertools.count()
+        self._wakeup = None
+        self._waiting = {}
+        self._running = {}
+        self._removed = set()
+
+    def __len__(self):
+        """Items waiting or being stepped"""
+        return len(self._waiting) + len(self._running)
+
+    def items(self):
+        """Items waiting or being stepped"""
+        return list(self._waiting) + list(self._running.values())
+
+    def due(self, item):
+        """Seconds until a waiting item is due, None if it is not waiting"""
+        if item not in self._waiting:
+            return None
+        return (self._waiting[item][0] - time.monotonic()) * self.time_scale
+
+    def schedule(self, item, delay=0):
+        """Make item due in delay seconds"""
+        entry = (time.monotonic() + delay / self.time_scale,
+                 next(self._seq), item)
+        self._waiting[item] = entry
+        heapq.heappush(self._heap, entry)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    def wake(self, item):
+        """Make a waiting item due now, returns whether it was waiting
+
+        An item being stepped is left to be rescheduled by its step.
+        """
+        if item not in self._waiting:
+            return False
+        self.schedule(item)
+        return True
+
+    def remove(self, item):
+        """Drop an item, now if waiting or else when its step returns"""
+        if self._waiting.pop(item, None) is not None:
+            return
+        if item in self._running.values():
+            self._removed.add(item)
+
+    async def run(self, step, forever=False):
+        """Step items as they come due until none are left"""
+        self._wakeup = asyncio.Event()
+        while forever or self._waiting or self._running:
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                entry = heapq.heappop(self._heap)
+                item = entry[2]
+                if self._waiting.get(item) is not entry:
+                    # Rescheduled since
+                    continue
+                del self._waiting[item]
+                task = asyncio.ensure_future(self._step(step, item))
+                self._running[task] = item
+            self._wakeup.clear()
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _step(self, step, item):
+        delay = None
+        try:
+            delay = await step(item)
+        except asyncio.CancelledError:
+            # Shutting down, leave it due
+            delay = 0
+            raise
+        except Exception:
+            # step should handle its own errors, an escape drops the item
+            print("# {:.0f} Dropping {}".format(time.time(), item),
+                  file=sys.stderr)
+            traceback.print_exc()
+        finally:
+            self._running.pop(current_task(), None)
+            if item in self._removed:
+                self._removed.discard(item)
+                delay = None
+            if delay is not None:
+                self.schedule(item, delay)
+            else:
+                self._wakeup.set()
+
+
+def run_async(main):
+    """asyncio.run(main), also on Python 3.6: run it on a new event loop,
+    then cancel the tasks it left and close the loop"""
+    if hasattr(asyncio, 'run'):
+        return asyncio.run(main)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        return loop.run_until_complete(main)
+    finally:
+        try:
+            tasks = [task for task in asyncio.Task.all_tasks(loop)
+                     if not task.done()]
+            for task in tasks:
+                task.cancel()
+            loop.run_until_complete(
+                asyncio.gather(*tasks, return_exceptions=True))
+            loop.run_until_complete(loop.shutdown_asyncgens())
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+class HashRing(object):
+    """Consistent hash ring assigning keys to nodes
+
+    Each node owns replicas points on the ring and a key belongs to the
+    node with the first point after the key's hash, so a key's node only
+    changes when a node is added or removed, and then only for about
+    1/len(nodes) of the keys.
+    """
+
+    def __init__(self, nodes, replicas=100):
+        self._points = sorted((self._hash('{}-{}'.format(node, i)), node)
+                              for node in nodes for i in range(replicas))
+        self._hashes = [point[0] for point in self._points]
+
+    @staticmethod
+    def _hash(key):
+        return int.from_bytes(
+            hashlib.md5(str(key).encode('utf-8')).digest()[:8], 'big')
+
+    def node(self, key):
+        """The node key belongs to"""
+        i = bisect.bisect(self._hashes, self._hash(key))
+        return self._points[i % len(self._points)][1]
+
+
+class Worker(object):
+    """A worker subprocess, sent its assignment and other messages as json
+    lines on stdin
+
+    run() keeps the process running, restarting it with a doubling delay
+    (reset after a good run) when it exits, and sends the current
+    assignment on every start.  Each line the worker prints is passed to
+    output(worker, line).
+    """
+
+    def __init__(self, index, command, output):
+        self.index = index
+        self.command = command
+        self.output = output
+        self.assignment = None
+        self.proc = None
+        self.restarts = 0
+        self.health = None
+
+    def assign(self, assignment):
+        """Send the worker a new assignment, returns whether it changed"""
+        line = json.dumps(assignment, sort_keys=True) + '\n'
+        if line == self.assignment:
+            return False
+        self.assignment = line
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.stdin.write(line.encode('utf-8'))
+        return True
+
+    def send(self, message):
+        """Send the worker a message if it is running, returns whether sent"""
+        if self.proc is None or self.proc.returncode is not None:
+            return False
+        self.proc.stdin.write((json.dumps(message) + '\n').encode('utf-8'))
+        return True
+
+    def signal(self, signum):
+        """Send signum to the worker if it is running"""
+        if self.proc is not None and self.proc.returncode is None:
+            self.proc.send_signal(signum)
+
+    async def run(self):
+        delay = 1
+        while True:
+            started = time.time()
+            self.proc = await asyncio.create_subprocess_exec(
+                *self.command, stdin=asyncio.subprocess.PIPE,
+                stdout=asyncio.subprocess.PIPE, limit=2**24)
+            if self.assignment is not None:
+                self.proc.stdin.write(self.assignment.encode('utf-8'))
+            async for line in self.proc.stdout:
+                self.output(self, line.decode('utf-8'))
+            code = await self.proc.wait()
+            if time.time() - started > 300:
+                delay = 1
+            self.restarts += 1
+            self.output(self, "# {:.0f} Worker {} exited with {}, restarting "
+                        "in {}s\n".format(time.time(), self.index, code,
+                                          delay))
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 300)
@@ -13,23 +13,1333 @@ v = c.vehicles[0]
 v.wake_up()
 v.data_request('charge_state')
 v.command('charge_start')
+
+or on an asyncio event loop:
+
+c = await teslajson.AsyncConnection.create(tokenfile='tesla.creds')
+v = c.vehicles[0]
+await v.wake_up()
+await v.data_request('charge_state')
 """
 
-from urllib.parse import urlencode
-from urllib.request import (
-    Request, build_opener, ProxyHandler, HTTPBasicAuthHandler,
-    HTTPHandler, HTTPSHandler, HTTPError, URLError)
+from urllib.parse import quote, urlencode, urlsplit
+from urllib.error import HTTPError, URLError
+from base64 import b64encode
+from collections import OrderedDict, deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import asyncio
+import http.client
+import io
+import email.utils
+import gzip
 import json
+import os
+import random
+import socket
+import ssl
+import threading
 import time
 import warnings
 import sys
+import zlib
 
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not on POSIX
+    fcntl = None
 
-class Connection(object):
-    """Connection to Tesla Motors API"""
+# Use the fast JSON codec shipped alongside teslajson when it is there,
+# teslajson.py also works on its own with the standard library
+try:
+    from jsoncodec import loads as _json_loads
+except ImportError:
+    _json_loads = json.loads
+
+
+# A fully read HTTP response, as returned by ConnectionPool.request; wire
+# is the size of the body as received if it was compressed, else None
+_Response = namedtuple('_Response', 'status reason headers body wire')
+_Response.__new__.__defaults__ = (None,)
+
+# Outcome for one vehicle of Connection.fetch_all, error is the exception
+# raised (data is then None) or None
+FetchResult = namedtuple('FetchResult', 'vehicle data error')
+
+
+def _proxy_settings(proxy_url, proxy_user, proxy_password):
+    """Return the proxy host:port and the headers for the CONNECT tunnel"""
+    if not proxy_url:
+        return None, {}
+    if '://' not in proxy_url:
+        proxy_url = 'https://' + proxy_url
+    headers = {}
+    if proxy_user:
+        creds = '{}:{}'.format(proxy_user, proxy_password)
+        headers['Proxy-Authorization'] = (
+            'Basic ' + b64encode(creds.encode('utf-8')).decode())
+    return urlsplit(proxy_url).netloc.rpartition('@')[2], headers
+
+
+def _split_hostport(hostport, default_port=443):
+    """Split host[:port] into (host, port)"""
+    host, sep, port = hostport.rpartition(':')
+    if not sep or not port.isdigit():
+        return hostport, default_port
+    return host, int(port)
+
+
+# Phases a new connection spends resolving, connecting and handshaking
+_SETUP_PHASES = ('dns', 'connect', 'tls')
+
+
+def _start_timing(timings):
+    """Clear the connection setup phases of a previous try"""
+    for phase in _SETUP_PHASES:
+        timings.pop(phase, None)
+
+
+def _send_timing(timings, elapsed):
+    """Record the time to send, less any connection setup within it"""
+    timings['send'] = elapsed - sum(timings.get(phase, 0)
+                                    for phase in _SETUP_PHASES)
+
+
+# Content-Encodings the pools ask for, and the size they read bodies in
+ACCEPT_ENCODING = 'gzip, deflate'
+_CHUNK = 65536
+
+
+class _Decompressor(object):
+    """Undo a gzip or deflate Content-Encoding a chunk at a time"""
+
+    def __init__(self):
+        # Accepts a gzip or zlib header, raw deflate is found on failure
+        self._obj = zlib.decompressobj(32 + zlib.MAX_WBITS)
+        self._started = False
+        self.wire = 0
+
+    @classmethod
+    def for_headers(cls, headers):
+        """Decompressor for the response headers, None if not compressed"""
+        encoding = (headers.get('Content-Encoding') or '').strip().lower()
+        if encoding not in ('gzip', 'x-gzip', 'deflate'):
+            return None
+        # The body handed back is decoded, so drop the header saying not
+        del headers['Content-Encoding']
+        return cls()
+
+    def feed(self, chunk):
+        """Decompress the next chunk of the body"""
+        self.wire += len(chunk)
+        try:
+            data = self._obj.decompress(chunk)
+        except zlib.error:
+            if self._started:
+                raise
+            # Some servers send deflate without the zlib wrapper
+            self._obj = zlib.decompressobj(-zlib.MAX_WBITS)
+            data = self._obj.decompress(chunk)
+        self._started = True
+        return data
+
+    def flush(self):
+        return self._obj.flush()
+
+
+def _read_body(resp):
+    """Read an http.client response body, decompressing as it arrives"""
+    decompressor = _Decompressor.for_headers(resp.msg)
+    if decompressor is None:
+        return resp.read(), None
+    parts = []
+    while True:
+        chunk = resp.read(_CHUNK)
+        if not chunk:
+            break
+        parts.append(decompressor.feed(chunk))
+    parts.append(decompressor.flush())
+    return b''.join(parts), decompressor.wire
+
+
+class _HTTPSConnection(http.client.HTTPSConnection):
+    """HTTPSConnection that can time the phases of connecting
+
+    When timings is a dict, connect() records the dns, connect (TCP and
+    any proxy tunnel) and tls times in seconds.
+    """
+
+    timings = None
+
+    def connect(self):
+        if self.timings is None:
+            return super(_HTTPSConnection, self).connect()
+        start = time.perf_counter()
+        addrs = socket.getaddrinfo(self.host, self.port, 0,
+                                   socket.SOCK_STREAM)
+        resolved = time.perf_counter()
+        self.timings['dns'] = resolved - start
+        for family, type, proto, _, addr in addrs:
+            sock = socket.socket(family, type, proto)
+            try:
+                sock.settimeout(self.timeout)
+                sock.connect(addr)
+                break
+            except OSError:
+                sock.close()
+                if addr == addrs[-1][4]:
+                    raise
+        self.sock = sock
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self._tunnel_host:
+            self._tunnel()
+        connected = time.perf_counter()
+        self.timings['connect'] = connected - resolved
+        self.sock = self._context.wrap_socket(
+            self.sock, server_hostname=self._tunnel_host or self.host)
+        self.timings['tls'] = time.perf_counter() - connected
+
+
+def _accept_encoding(pool, headers):
+    """headers with Accept-Encoding added if the pool compresses"""
+    if not pool.compress or 'Accept-Encoding' in headers:
+        return headers
+    return dict(headers, **{'Accept-Encoding': ACCEPT_ENCODING})
+
+
+class ConnectionPool(object):
+    """Thread-safe pool of persistent keep-alive HTTPS connections
+
+    At most maxsize requests are in flight at once, further callers wait
+    for a connection to come free.  Idle connections are reused most
+    recently used first so the TCP+TLS handshake is only paid when the
+    pool grows or the server drops a connection.
+    """
+
+    def __init__(self, host, maxsize=10, timeout=60, proxy_url='',
+                 proxy_user='', proxy_password='', context=None,
+                 debuglevel=0, compress=True):
+        """Create pool for https://host
+
+        proxy_url: host:port of a proxy to CONNECT through
+        proxy_user/proxy_password: basic authentication for the proxy
+        context: ssl.SSLContext to use, defaults to system verification
+        compress: ask for gzip/deflate responses, bodies are returned
+            decompressed either way
+        """
+        self.host = host
+        self.compress = compress
+        self.timeout = timeout
+        self.context = context or ssl.create_default_context()
+        self.debuglevel = debuglevel
+        self.proxy, self.proxy_headers = _proxy_settings(
+            proxy_url, proxy_user, proxy_password)
+        self.connections_made = 0
+        self._idle = deque()
+        self._lock = threading.Lock()
+        self.maxsize = maxsize
+        self._slots = threading.BoundedSemaphore(maxsize)
+
+    def request(self, method, path, body=None, headers={}, timings=None):
+        """Send a request and read the complete response
+
+        Returns a _Response; HTTP error statuses are returned, not raised,
+        so the connection can go back into the pool.  If timings is a dict
+        the seconds spent in each phase (dns, connect, tls for a new
+        connection, then send, server and body) are stored in it.
+        """
+        headers = _accept_encoding(self, headers)
+        with self._slots:
+            conn, reused = self._checkout()
+            try:
+                try:
+                    resp, data, wire = self._send(conn, method, path, body,
+                                                  headers, timings)
+                except (http.client.RemoteDisconnected, ConnectionError):
+                    if not reused:
+                        raise
+                    # Server closed an idle keep-alive connection under us,
+                    # that is not a failure of the request so go again
+                    conn.close()
+                    conn = self._new_connection()
+                    resp, data, wire = self._send(conn, method, path, body,
+                                                  headers, timings)
+            except BaseException:
+                conn.close()
+                raise
+            if resp.will_close:
+                conn.close()
+            else:
+                with self._lock:
+                    self._idle.append(conn)
+            return _Response(resp.status, resp.reason, resp.msg, data, wire)
+
+    def close(self):
+        """Close all idle connections"""
+        with self._lock:
+            while self._idle:
+                self._idle.pop().close()
+
+    def _checkout(self):
+        """Get an idle connection or a new one, and whether it was reused"""
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._new_connection(), False
+
+    def _new_connection(self):
+        """Open (lazily) a new connection, tunnelling through any proxy"""
+        if self.proxy:
+            conn = _HTTPSConnection(
+                self.proxy, timeout=self.timeout, context=self.context)
+            conn.set_tunnel(self.host, headers=self.proxy_headers)
+        else:
+            conn = _HTTPSConnection(
+                self.host, timeout=self.timeout, context=self.context)
+        conn.set_debuglevel(self.debuglevel)
+        with self._lock:
+            self.connections_made += 1
+        return conn
+
+    @staticmethod
+    def _send(conn, method, path, body, headers, timings=None):
+        """Issue one request on conn, return the response, the whole
+        body and its compressed size"""
+        if timings is None:
+            conn.request(method, path, body=body, headers=headers)
+            resp = conn.getresponse()
+            return (resp,) + _read_body(resp)
+
+        _start_timing(timings)
+        conn.timings = timings
+        try:
+            start = time.perf_counter()
+            conn.request(method, path, body=body, headers=headers)
+            sent = time.perf_counter()
+            resp = conn.getresponse()
+            answered = time.perf_counter()
+            data, wire = _read_body(resp)
+        finally:
+            conn.timings = None
+        _send_timing(timings, sent - start)
+        timings['server'] = answered - sent
+        timings['body'] = time.perf_counter() - answered
+        return resp, data, wire
+
+
+class _AsyncHTTPSConnection(object):
+    """A single HTTP/1.1 over TLS connection on the event loop"""
+
+    def __init__(self, pool):
+        self.pool = pool
+        self.reader = None
+        self.writer = None
+
+    async def connect(self, timings=None):
+        """Open the connection, tunnelling through the proxy if any
+
+        The TCP connection is made by hand, rather than by
+        asyncio.open_connection, so the proxy CONNECT can happen before
+        TLS starts and the phases can be timed into timings.
+        """
+        pool = self.pool
+        loop = asyncio.get_event_loop()
+        host, port = _split_hostport(pool.host)
+        start = time.perf_counter()
+        addrs = await loop.getaddrinfo(*_split_hostport(pool.proxy or
+                                                        pool.host),
+                                       type=socket.SOCK_STREAM)
+        resolved = time.perf_counter()
+        for family, type, proto, _, addr in addrs:
+            sock = socket.socket(family, type, proto)
+            try:
+                sock.setblocking(False)
+                await loop.sock_connect(sock, addr)
+                break
+            except OSError:
+                sock.close()
+                if addr == addrs[-1][4]:
+                    raise
+        try:
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if pool.proxy:
+                await self._tunnel(loop, sock, host, port)
+            connected = time.perf_counter()
+            self.reader, self.writer = await asyncio.open_connection(
+                sock=sock, ssl=pool.context, server_hostname=host)
+        except BaseException:
+            sock.close()
+            raise
+        if timings is not None:
+            timings['dns'] = resolved - start
+            timings['connect'] = connected - resolved
+            timings['tls'] = time.perf_counter() - connected
+
+    async def _tunnel(self, loop, sock, host, port):
+        """CONNECT through the proxy in the clear"""
+        lines = ['CONNECT {0}:{1} HTTP/1.1'.format(host, port),
+                 'Host: {0}:{1}'.format(host, port)]
+        lines += ['{}: {}'.format(k, v)
+                  for k, v in self.pool.proxy_headers.items()]
+        await loop.sock_sendall(
+            sock, ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1'))
+        reply = b''
+        while b'\r\n\r\n' not in reply:
+            chunk = await loop.sock_recv(sock, 4096)
+            if not chunk:
+                raise OSError('Tunnel connection closed by proxy')
+            reply += chunk
+        status = reply.split(b'\r\n', 1)[0].decode('latin-1')
+        if status.split()[1:2] != ['200']:
+            raise OSError('Tunnel connection failed: ' + status)
+
+    def usable(self):
+        """Whether an idle connection still looks open"""
+        return self.reader is not None and not self.reader.at_eof()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body, headers, timings=None):
+        """Send the request, return (_Response, keep-alive)
+
+        Phase times are stored in timings if it is a dict.
+        """
+        if timings is not None:
+            _start_timing(timings)
+            start = time.perf_counter()
+        if self.writer is None:
+            await self.connect(timings)
+        lines = ['{} {} HTTP/1.1'.format(method, path),
+                 'Host: {}'.format(self.pool.host)]
+        lines += ['{}: {}'.format(k, v) for k, v in headers.items()]
+        if body is not None:
+            lines.append('Content-Length: {:d}'.format(len(body)))
+        if self.pool.debuglevel:
+            print('send:', lines)
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n')
+                          .encode('latin-1') + (body or b''))
+        await self.writer.drain()
+        if timings is not None:
+            sent = time.perf_counter()
+
+        head = await self.reader.readuntil(b'\r\n\r\n')
+        if timings is not None:
+            answered = time.perf_counter()
+        statusline, _, rest = head.partition(b'\r\n')
+        if self.pool.debuglevel:
+            print('reply:', statusline)
+        version, status, reason = (
+            statusline.decode('latin-1').split(None, 2) + [''])[:3]
+        if not version.startswith('HTTP/') or not status.isdigit():
+            raise http.client.BadStatusLine(statusline.decode('latin-1'))
+        status = int(status)
+        msg = http.client.parse_headers(io.BytesIO(rest))
+        keep = (version == 'HTTP/1.1' and
+                msg.get('Connection', '').lower() != 'close')
+
+        # Decompress each piece of the body as it arrives
+        parts = []
+        decompressor = _Decompressor.for_headers(msg)
+        add = (parts.append if decompressor is None else
+               lambda chunk: parts.append(decompressor.feed(chunk)))
+        if method == 'HEAD' or status in (204, 304) or status < 200:
+            pass
+        elif 'chunked' in msg.get('Transfer-Encoding', '').lower():
+            await self._read_chunked(add)
+        elif msg.get('Content-Length') is not None:
+            remaining = int(msg['Content-Length'])
+            while remaining:
+                chunk = await self.reader.readexactly(min(remaining, _CHUNK))
+                remaining -= len(chunk)
+                add(chunk)
+        else:
+            while True:
+                chunk = await self.reader.read(_CHUNK)
+                if not chunk:
+                    break
+                add(chunk)
+            keep = False
+        wire = None
+        if decompressor is not None:
+            parts.append(decompressor.flush())
+            wire = decompressor.wire
+        if timings is not None:
+            _send_timing(timings, sent - start)
+            timings['server'] = answered - sent
+            timings['body'] = time.perf_counter() - answered
+        return _Response(status, reason.strip(), msg, b''.join(parts),
+                         wire), keep
+
+    async def _read_chunked(self, add):
+        """Read a chunked transfer-encoded body, passing each chunk to add"""
+        while True:
+            line = await self.reader.readline()
+            size = int(line.split(b';', 1)[0].strip(), 16)
+            if not size:
+                break
+            add(await self.reader.readexactly(size))
+            await self.reader.readexactly(2)
+        # Skip any trailers
+        while (await self.reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+
+
+class AsyncConnectionPool(object):
+    """asyncio pool of persistent keep-alive HTTPS connections
+
+    The event loop counterpart of ConnectionPool: at most maxsize
+    requests hold a connection at once, the rest queue for one.
+    """
+
+    def __init__(self, host, maxsize=100, timeout=60, proxy_url='',
+                 proxy_user='', proxy_password='', context=None,
+                 debuglevel=0, compress=True):
+        """Create pool for https://host, arguments as for ConnectionPool"""
+        self.host = host
+        self.compress = compress
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self.context = context or ssl.create_default_context()
+        self.debuglevel = debuglevel
+        self.proxy, self.proxy_headers = _proxy_settings(
+            proxy_url, proxy_user, proxy_password)
+        self.connections_made = 0
+        self._idle = deque()
+        self._slots = None
+
+    async def request(self, method, path, body=None, headers={},
+                      timings=None):
+        """Send a request and read the complete response
+
+        Returns a _Response; HTTP error statuses are returned, not raised.
+        Phase times are stored in timings if it is a dict.
+        """
+        headers = _accept_encoding(self, headers)
+        # Created here so the semaphore belongs to the running loop
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.maxsize)
+        async with self._slots:
+            conn, reused = self._checkout()
+            try:
+                try:
+                    resp, keep = await asyncio.wait_for(
+                        conn.request(method, path, body, headers, timings),
+                        self.timeout)
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    if not reused:
+                        raise
+                    # Server closed an idle keep-alive connection under us
+                    conn.close()
+                    conn = self._new_connection()
+                    resp, keep = await asyncio.wait_for(
+                        conn.request(method, path, body, headers, timings),
+                        self.timeout)
+            except BaseException:
+                conn.close()
+                raise
+            if keep:
+                self._idle.append(conn)
+            else:
+                conn.close()
+            return resp
+
+    def close(self):
+        """Close all idle connections"""
+        while self._idle:
+            self._idle.pop().close()
+
+    def _checkout(self):
+        """Get a live idle connection or a new one, and whether reused"""
+        while self._idle:
+            conn = self._idle.pop()
+            if conn.usable():
+                return conn, True
+            conn.close()
+        return self._new_connection(), False
+
+    def _new_connection(self):
+        self.connections_made += 1
+        return _AsyncHTTPSConnection(self)
+
+
+def _endpoint(command):
+    """Classify an API command as (endpoint class, vehicle id or None)
+
+    Endpoint classes are 'wake', 'command' and 'data' (everything else).
+    """
+    parts = command.split('/')
+    vid = parts[1] if parts[0] == 'vehicles' and len(parts) > 1 else None
+    if parts[-1] == 'wake_up':
+        return 'wake', vid
+    if 'command' in parts[2:]:
+        return 'command', vid
+    return 'data', vid
+
+
+class TokenBucket(object):
+    """Token bucket refilling at rate tokens/second up to burst tokens"""
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = self.burst
+        self.stamp = time.monotonic()
+
+    def delay(self):
+        """Seconds until a token is available, 0 if one is now"""
+        now = time.monotonic()
+        self.tokens = min(self.burst,
+                          self.tokens + (now - self.stamp) * self.rate)
+        self.stamp = now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class RateLimiter(object):
+    """Client side request rate limit for an account
+
+    Each endpoint class ('data', 'wake', 'command') has its own token
+    bucket, limits maps the class to (requests per second, burst).
+    Classes missing from limits are not limited.  Waiting requests are
+    served round robin by vehicle, so one busy vehicle cannot starve
+    the others.  A limiter serves either threads (acquire) or a single
+    event loop (acquire_async), not both.
+
+    metrics() reports the requests currently waiting on the limiter and
+    the totals of requests delayed and time spent waiting.
+    """
+
+    # Rough budget keeping a poller clear of server side throttling
+    DEFAULT_LIMITS = {'data': (1.0, 20), 'wake': (0.2, 5),
+                      'command': (0.5, 10)}
+
+    def __init__(self, limits=None):
+        if limits is None:
+            limits = self.DEFAULT_LIMITS
+        self.buckets = {kind: TokenBucket(rate, burst)
+                        for kind, (rate, burst) in limits.items()}
+        self._queues = {kind: OrderedDict() for kind in self.buckets}
+        self._cond = threading.Condition()
+        self._acond = None
+        self.waiting = 0
+        self.delayed = 0
+        self.wait_seconds = 0.0
+        self.max_wait = 0.0
+
+    def acquire(self, kind, key=None):
+        """Block until a request of class kind for vehicle key may go,
+        returns the seconds waited"""
+        if kind not in self.buckets:
+            return 0
+        start = time.monotonic()
+        with self._cond:
+            ticket = self._enqueue(kind, key)
+            try:
+                while True:
+                    delay = self._grant(kind, key, ticket)
+                    if delay == 0:
+                        break
+                    self._cond.wait(delay)
+            except BaseException:
+                self._cancel(kind, key, ticket)
+                raise
+            finally:
+                self._cond.notify_all()
+            return self._waited(start)
+
+    async def acquire_async(self, kind, key=None):
+        """Coroutine version of acquire"""
+        if kind not in self.buckets:
+            return 0
+        if self._acond is None:
+            self._acond = asyncio.Condition()
+        start = time.monotonic()
+        async with self._acond:
+            ticket = self._enqueue(kind, key)
+            try:
+                while True:
+                    delay = self._grant(kind, key, ticket)
+                    if delay == 0:
+                        break
+                    await self._wait_async(delay)
+            except BaseException:
+                self._cancel(kind, key, ticket)
+                raise
+            finally:
+                self._acond.notify_all()
+            return self._waited(start)
+
+    async def _wait_async(self, delay):
+        """Wait on _acond for at most delay seconds, holding it again on
+        return: wait_for() does not wait for that before Python 3.7"""
+        waiter = asyncio.ensure_future(self._acond.wait())
+        try:
+            await asyncio.wait([waiter], timeout=delay)
+        finally:
+            waiter.cancel()
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                pass
+
+    def set_limits(self, limits):
+        """Change the (rate, burst) of the classes in limits"""
+        for kind, (rate, burst) in limits.items():
+            bucket = self.buckets.get(kind)
+            if bucket is None:
+                continue
+            # Bank the tokens earned at the old rate
+            bucket.delay()
+            bucket.rate = float(rate)
+            bucket.burst = float(burst)
+            bucket.tokens = min(bucket.tokens, bucket.burst)
+
+    def metrics(self):
+        """Current limiter metrics"""
+        return {'waiting': self.waiting, 'delayed': self.delayed,
+                'wait_seconds': round(self.wait_seconds, 3),
+                'max_wait': round(self.max_wait, 3)}
+
+    def _enqueue(self, kind, key):
+        ticket = object()
+        self._queues[kind].setdefault(key, deque()).append(ticket)
+        self.waiting += 1
+        return ticket
+
+    def _grant(self, kind, key, ticket):
+        """Take a token for ticket if it is next in line and one is free
+
+        Returns 0 when granted, the seconds until a token is free when
+        next in line, or None when other vehicles are ahead.
+        """
+        queue = self._queues[kind]
+        if next(iter(queue.values()))[0] is not ticket:
+            return None
+        delay = self.buckets[kind].delay()
+        if delay:
+            return delay
+        self.buckets[kind].take()
+        self._cancel(kind, key, ticket)
+        return 0
+
+    def _cancel(self, kind, key, ticket):
+        """Remove ticket, rotating its vehicle to the back of the line"""
+        queue = self._queues[kind]
+        tickets = queue.get(key)
+        if tickets is None or ticket not in tickets:
+            return
+        tickets.remove(ticket)
+        self.waiting -= 1
+        if tickets:
+            queue.move_to_end(key)
+        else:
+            del queue[key]
+
+    def _waited(self, start):
+        waited = time.monotonic() - start
+        if waited > 0.001:
+            self.delayed += 1
+            self.wait_seconds += waited
+            self.max_wait = max(self.max_wait, waited)
+        return waited
+
+
+class CircuitOpenError(URLError):
+    """Request refused because its circuit breaker is open"""
+
+
+class RetryPolicy(object):
+    """Decides which failed requests are retried and how long to wait
+
+    Backoff is exponential with decorrelated jitter: each sleep is drawn
+    uniformly between base and three times the previous sleep, capped at
+    cap seconds.  A Retry-After header on the failure is used instead
+    when present.  Errors that will not succeed on retry, HTTP 4xx other
+    than 408 and 429 (including 401), fail at once.
+
+    Subclass and override retryable() or delay() to change the policy.
+    """
+
+    # HTTP statuses worth another try
+    RETRY_STATUS = frozenset([408, 429, 500, 502, 503, 504])
+
+    def __init__(self, tries=1, base=1.5, cap=120):
+        self.tries = tries
+        self.base = base
+        self.cap = cap
+
+    def retryable(self, e):
+        """Whether the request failing with e could succeed on retry"""
+        if isinstance(e, CircuitOpenError):
+            return False
+        if isinstance(e, HTTPError):
+            return e.code in self.RETRY_STATUS
+        return True
+
+    def delay(self, e, previous=None):
+        """Seconds to sleep after failure e, previous is the last sleep"""
+        retry_after = self.retry_after(e)
+        if retry_after is not None:
+            return min(self.cap, retry_after)
+        previous = previous or self.base
+        return min(self.cap, random.uniform(self.base, previous * 3))
+
+    @staticmethod
+    def retry_after(e):
+        """Seconds from a Retry-After header on e, or None"""
+        value = getattr(e, 'headers', None) and e.headers.get('Retry-After')
+        if not value:
+            return None
+        if value.strip().isdigit():
+            return float(value)
+        try:
+            when = email.utils.parsedate_to_datetime(value).timestamp()
+        except (TypeError, ValueError, IndexError):
+            return None
+        return max(0.0, when - time.time())
+
+
+class CircuitBreaker(object):
+    """Circuit breakers per vehicle and endpoint class
+
+    After threshold consecutive retryable failures for a (endpoint
+    class, vehicle id) the circuit opens and its requests fail at once
+    with CircuitOpenError for reset_timeout seconds.  Then a single
+    trial request is let through: success closes the circuit, failure
+    opens it again, and a trial ending neither way (e.g. cancelled, an
+    undecodable answer or a client error such as 404) is abandoned,
+    letting another through.
+    """
+
+    def __init__(self, threshold=5, reset_timeout=60):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        # endpoint -> [consecutive failures, time opened or None, trial]
+        self._circuits = {}
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def allow(self, endpoint):
+        """Raise CircuitOpenError unless a request to endpoint may go,
+        True if it goes as the trial"""
+        with self._lock:
+            circuit = self._circuits.get(endpoint)
+            if circuit is None or circuit[1] is None:
+                return False
+            if (time.monotonic() >= circuit[1] + self.reset_timeout and
+                    not circuit[2]):
+                circuit[2] = True  # half open, let one through
+                return True
+            self.rejected += 1
+        raise CircuitOpenError('circuit open for {} {}'.format(*endpoint))
+
+    def abandon(self, endpoint):
+        """The trial request to endpoint ended with no success or failure"""
+        with self._lock:
+            circuit = self._circuits.get(endpoint)
+            if circuit is not None:
+                circuit[2] = False
+
+    def success(self, endpoint):
+        with self._lock:
+            self._circuits.pop(endpoint, None)
+
+    def failure(self, endpoint):
+        with self._lock:
+            circuit = self._circuits.setdefault(endpoint, [0, None, False])
+            circuit[0] += 1
+            if circuit[2] or circuit[0] >= self.threshold:
+                circuit[1] = time.monotonic()
+                circuit[2] = False
+
+    def metrics(self):
+        """Open circuits and the number of requests refused"""
+        with self._lock:
+            opened = ['{} {}'.format(*endpoint)
+                      for endpoint, circuit in self._circuits.items()
+                      if circuit[1] is not None]
+        return {'open': opened, 'rejected': self.rejected}
+
+
+class LatencyHistogram(object):
+    """HDR style latency histogram
+
+    Records durations in microseconds into log-linear buckets: exact
+    below 2**(precision+1)us, above that each power of two is split into
+    2**precision buckets, so any value is kept to within 1/2**precision
+    (about 3% by default) over an unbounded range in little memory.
+    """
+
+    def __init__(self, precision=5):
+        self.precision = precision
+        self.sub = 1 << precision
+        self.counts = {}
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        """Record one duration given in seconds"""
+        value = max(0, int(seconds * 1e6))
+        if value < 2 * self.sub:
+            index = value
+        else:
+            shift = value.bit_length() - self.precision - 1
+            index = shift * self.sub + (value >> shift)
+        with self._lock:
+            self.counts[index] = self.counts.get(index, 0) + 1
+            self.count += 1
+            self.total += seconds
+            if self.min is None or seconds < self.min:
+                self.min = seconds
+            if self.max is None or seconds > self.max:
+                self.max = seconds
+
+    def _value(self, index):
+        """Midpoint in microseconds of a bucket"""
+        if index < 2 * self.sub:
+            return index
+        shift = index // self.sub - 1
+        return ((index - shift * self.sub) << shift) + (1 << shift) / 2
+
+    def percentile(self, percent):
+        """Duration in seconds at percent (0-100) of the recorded values"""
+        with self._lock:
+            if not self.count:
+                return None
+            rank = max(1, percent * self.count / 100.0)
+            seen = 0
+            for index in sorted(self.counts):
+                seen += self.counts[index]
+                if seen >= rank:
+                    return min(max(self._value(index) / 1e6, self.min),
+                               self.max)
+        return self.max
+
+    def snapshot(self):
+        """Summary in milliseconds"""
+        if not self.count:
+            return {'count': 0}
+        summary = {'count': self.count,
+                   'min': round(self.min * 1000, 3),
+                   'mean': round(self.total * 1000 / self.count, 3),
+                   'max': round(self.max * 1000, 3)}
+        for percent in (50, 90, 99, 99.9):
+            summary['p{:g}'.format(percent)] = round(
+                self.percentile(percent) * 1000, 3)
+        return summary
+
+
+class RequestHistograms(object):
+    """Request hook keeping latency histograms per endpoint and phase
+
+    Register with Connection.add_hook(); snapshot() summarizes the total
+    request time and every phase for each endpoint class.
+    """
+
+    def __init__(self, precision=5):
+        self.precision = precision
+        self.histograms = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, info):
+        endpoint = info['endpoint']
+        self._histogram(endpoint, 'total').record(info['total'])
+        for phase, seconds in info['timings'].items():
+            self._histogram(endpoint, phase).record(seconds)
+        if info['error'] is not None:
+            with self._lock:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+
+    def _histogram(self, endpoint, phase):
+        key = (endpoint, phase)
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self.histograms.setdefault(
+                    key, LatencyHistogram(self.precision))
+        return histogram
+
+    def snapshot(self):
+        """{endpoint: {phase: summary, 'errors': count}}"""
+        result = {}
+        for (endpoint, phase), histogram in sorted(
+                self.histograms.items()):
+            result.setdefault(endpoint, {})[phase] = histogram.snapshot()
+        for endpoint, errors in self.errors.items():
+            result.setdefault(endpoint, {})['errors'] = errors
+        return result
+
+
+class WakeEngine(object):
+    """Wakes vehicles without hammering the API
+
+    A wake sends a single wake_up, then checks the vehicle's state after
+    delays growing from initial by factor up to max_delay, giving up
+    after deadline seconds.  Concurrent wakes of the same vehicle share
+    one attempt, and at most max_concurrent vehicles are woken at once.
+    Delays are divided by time_scale, e.g. to match a faster replay.
+    """
+
+    ASLEEP = ('asleep', 'offline', 'inactive')
+
+    def __init__(self, initial=2, factor=1.5, max_delay=30, deadline=180,
+                 max_concurrent=10, time_scale=1.0):
+        self.initial = initial
+        self.factor = factor
+        self.max_delay = max_delay
+        self.deadline = deadline
+        self.max_concurrent = max_concurrent
+        self.time_scale = time_scale
+        self.latency = LatencyHistogram()
+        self.counts = {'requested': 0, 'collapsed': 0, 'awake': 0,
+                       'woken': 0, 'timeouts': 0}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._flights = {}
+        # Created on first use so they belong to the running loop
+        self._aslots = None
+        self._aflights = {}
+
+    def wake(self, vehicle):
+        """Wake vehicle, return its basic data or None if it did not
+        wake by the deadline"""
+        key = vehicle['id']
+        with self._lock:
+            self.counts['requested'] += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = {'done': threading.Event()}
+            else:
+                self.counts['collapsed'] += 1
+        if not leader:
+            flight['done'].wait()
+            if 'error' in flight:
+                raise flight['error']
+            return flight['result']
+
+        try:
+            with self._slots:
+                flight['result'] = self._wake(vehicle)
+        except BaseException as e:
+            flight['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight['done'].set()
+        return flight['result']
+
+    async def wake_async(self, vehicle):
+        """Coroutine version of wake"""
+        key = vehicle['id']
+        with self._lock:
+            self.counts['requested'] += 1
+        task = self._aflights.get(key)
+        if task is not None:
+            with self._lock:
+                self.counts['collapsed'] += 1
+        else:
+            task = asyncio.ensure_future(self._wake_async(vehicle))
+            self._aflights[key] = task
+            task.add_done_callback(lambda t: self._aflights.pop(key, None))
+        return await asyncio.shield(task)
+
+    def _wake(self, vehicle):
+        start = time.monotonic()
+        data = vehicle.data_request(None)
+        if data['state'] not in self.ASLEEP:
+            return self._awake(data)
+        vehicle.wake_up()
+        for delay in self._delays(start):
+            time.sleep(delay)
+            data = vehicle.data_request(None)
+            if data['state'] not in self.ASLEEP:
+                return self._woken(start, data)
+        return self._timed_out()
+
+    async def _wake_async(self, vehicle):
+        if self._aslots is None:
+            self._aslots = asyncio.Semaphore(self.max_concurrent)
+        async with self._aslots:
+            start = time.monotonic()
+            data = await vehicle.data_request(None)
+            if data['state'] not in self.ASLEEP:
+                return self._awake(data)
+            await vehicle.wake_up()
+            for delay in self._delays(start):
+                await asyncio.sleep(delay)
+                data = await vehicle.data_request(None)
+                if data['state'] not in self.ASLEEP:
+                    return self._woken(start, data)
+            return self._timed_out()
+
+    def _delays(self, start):
+        """Waits between state checks until the deadline"""
+        end = start + self.deadline / self.time_scale
+        delay = self.initial
+        while True:
+            wait = min(delay / self.time_scale, end - time.monotonic())
+            if wait <= 0:
+                return
+            yield wait
+            delay = min(delay * self.factor, self.max_delay)
+
+    def _awake(self, data):
+        with self._lock:
+            self.counts['awake'] += 1
+        return data
+
+    def _woken(self, start, data):
+        self.latency.record((time.monotonic() - start) * self.time_scale)
+        with self._lock:
+            self.counts['woken'] += 1
+        return data
+
+    def _timed_out(self):
+        with self._lock:
+            self.counts['timeouts'] += 1
+        return None
+
+    def metrics(self):
+        """Wake counts and the wake latency distribution (ms)"""
+        with self._lock:
+            result = dict(self.counts)
+        result['latency'] = self.latency.snapshot()
+        return result
+
+
+class Cassette(object):
+    """Recorded API requests and responses, for replay without a network
+
+    The file holds one compact json object per request: method, path,
+    response status, reason, content headers, body and how long the
+    request took.  Credentials are never written: request headers and
+    bodies are not recorded and token fields in response bodies are
+    scrubbed.  A filename ending in .gz is gzip compressed.
+
+    Entries are appended as they are recorded.  On replay each (method,
+    path) returns its recorded responses in order, starting over at the
+    first when they run out.
+    """
+
+    # json keys whose values are credentials
+    SCRUB = frozenset(['access_token', 'refresh_token', 'id_token',
+                       'tokens', 'password', 'client_secret'])
+    SCRUBBED = 'scrubbed'
+    # response headers worth keeping
+    HEADERS = ('Content-Type', 'Retry-After')
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.entries = {}
+        self._lock = threading.Lock()
+        self._file = None
+
+    def _open(self, mode):
+        if self.filename.endswith('.gz'):
+            return gzip.open(self.filename, mode + 't', encoding='utf-8')
+        return open(self.filename, mode, encoding='utf-8')
+
+    def load(self):
+        """Read the recorded entries, returns self"""
+        with self._open('r') as R:
+            for line in R:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.entries.setdefault(
+                        (entry['m'], entry['p']), deque()).append(entry)
+        return self
+
+    def record(self, method, path, resp, duration):
+        """Append a response to the cassette file"""
+        entry = {'m': method, 'p': path, 's': resp.status,
+                 'r': resp.reason, 'd': round(duration, 4),
+                 'h': {k: resp.headers[k] for k in self.HEADERS
+                       if resp.headers.get(k) is not None},
+                 'b': self._scrub_body(resp.body)}
+        line = json.dumps(entry, separators=(',', ':')) + '\n'
+        with self._lock:
+            if self._file is None:
+                self._file = self._open('a')
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def play(self, method, path):
+        """Next recorded (_Response, duration) for a request"""
+        with self._lock:
+            entries = self.entries.get((method, path))
+            if not entries:
+                headers = http.client.HTTPMessage()
+                headers['Content-Type'] = 'application/json'
+                return _Response(404, 'Not recorded', headers,
+                                 b'{"response": null, "error": '
+                                 b'"not recorded"}'), 0
+            entry = entries[0]
+            entries.rotate(-1)
+        headers = http.client.HTTPMessage()
+        for k, v in entry['h'].items():
+            headers[k] = v
+        return (_Response(entry['s'], entry['r'], headers,
+                          entry['b'].encode('utf-8')), entry['d'])
+
+    def _scrub_body(self, body):
+        """Body as text with any credentials replaced"""
+        text = body.decode('utf-8', 'replace')
+        try:
+            data = json.loads(text)
+        except ValueError:
+            return text
+        return json.dumps(self._scrub(data), separators=(',', ':'))
+
+    def _scrub(self, data):
+        if isinstance(data, dict):
+            return {k: self.SCRUBBED if k in self.SCRUB else self._scrub(v)
+                    for k, v in data.items()}
+        if isinstance(data, list):
+            return [self._scrub(v) for v in data]
+        return data
+
+
+class RecordingTransport(object):
+    """Transport recording every response from pool into a Cassette"""
+
+    def __init__(self, pool, cassette):
+        self.pool = pool
+        self.cassette = cassette
+
+    def request(self, method, path, body=None, headers={}, timings=None):
+        start = time.perf_counter()
+        resp = self.pool.request(method, path, body, headers, timings)
+        self.cassette.record(method, path, resp, time.perf_counter() - start)
+        return resp
+
+    def close(self):
+        self.pool.close()
+        self.cassette.close()
+
+
+class AsyncRecordingTransport(RecordingTransport):
+    """RecordingTransport for an AsyncConnectionPool"""
+
+    async def request(self, method, path, body=None, headers={},
+                      timings=None):
+        start = time.perf_counter()
+        resp = await self.pool.request(method, path, body, headers, timings)
+        self.cassette.record(method, path, resp, time.perf_counter() - start)
+        return resp
+
+
+class ReplayTransport(object):
+    """Transport answering from a Cassette with no network
+
+    Each response is delayed by its recorded duration divided by speed,
+    so speed=1 reproduces the recorded latency, larger values replay
+    faster and speed=0 replays without any delay.
+    """
+
+    def __init__(self, cassette, speed=1.0):
+        self.cassette = cassette
+        self.speed = speed
+
+    def _play(self, method, path, timings):
+        resp, duration = self.cassette.play(method, path)
+        delay = duration / self.speed if self.speed else 0
+        if timings is not None:
+            timings['server'] = delay
+        return resp, delay
+
+    def request(self, method, path, body=None, headers={}, timings=None):
+        resp, delay = self._play(method, path, timings)
+        if delay:
+            time.sleep(delay)
+        return resp
+
+    def close(self):
+        pass
+
+
+class AsyncReplayTransport(ReplayTransport):
+    """ReplayTransport for an AsyncConnection"""
+
+    async def request(self, method, path, body=None, headers={},
+                      timings=None):
+        resp, delay = self._play(method, path, timings)
+        if delay:
+            await asyncio.sleep(delay)
+        return resp
+
+
+def _atomic_write(filename, text):
+    """Replace filename with text, private to the user, all or nothing"""
+    tmpname = "{}.{:d}.tmp".format(filename, os.getpid())
+    fd = os.open(tmpname, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with open(fd, "w") as W:
+        W.write(text)
+        W.flush()
+        os.fsync(W.fileno())
+    os.replace(tmpname, filename)
+
+
+class _TokenFileLock(object):
+    """Exclusive lock coordinating processes that share a tokenfile
+
+    Uses flock() on tokenfile.lock; a no-op without a tokenfile or on
+    platforms without fcntl.
+    """
+
+    def __init__(self, tokenfile):
+        self.path = tokenfile + '.lock' if tokenfile and fcntl else None
+        self.fd = None
+
+    def acquire(self):
+        if self.path:
+            self.fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+
+    def release(self):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class BaseConnection(object):
+    """Account state shared by the blocking and asyncio connections
+
+    Handles configuration, tokens, request encoding and response
+    decoding; Connection and AsyncConnection supply the I/O.
+    """
 
     __version__ = "1.5.0"
 
+    # Pool and recorder classes used for the transport, set by subclasses
+    pool_class = ConnectionPool
+    recording_class = RecordingTransport
+
     def __init__(self,
                  userid='',
                  password='',
@@ -41,12 +1351,22 @@ class Connection(object):
                  retries=0,
                  retry_delay=1.5,
                  tesla_client=None,
-                 debug=False):
+                 debug=False,
+                 pool_size=None,
+                 timeout=60,
+                 compress=True,
+                 refresh_ahead=3600,
+                 rate_limiter=None,
+                 retry_policy=None,
+                 circuit_breaker=None,
+                 wake_engine=None,
+                 transport=None,
+                 record='',
+                 vehicle_ids=None,
+                 vehicle_cache='',
+                 vehicle_cache_ttl=86400):
         """Initialize connection object
 
-        Sets the vehicles field, a list of Vehicle objects
-        associated with your account
-
         Required parameters:
           Option 1: (will log in and get tokens using credentials)
             userid: your login for teslamotors.com
@@ -66,13 +1386,47 @@ class Connection(object):
         proxy_password: password for proxy server
         retries: Number of times we will retry command on HTTP failure beforing
             failing
-        retry_delay: Time in seconds we will multiplicatively back off after
-            each failure
+        retry_delay: Base time in seconds for the jittered exponential back
+            off after each failure
         debug: Turn on debugging of web traffic to tesla (non-proxy case)
+        pool_size: Maximum number of concurrent (kept alive) connections
+            to the API, size this to the number of threads or tasks making
+            calls.  Defaults to 10 (Connection) or 100 (AsyncConnection)
+        timeout: Socket timeout in seconds for API requests
+        compress: Ask the API for gzip or deflate compressed responses
+        refresh_ahead: Seconds before the token is due for refresh to
+            refresh it in the background, from the first request on, so
+            requests never wait on it.  0 disables the background refresh
+        rate_limiter: RateLimiter to pace requests through, share one
+            between connections to the same account.  None for no limit
+        retry_policy: RetryPolicy deciding what is retried and the back
+            off, replaces retries and retry_delay
+        circuit_breaker: CircuitBreaker shedding requests to a vehicle
+            and endpoint class while they keep failing.  None for none
+        wake_engine: WakeEngine used by Vehicle.wake(), share one between
+            connections to bound concurrent wakes.  Defaults to a new one
+        transport: Object with the request() and close() methods of the
+            pool to use instead of the network, e.g. a ReplayTransport.
+            Tokens it issues are not real, so the tokenfile is then only
+            read, never written
+        record: Cassette file to record all requests and responses into
+        vehicle_ids: Ids of the vehicles to use, skipping the vehicle list
+            request.  Those Vehicles then hold only their id
+        vehicle_cache: File to cache the account's vehicle list in, it is
+            used instead of asking the API while younger than
+            vehicle_cache_ttl seconds
+
+        Token refreshes are single-flight: concurrent callers wait for
+        the one refresh in progress.  Processes sharing a tokenfile
+        serialize refreshes with a lock on tokenfile.lock, and pick up
+        tokens another process has just written instead of making their
+        own OAuth call.
         """
 
-        self.tries = retries + 1
-        self.retry_delay = retry_delay
+        self.retry_policy = retry_policy or RetryPolicy(
+            tries=retries + 1, base=retry_delay)
+        self.circuit_breaker = circuit_breaker
+        self.wake_engine = wake_engine or WakeEngine()
         self.proxy_url = proxy_url
         self.proxy_user = proxy_user
         self.proxy_password = proxy_password
@@ -82,6 +1436,13 @@ class Connection(object):
         self.tokenfile = tokenfile
         self.access_token = access_token
         self.refresh_token = None
+        self.refresh_ahead = refresh_ahead
+        self.rate_limiter = rate_limiter
+        self.vehicle_ids = vehicle_ids
+        self.vehicle_cache = vehicle_cache
+        self.vehicle_cache_ttl = vehicle_cache_ttl
+        self._vehicles = None
+        self.hooks = []
         self.teslaapifile = "teslaapi.conf"
 
         # Obtain URL and program access tokens from pastebin if not on CLI
@@ -110,6 +1471,20 @@ class Connection(object):
         # Prefix for API queries
         self.api = self.current_client['api']
 
+        # Keep-alive connections shared by every request on this account
+        self.offline = transport is not None
+        poolargs = {'maxsize': pool_size} if pool_size else {}
+        self.pool = transport or self.pool_class(self.baseurl[len(prefix):],
+                                    timeout=timeout,
+                                    proxy_url=proxy_url,
+                                    proxy_user=proxy_user,
+                                    proxy_password=proxy_password,
+                                    debuglevel=self.debuglevel,
+                                    compress=compress,
+                                    **poolargs)
+        if record:
+            self.pool = self.recording_class(self.pool, Cassette(record))
+
         if access_token:
             self._sethead(access_token)
         else:
@@ -133,30 +1508,24 @@ class Connection(object):
                       "specified".format(self.tokenfile), file=sys.stderr)
                 raise
 
-        self.vehicles = [Vehicle(v, self) for v in sorted(
-            self.get('vehicles')['response'], key=lambda d: d['id'])]
-
-    def get(self, command):
-        """Utility command to get data from API"""
-        return self.post(command, None)
-
-    def post(self, command, data={}):
-        """Utility command to post data to API"""
-        if time.time() > self.expiration:
-            self._refresh_token()
-        return self.__open("%s%s" % (self.api, command),
-                           headers=self.head, data=data)
+    def close(self):
+        """Close the idle connections in the pool"""
+        self.pool.close()
 
     def _user_agent(self):
         """Set the user agent"""
         if "User-Agent" not in self.head:
+            self.head = dict(self.head)
             self.head["User-Agent"] = 'teslajson.py ' + self.__version__
 
     def _sethead(self, access_token, expiration=float('inf')):
         """Set HTTP header"""
         self.access_token = access_token
         self.expiration = expiration
-        self.head = {"Authorization": "Bearer %s" % access_token}
+        # Replace rather than update, requests in flight on other threads
+        # may be using the old headers
+        self.head = {"Authorization": "Bearer %s" % access_token,
+                     "User-Agent": 'teslajson.py ' + self.__version__}
 
     def _update_tokens(self, tokens=None, stream=None):
         """Update tokens from dict or json stream"""
@@ -170,8 +1539,18 @@ class Connection(object):
 
         self._sethead(self.access_token, expiration=self.expiration)
 
-    def _refresh_token(self):
-        """Refresh tokens using either userid/password or refresh_token"""
+    def _refresh_due(self, ahead=0):
+        """Whether the token needs refreshing within ahead seconds"""
+        return time.time() > self.expiration - ahead
+
+    def _refresh_delay(self):
+        """Seconds until the background refresh is due, rechecked hourly"""
+        return min(max(self.expiration - self.refresh_ahead - time.time(),
+                       0), 3600)
+
+    def _refresh_request(self):
+        """Set up self.oauth for a refresh using refresh_token if we have
+        one, otherwise the userid/password"""
 
         if self.refresh_token:
             self.oauth = {
@@ -180,67 +1559,596 @@ class Connection(object):
                 "client_secret": self.current_client['secret'],
                 "refresh_token": self.refresh_token}
 
-        self.head = {}
-        tokens = self.__open("/oauth/token", data=self.oauth)
+    def _adopt_tokenfile(self, ahead=0):
+        """Use the tokenfile if another process has refreshed it
+
+        Must be called holding the tokenfile lock.  Returns True if the
+        tokens there are newer than ours and not due for refresh.
+        """
+        if not self.tokenfile or not self.refresh_token:
+            return False
+        try:
+            with open(self.tokenfile, "r") as R:
+                tokens = json.load(R)
+            expiration = (tokens["created_at"] + tokens["expires_in"] -
+                          86400)
+        except (IOError, ValueError, KeyError, TypeError):
+            return False
+        if (tokens.get('access_token') == self.access_token or
+                time.time() > expiration - ahead):
+            return False
+        self._update_tokens(tokens=tokens)
+        return True
+
+    def _store_tokens(self, tokens):
+        """Use newly issued tokens and atomically replace the tokenfile"""
         self._update_tokens(tokens=tokens)
-        if self.tokenfile:
-            with open(self.tokenfile, "w") as W:
-                W.write(json.dumps(tokens))
+        if self.tokenfile and not self.offline:
+            _atomic_write(self.tokenfile, json.dumps(tokens))
 
-    def __open(self, url, headers={}, data=None, baseurl=""):
-        """Raw urlopen command"""
+    def _known_vehicles(self):
+        """Vehicle dicts we have without asking the API, or None
 
-        if not baseurl:
-            baseurl = self.baseurl
+        From vehicle_ids if given, otherwise from vehicle_cache if it is
+        no older than vehicle_cache_ttl.
+        """
+        if self.vehicle_ids is not None:
+            return [{'id': int(vid)} for vid in sorted(self.vehicle_ids)]
+        if not self.vehicle_cache:
+            return None
+        try:
+            with open(self.vehicle_cache, "r") as R:
+                cache = json.load(R)
+            if (cache['baseurl'] == self.baseurl and
+                    time.time() - cache['fetched'] < self.vehicle_cache_ttl):
+                return cache['vehicles']
+        except (IOError, ValueError, KeyError, TypeError):
+            pass
+        return None
+
+    def _cache_vehicles(self, vehicles):
+        """Save the vehicle list to vehicle_cache"""
+        if self.vehicle_cache:
+            _atomic_write(self.vehicle_cache, json.dumps({
+                'baseurl': self.baseurl, 'fetched': time.time(),
+                'vehicles': vehicles}))
+
+    def _encode(self, headers, data):
+        """Return method, body and headers for a request with data
+
+        URLEncode any data, no data at all means this is a GET
+        """
         self._user_agent()
+        if data is None:
+            return 'GET', None, headers
+        headers = dict(headers)
+        headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        return 'POST', urlencode(data).encode('utf-8'), headers
+
+    def _check(self, url, resp):
+        """Raise HTTPError for an HTTP error status"""
+        if resp.status >= 400:
+            raise HTTPError("{}{}".format(self.baseurl, url),
+                            resp.status, resp.reason, resp.headers,
+                            io.BytesIO(resp.body))
+
+    def add_hook(self, hook):
+        """Call hook(info) after every request
+
+        info is a dict with the endpoint class, vehicle_id, url, method,
+        status (None if no response), bytes of response body, retries,
+        error (the exception raised or None), total seconds and timings,
+        a dict of seconds spent in each phase of the last try: limiter
+        (waiting on the rate limiter, all tries), dns, connect and tls
+        (only when a new connection was opened), send, server (waiting
+        for the response), body and decode.  Hooks run on the calling
+        thread or task and should be quick.
+        """
+        self.hooks.append(hook)
+
+    def remove_hook(self, hook):
+        self.hooks.remove(hook)
+
+    def _request_info(self, url, method, endpoint):
+        """Start the info dict passed to the request hooks"""
+        endpoint, vid = endpoint or ('oauth', None)
+        return {'endpoint': endpoint, 'vehicle_id': vid, 'url': url,
+                'method': method, 'status': None, 'bytes': 0,
+                'retries': 0, 'error': None, 'timings': {},
+                'start': time.perf_counter()}
+
+    @staticmethod
+    def _tried(info, count, resp=None):
+        """Note the outcome of a try in the request info"""
+        info['retries'] = count
+        if resp is not None:
+            info['status'] = resp.status
+            info['bytes'] = (len(resp.body) if resp.wire is None
+                             else resp.wire)
+
+    @staticmethod
+    def _limited(info, waited):
+        """Add time waiting on the rate limiter to the request info"""
+        timings = info['timings']
+        timings['limiter'] = timings.get('limiter', 0) + waited
+
+    def _emit(self, info):
+        """Call the request hooks"""
+        info['total'] = time.perf_counter() - info.pop('start')
+        for hook in self.hooks:
+            try:
+                hook(info)
+            except Exception as e:
+                print('# {:.0f} Request hook {} failed: {}'.format(
+                    time.time(), hook, e), file=sys.stderr)
+
+    def _allow(self, endpoint):
+        """Check the circuit breaker for endpoint (class, vehicle id),
+        True if the request is its trial"""
+        if endpoint and self.circuit_breaker:
+            return self.circuit_breaker.allow(endpoint)
+        return False
+
+    def _abandoned(self, endpoint, trial):
+        if trial:
+            self.circuit_breaker.abandon(endpoint)
+
+    def _succeeded(self, endpoint):
+        if endpoint and self.circuit_breaker:
+            self.circuit_breaker.success(endpoint)
+
+    def _failed(self, url, count, e, previous, endpoint, trial=False):
+        """Record failed try number count, previous is the last sleep
+
+        Returns the exception to raise and, if it should be retried, the
+        time to sleep before trying again (otherwise None)
+        """
+        if not isinstance(e, (HTTPError, URLError)):
+            e = URLError(e)
+        policy = self.retry_policy
+        retryable = policy.retryable(e)
+        if endpoint and self.circuit_breaker:
+            # Only failures that say the upstream is unhealthy count, the
+            # rest (e.g. 404) say nothing about it either way
+            if retryable:
+                self.circuit_breaker.failure(endpoint)
+            else:
+                self._abandoned(endpoint, trial)
+        if self.debug:
+            print('# {:.0f} Timed out or other error for {}: {}\n'
+                  .format(time.time(), url, str(e)))
+        if not retryable or count + 1 >= policy.tries:
+            return e, None
+        return e, policy.delay(e, previous)
+
+    @staticmethod
+    def _decode(resp, timings=None):
+        """Decode the json body of a response"""
+        start = time.perf_counter()
+        charset = resp.headers.get_content_charset('utf-8')
+        if charset.lower() in ('utf-8', 'utf8'):
+            result = _json_loads(resp.body)
+        else:
+            result = _json_loads(resp.body.decode(charset))
+        if timings is not None:
+            timings['decode'] = time.perf_counter() - start
+        return result
+
+    @staticmethod
+    def _sorted_vehicles(result):
+        return sorted(result['response'], key=lambda d: d['id'])
+
+    def _fetch_workers(self, vehicles, max_workers):
+        """Workers for fetch_all, by default as many as the pool allows"""
+        return max(1, min(len(vehicles), max_workers or
+                          getattr(self.pool, 'maxsize', 10)))
+
+    @staticmethod
+    def _fetch(vehicle, what):
+        """Call for fetch_all: 'all' is data_all, a name (or None) is
+        data_request, a list of names data_select, or what(vehicle) if
+        callable"""
+        if callable(what):
+            return what(vehicle)
+        if what == 'all':
+            return vehicle.data_all()
+        if isinstance(what, (list, tuple)):
+            return vehicle.data_select(what)
+        return vehicle.data_request(what)
+
+
+class Connection(BaseConnection):
+    """Connection to Tesla Motors API"""
+
+    def __init__(self, *args, **kwargs):
+        """Initialize connection object, see BaseConnection for arguments
+
+        No requests are made until needed: the vehicles field, a list of
+        Vehicle objects associated with your account, is loaded on first
+        use.
+        """
+        super(Connection, self).__init__(*args, **kwargs)
+
+        self._refresh_lock = threading.Lock()
+        self._closed = threading.Event()
+        # Started by the first request, none for connections never used
+        self._refresher = None
+
+    @property
+    def vehicles(self):
+        """Vehicles on the account, loaded on first use"""
+        if self._vehicles is None:
+            self.load_vehicles()
+        return self._vehicles
+
+    @vehicles.setter
+    def vehicles(self, vehicles):
+        self._vehicles = vehicles
+
+    def load_vehicles(self, refresh=False):
+        """Set the vehicles field, a list of Vehicle objects
 
-        last_except = Exception
-        for count in range(self.tries):
+        Uses vehicle_ids or a fresh vehicle_cache unless refresh is set.
+        """
+        data = None if refresh else self._known_vehicles()
+        if data is None:
+            data = self._sorted_vehicles(self.get('vehicles'))
+            self._cache_vehicles(data)
+        self._vehicles = [Vehicle(v, self) for v in data]
+        return self._vehicles
+
+    def close(self):
+        """Stop the background refresh and close idle connections"""
+        self._closed.set()
+        super(Connection, self).close()
+
+    def fetch_all(self, vehicles=None, what='all', max_workers=None):
+        """Fetch data for many vehicles concurrently
+
+        Runs data_all ('all'), data_request(what), data_select(what) if
+        what is a list, or what(vehicle) if callable, for each of vehicles
+        (default all of them) on at most max_workers threads (default the
+        pool size).  Yields a FetchResult for each
+        vehicle as it completes; a failure is returned in its error
+        rather than raised.
+        """
+        vehicles = self.vehicles if vehicles is None else list(vehicles)
+        if not vehicles:
+            return
+        executor = ThreadPoolExecutor(
+            self._fetch_workers(vehicles, max_workers),
+            thread_name_prefix='teslajson-fetch')
+        futures = {}
+        try:
+            futures = {executor.submit(self._fetch, vehicle, what): vehicle
+                       for vehicle in vehicles}
+            for future in as_completed(futures):
+                try:
+                    yield FetchResult(futures[future], future.result(), None)
+                except Exception as e:
+                    yield FetchResult(futures[future], None, e)
+        finally:
+            # Abandoned early, drop what has not started
+            for future in futures:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def get(self, command):
+        """Utility command to get data from API"""
+        return self.post(command, None)
+
+    def post(self, command, data={}):
+        """Utility command to post data to API"""
+        if time.time() > self.expiration:
+            self._refresh_token()
+        if (self._refresher is None and self.refresh_ahead and
+                self.expiration != float('inf')):
+            self._start_refresh()
+        return self.__open("%s%s" % (self.api, command),
+                           headers=self.head, data=data,
+                           endpoint=_endpoint(command))
+
+    def _refresh_token(self, ahead=0):
+        """Refresh tokens using either userid/password or refresh_token
+
+        Only one thread refreshes, the rest wait for it and then find
+        the token is no longer due.
+        """
+
+        with self._refresh_lock:
+            if not self._refresh_due(ahead):
+                return
+            with _TokenFileLock(self.tokenfile):
+                if self._adopt_tokenfile(ahead):
+                    return
+                self._refresh_request()
+                self._store_tokens(self.__open("/oauth/token",
+                                               data=self.oauth))
+
+    def _start_refresh(self):
+        with self._refresh_lock:
+            if self._refresher is not None or self._closed.is_set():
+                return
+            self._refresher = threading.Thread(
+                target=self._background_refresh, daemon=True,
+                name='teslajson-refresh')
+            self._refresher.start()
+
+    def _background_refresh(self):
+        """Thread refreshing the token refresh_ahead seconds early"""
+        while not self._closed.wait(self._refresh_delay()):
             try:
-                req = Request("{}{}".format(baseurl, url), headers=headers)
+                self._refresh_token(ahead=self.refresh_ahead)
+            except Exception as e:
+                if self.debug:
+                    print('# {:.0f} Background token refresh failed: {}\n'
+                          .format(time.time(), str(e)))
+                self._closed.wait(60)
+
+    def __open(self, url, headers={}, data=None, endpoint=None):
+        """Issue request over the connection pool, retrying on failure
 
-                # URLEncode any data
+        endpoint is the (class, vehicle id) used for rate limiting and
+        circuit breaking.  The request hooks are called once it has
+        succeeded or finally failed.
+        """
+
+        method, body, headers = self._encode(headers, data)
+        if not self.hooks:
+            return self.__request(url, method, body, headers, endpoint)
+        info = self._request_info(url, method, endpoint)
+        try:
+            return self.__request(url, method, body, headers, endpoint,
+                                  info)
+        except Exception as e:
+            info['error'] = e
+            raise
+        finally:
+            self._emit(info)
+
+    def __request(self, url, method, body, headers, endpoint, info=None):
+        """The retry loop of __open, recording into info if given"""
+        timings = None if info is None else info['timings']
+        count, delay = 0, None
+        while True:
+            trial = self._allow(endpoint)
+            resp = None
+            try:
+                if endpoint and self.rate_limiter:
+                    waited = self.rate_limiter.acquire(*endpoint)
+                    if info is not None:
+                        self._limited(info, waited)
+                resp = self.pool.request(method, url, body, headers,
+                                         timings)
+                self._check(url, resp)
+                result = self._decode(resp, timings)
+                self._succeeded(endpoint)
+                return result
+            except (OSError, http.client.HTTPException) as e:
+                last_except, delay = self._failed(url, count, e, delay,
+                                                  endpoint, trial)
+            except BaseException:
+                # Interrupted or an undecodable answer
+                self._abandoned(endpoint, trial)
+                raise
+            finally:
+                if info is not None:
+                    self._tried(info, count, resp)
+            if delay is None:
+                raise last_except
+            time.sleep(delay)
+            count += 1
+
+
+class AsyncConnection(BaseConnection):
+    """asyncio connection to Tesla Motors API
+
+    Takes the same arguments as Connection.  The constructor does no I/O,
+    so unless vehicle_ids or a fresh vehicle_cache supply them, the
+    vehicles field is only set once load_vehicles() is awaited;
+    AsyncConnection.create() does both.  Requests from any number of
+    tasks share the keep-alive pool.
+    """
+
+    pool_class = AsyncConnectionPool
+    recording_class = AsyncRecordingTransport
+
+    def __init__(self, *args, **kwargs):
+        """Initialize connection object, see BaseConnection for arguments"""
+        super(AsyncConnection, self).__init__(*args, **kwargs)
+        # Created on first use so they belong to the running loop
+        self._refresh_lock = None
+        self._refresher = None
+
+    @classmethod
+    async def create(cls, *args, **kwargs):
+        """Create a connection and load its vehicles"""
+        self = cls(*args, **kwargs)
+        await self.load_vehicles()
+        return self
+
+    @property
+    def vehicles(self):
+        """Vehicles on the account, from load_vehicles() or the cache"""
+        if self._vehicles is None:
+            data = self._known_vehicles()
+            if data is None:
+                raise AttributeError('vehicles not loaded, await '
+                                     'load_vehicles() first')
+            self._vehicles = [AsyncVehicle(v, self) for v in data]
+        return self._vehicles
+
+    @vehicles.setter
+    def vehicles(self, vehicles):
+        self._vehicles = vehicles
+
+    async def load_vehicles(self, refresh=False):
+        """Set the vehicles field, a list of AsyncVehicle objects
+
+        Uses vehicle_ids or a fresh vehicle_cache unless refresh is set.
+        """
+        data = None if refresh else self._known_vehicles()
+        if data is None:
+            data = self._sorted_vehicles(await self.get('vehicles'))
+            self._cache_vehicles(data)
+        self._vehicles = [AsyncVehicle(v, self) for v in data]
+        return self._vehicles
+
+    async def fetch_all(self, vehicles=None, what='all', max_workers=None):
+        """Fetch data for many vehicles concurrently
+
+        Async generator version of Connection.fetch_all, running at most
+        max_workers (default the pool size) requests at once.
+        """
+        vehicles = self.vehicles if vehicles is None else list(vehicles)
+        if not vehicles:
+            return
+        slots = asyncio.Semaphore(self._fetch_workers(vehicles, max_workers))
+
+        async def fetch(vehicle):
+            async with slots:
                 try:
-                    req.data = urlencode(data).encode('utf-8')
-                except Exception:
-                    pass
-
-                # Proxy support
-                if self.proxy_url:
-                    if self.proxy_user:
-                        # ProxyHandler expects a dictionary of proxy mappings
-                        proxy = ProxyHandler({
-                            'https': 'https://{}:{}@{}'.format(
-                                self.proxy_user,
-                                self.proxy_password,
-                                self.proxy_url)})
-                        auth = HTTPBasicAuthHandler()
-                        opener = build_opener(proxy, auth, HTTPHandler)
-                    else:
-                        handler = ProxyHandler({'https': self.proxy_url})
-                        opener = build_opener(handler)
-                else:
-                    opener = build_opener(
-                        HTTPSHandler(debuglevel=self.debuglevel))
-
-                resp = opener.open(req)
-                charset = resp.info().get('charset', 'utf-8')
-                break
-            except (HTTPError, URLError) as e:
-                last_except = e
+                    return FetchResult(vehicle,
+                                       await self._fetch(vehicle, what),
+                                       None)
+                except Exception as e:
+                    return FetchResult(vehicle, None, e)
+
+        tasks = [asyncio.ensure_future(fetch(vehicle))
+                 for vehicle in vehicles]
+        try:
+            for task in asyncio.as_completed(tasks):
+                yield await task
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def get(self, command):
+        """Utility command to get data from API"""
+        return await self.post(command, None)
+
+    async def post(self, command, data={}):
+        """Utility command to post data to API"""
+        if time.time() > self.expiration:
+            await self._refresh_token()
+        if (self._refresher is None and self.refresh_ahead and
+                self.expiration != float('inf')):
+            self._refresher = asyncio.ensure_future(
+                self._background_refresh())
+        return await self._open("%s%s" % (self.api, command),
+                                headers=self.head, data=data,
+                                endpoint=_endpoint(command))
+
+    def close(self):
+        """Stop the background refresh and close idle connections"""
+        if self._refresher is not None:
+            self._refresher.cancel()
+        super(AsyncConnection, self).close()
+
+    async def _refresh_token(self, ahead=0):
+        """Refresh tokens using either userid/password or refresh_token
+
+        Only one task refreshes, the rest wait for it and then find
+        the token is no longer due.
+        """
+
+        if self._refresh_lock is None:
+            self._refresh_lock = asyncio.Lock()
+        async with self._refresh_lock:
+            if not self._refresh_due(ahead):
+                return
+            lock = _TokenFileLock(self.tokenfile)
+            # flock() blocks, so wait for other processes off the loop
+            acquired = asyncio.get_event_loop().run_in_executor(
+                None, lock.acquire)
+            try:
+                await asyncio.shield(acquired)
+            except asyncio.CancelledError:
+                # The thread still takes the lock, give it back then
+                acquired.add_done_callback(lambda future: lock.release())
+                raise
+            try:
+                if self._adopt_tokenfile(ahead):
+                    return
+                self._refresh_request()
+                self._store_tokens(await self._open("/oauth/token",
+                                                    data=self.oauth))
+            finally:
+                lock.release()
+
+    async def _background_refresh(self):
+        """Task refreshing the token refresh_ahead seconds early"""
+        while True:
+            await asyncio.sleep(self._refresh_delay())
+            try:
+                await self._refresh_token(ahead=self.refresh_ahead)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
                 if self.debug:
-                    print('# {0:d} Timed out or other error'
-                          'for {}: {}\n'.format(time.time(), type, str(e)))
-                count += 1
-                if count != self.tries:
-                    time.sleep(count * self.retry_delay)
-        else:
-            raise last_except
+                    print('# {:.0f} Background token refresh failed: {}\n'
+                          .format(time.time(), str(e)))
+                await asyncio.sleep(60)
 
-        return json.loads(resp.read().decode(charset))
+    async def _open(self, url, headers={}, data=None, endpoint=None):
+        """Issue request over the connection pool, retrying on failure
+
+        endpoint is the (class, vehicle id) used for rate limiting and
+        circuit breaking.  The request hooks are called once it has
+        succeeded or finally failed.
+        """
+
+        method, body, headers = self._encode(headers, data)
+        if not self.hooks:
+            return await self._request(url, method, body, headers, endpoint)
+        info = self._request_info(url, method, endpoint)
+        try:
+            return await self._request(url, method, body, headers, endpoint,
+                                       info)
+        except Exception as e:
+            info['error'] = e
+            raise
+        finally:
+            self._emit(info)
+
+    async def _request(self, url, method, body, headers, endpoint,
+                       info=None):
+        """The retry loop of _open, recording into info if given"""
+        timings = None if info is None else info['timings']
+        count, delay = 0, None
+        while True:
+            trial = self._allow(endpoint)
+            resp = None
+            try:
+                if endpoint and self.rate_limiter:
+                    waited = await self.rate_limiter.acquire_async(
+                        *endpoint)
+                    if info is not None:
+                        self._limited(info, waited)
+                resp = await self.pool.request(method, url, body, headers,
+                                               timings)
+                self._check(url, resp)
+                result = self._decode(resp, timings)
+                self._succeeded(endpoint)
+                return result
+            except (OSError, EOFError, asyncio.TimeoutError,
+                    http.client.HTTPException) as e:
+                last_except, delay = self._failed(url, count, e, delay,
+                                                  endpoint, trial)
+            except BaseException:
+                # Cancelled or an undecodable answer
+                self._abandoned(endpoint, trial)
+                raise
+            finally:
+                if info is not None:
+                    self._tried(info, count, resp)
+            if delay is None:
+                raise last_except
+            await asyncio.sleep(delay)
+            count += 1
 
 
-class Vehicle(dict):
+class BaseVehicle(dict):
     """Vehicle class, subclassed from dictionary.
 
     There are 3 primary methods: wake_up, data/data_request and
@@ -248,6 +2156,7 @@ class Vehicle(dict):
     the data or command, respectively.  data gets everything. These
     names can be found in the Tesla JSON API.
 
+    Vehicle issues these as blocking calls, AsyncVehicle as coroutines.
     """
 
     def __init__(self, data, connection):
@@ -255,8 +2164,53 @@ class Vehicle(dict):
 
         Called automatically by the Connection class
         """
-        super(Vehicle, self).__init__(data)
+        super(BaseVehicle, self).__init__(data)
         self.connection = connection
+        self._static = {}
+
+    def _path(self, command):
+        """API path for a command on this vehicle"""
+        if command:
+            return 'vehicles/{:d}/{}'.format(self['id'], command)
+        return 'vehicles/{:d}'.format(self['id'])
+
+    @staticmethod
+    def _data_command(name):
+        """Command to fetch the named data, or basic data if no name"""
+        return 'data_request/{}'.format(name) if name else name
+
+    # Sub-states of vehicle_data which rarely change, and the seconds a
+    # cached copy is used before asking for them again
+    STATIC_ENDPOINTS = ('vehicle_config', 'gui_settings')
+    static_ttl = 86400
+
+    def _select_command(self, endpoints):
+        """vehicle_data command for endpoints, leaving out static ones
+        with a fresh cached copy (basic data if that leaves none)"""
+        now = time.time()
+        cache = self._static
+        wanted = [e for e in endpoints if e not in cache or
+                  cache[e][0] + self.static_ttl <= now]
+        if not wanted:
+            return None
+        return 'vehicle_data?endpoints={}'.format(quote(';'.join(wanted)))
+
+    def _select_merge(self, endpoints, data):
+        """Cache static sections in data and merge requested cached ones"""
+        cache = self._static
+        now = time.time()
+        for e in endpoints:
+            if e not in self.STATIC_ENDPOINTS:
+                continue
+            if e in data:
+                cache[e] = (now, data[e])
+            elif e in cache:
+                data[e] = cache[e][1]
+        return data
+
+
+class Vehicle(BaseVehicle):
+    """Vehicle on a (blocking) Connection"""
 
     def data_all(self):
         """Get all vehicle data"""
@@ -265,33 +2219,86 @@ class Vehicle(dict):
 
     def data_request(self, name):
         """Get vehicle data"""
-        if name:
-            result = self.get('data_request/%s'.format(name))
-        else:
-            result = self.get(name)
-        return result['response']
+        return self.get(self._data_command(name))['response']
+
+    def data_select(self, endpoints):
+        """Get only the named sub-states of the vehicle data
+
+        Static sub-states (STATIC_ENDPOINTS) come from a per-vehicle cache
+        while it is fresh.
+        """
+        result = self.get(self._select_command(endpoints))
+        return self._select_merge(endpoints, result['response'])
 
     def wake_up(self):
         """Wake the vehicle"""
         return self.post('wake_up')
 
+    def wake(self):
+        """Wake the vehicle and wait for it to come online
+
+        Returns the basic vehicle data, None if it did not wake in time.
+        See WakeEngine.
+        """
+        return self.connection.wake_engine.wake(self)
+
     def command(self, name, data={}):
         """Run the command for the vehicle"""
         return self.post('command/{}'.format(name), data)
 
     def get(self, command):
         """Utility command to get data from API"""
-        if command:
-            return self.connection.get(
-                'vehicles/{:d}/{}'.format(self['id'], command))
-        else:
-            return self.connection.get(
-                'vehicles/{:d}'.format(self['id']))
+        return self.connection.get(self._path(command))
 
     def post(self, command, data={}):
         """Utility command to post data to API"""
-        return self.connection.post(
-            'vehicles/{:d}/{}'.format(self['id'], command), data)
+        return self.connection.post(self._path(command), data)
+
+
+class AsyncVehicle(BaseVehicle):
+    """Vehicle on an AsyncConnection, all requests are coroutines"""
+
+    async def data_all(self):
+        """Get all vehicle data"""
+        result = await self.get('data')
+        return result['response']
+
+    async def data_request(self, name):
+        """Get vehicle data"""
+        return (await self.get(self._data_command(name)))['response']
+
+    async def data_select(self, endpoints):
+        """Get only the named sub-states of the vehicle data
+
+        Static sub-states (STATIC_ENDPOINTS) come from a per-vehicle cache
+        while it is fresh.
+        """
+        result = await self.get(self._select_command(endpoints))
+        return self._select_merge(endpoints, result['response'])
+
+    async def wake_up(self):
+        """Wake the vehicle"""
+        return await self.post('wake_up')
+
+    async def wake(self):
+        """Wake the vehicle and wait for it to come online
+
+        Returns the basic vehicle data, None if it did not wake in time.
+        See WakeEngine.
+        """
+        return await self.connection.wake_engine.wake_async(self)
+
+    async def command(self, name, data={}):
+        """Run the command for the vehicle"""
+        return await self.post('command/{}'.format(name), data)
+
+    async def get(self, command):
+        """Utility command to get data from API"""
+        return await self.connection.get(self._path(command))
+
+    async def post(self, command, data={}):
+        """Utility command to post data to API"""
+        return await self.connection.post(self._path(command), data)
 
 
 def main():
@@ -302,6 +2309,7 @@ def main():
 vehicles	# Get vehicle information (default command)
 get		# Get basic car data
 get data	# Get all data
+get charge_state,drive_state	# Get only some data
     charge_state, climate_state, drive_state, gui_settings, vehicle_state, mobile_enabled
 do wake_up, honk_horn, flash_lights, remote_state_drive ...
 do speed_limit_set_limit limit_mph=65
@@ -324,11 +2332,24 @@ do speed_limit_set_limit limit_mph=65
     parser.add_argument('--retries', default=0, type=int,
                         help='Number of retries on failure')
     parser.add_argument('--retry_delay', default=1.5, type=float,
-                        help='Multiplicative backup on failure')
+                        help='Base of the jittered exponential backoff on '
+                        'failure')
     parser.add_argument('--tesla_client', default=None,
                         help='Override API location')
     parser.add_argument('--debug', default=False,
                         action='store_true', help='Example debugging')
+    parser.add_argument('--record', default=None,
+                        help='Record requests and responses to cassette file')
+    parser.add_argument('--replay', default=None,
+                        help='Replay responses from cassette file instead '
+                        'of using the network')
+    parser.add_argument('--replay_speed', default=0, type=float,
+                        help='Speed up recorded latency, 1 is as recorded, '
+                        '0 (default) is no delay')
+    parser.add_argument('--vehicle_cache', default=None,
+                        help='File caching the vehicle list between runs')
+    parser.add_argument('--vehicle_cache_ttl', default=86400, type=int,
+                        help='Seconds the vehicle cache stays fresh')
     parser.add_argument('--vid', default=None, help='Vehicle to operate on')
     parser.add_argument('command', default='vehicles', nargs='?',
                         help='Command for program (get, do)')
@@ -352,6 +2373,14 @@ do speed_limit_set_limit limit_mph=65
         except Exception as err:
             print('ERROR', err)
 
+    # Replaying needs no real credentials
+    transport = None
+    if args.replay:
+        transport = ReplayTransport(Cassette(args.replay).load(),
+                                    speed=args.replay_speed)
+        if not (args.userid or args.tokenfile or args.token):
+            args.token = Cassette.SCRUBBED
+
     if not args.command:
         args.command = "vehicles"
 
@@ -366,6 +2395,10 @@ do speed_limit_set_limit limit_mph=65
                    proxy_password=args.proxy_password,
                    retries=args.retries,
                    retry_delay=args.retry_delay,
+                   transport=transport,
+                   record=args.record,
+                   vehicle_cache=args.vehicle_cache,
+                   vehicle_cache_ttl=args.vehicle_cache_ttl,
                    debug=args.debug)
 
     if args.vid is not None:
@@ -373,31 +2406,50 @@ do speed_limit_set_limit limit_mph=65
             vnum = int(args.vid)
             c.vehicles = [c.vehicles[vnum]]
         except Exception as err:
-            c.vehicles = filter(lambda v: v['id'] == args.vid, c.vehicles)
+            c.vehicles = [v for v in c.vehicles
+                          if str(v['id']) == args.vid]
 
     if len(c.vehicles) < 1:
         raise ValueError('Invalid vehicle number or id')
 
-    for v in c.vehicles:
-        if args.command == "vehicles":
+    if args.command == "vehicles":
+        for v in c.vehicles:
             print(v["id"])
-        elif args.command == "get":
-            if not args.args:
-                print(str(v.data_request(None)))
-            elif (args.args[0] == "data" or args.args[0] == "vehicle_data" or
-                  args.args[0] == "mobile_enabled"):
-                print(str(v.get(args.args[0])))
+    elif args.command == "get":
+        # Fetch from every vehicle at once, printing as each arrives
+        if not args.args:
+            what = None
+        elif (args.args[0] == "data" or args.args[0] == "vehicle_data" or
+              args.args[0] == "mobile_enabled"):
+            what = lambda v: v.get(args.args[0])
+        elif ',' in args.args[0]:
+            what = args.args[0].split(',')
+        else:
+            what = args.args[0]
+        failed = False
+        for result in c.fetch_all(c.vehicles, what):
+            if result.error is not None:
+                failed = True
+                print('ERROR: vehicle {}: {}'.format(result.vehicle['id'],
+                                                     result.error),
+                      file=sys.stderr)
             else:
-                print(str(v.data_request(args.args[0])))
-        elif args.command == "do":
+                print(str(result.data))
+        if failed:
+            c.close()
+            sys.exit(1)
+    elif args.command == "do":
+        for v in c.vehicles:
             command = args.args[0]
             data = dict([kv.split('=', 1) for kv in args.args[1:]])
             if command == "wake_up":
                 print(str(v.wake_up()))
             else:
                 print(str(v.command(command, data)))
-        else:
-            raise ValueError("Unknown command %s" % args.command)
+    else:
+        raise ValueError("Unknown command %s" % args.command)
+
+    c.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,79 @@
+"""AdaptiveIntervals learning when vehicles become active"""
+
+import time
+import unittest
+
+from tesla_pollerlib import AdaptiveIntervals, VehicleState
+
+INTERVALS = {'inactive': 300, 'to_sleep': 150, 'running': 30,
+             'charging': 90, 'recent': 60}
+WEEK = 7 * 86400
+# A Monday 08:00 local time, with no clock changes in the weeks after
+MONDAY = time.mktime((2026, 5, 4, 8, 0, 0, 0, 0, -1))
+
+
+class AdaptiveIntervalsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.adaptive = AdaptiveIntervals(INTERVALS, max_latency=900,
+                                          tighten=0.5)
+        self.vs = VehicleState({'id': 1})
+
+    def polls(self, weeks, active):
+        """Poll the vehicle every 5 minutes of Monday 08:00-09:00 for
+        weeks, active(n) saying whether it became active at poll n"""
+        n = 0
+        for week in range(weeks):
+            self.vs.last_poll = None
+            for t in range(0, 3600, 300):
+                ourstate = 'running' if active(n) else 'inactive'
+                self.adaptive.observe(self.vs, 'inactive', ourstate,
+                                      MONDAY + week * WEEK + t)
+                n += 1
+
+    def test_static_without_history(self):
+        for ourstate, interval in INTERVALS.items():
+            self.assertEqual(self.adaptive.interval(self.vs, ourstate,
+                                                    MONDAY), interval)
+        # The first poll has nothing to learn from
+        self.adaptive.observe(self.vs, 'inactive', 'running', MONDAY)
+        self.assertIsNone(self.vs.profile)
+        self.assertEqual(self.vs.last_poll, MONDAY)
+
+    def test_quiet_hours_poll_less(self):
+        self.polls(4, lambda n: False)
+        self.assertEqual(self.adaptive.interval(self.vs, 'inactive',
+                                                MONDAY + 1800), 900)
+        # Other states and hours far off are left alone
+        self.assertEqual(self.adaptive.interval(self.vs, 'running',
+                                                MONDAY + 1800), 30)
+        self.assertEqual(self.adaptive.interval(self.vs, 'inactive',
+                                                MONDAY + 6 * 3600), 300)
+
+    def test_busy_hours_poll_more(self):
+        self.polls(4, lambda n: n % 2 == 0)
+        self.assertEqual(self.adaptive.interval(self.vs, 'inactive',
+                                                MONDAY + 1800), 150)
+        self.assertEqual(self.adaptive.interval(self.vs, 'to_sleep',
+                                                MONDAY + 1800), 75)
+
+    def test_polls_while_active_are_not_counted(self):
+        self.polls(1, lambda n: False)
+        profile = list(self.vs.profile)
+        self.adaptive.observe(self.vs, 'running', 'running', MONDAY + 3000)
+        self.assertEqual(list(self.vs.profile), profile)
+
+    def test_old_habits_are_forgotten(self):
+        self.adaptive = AdaptiveIntervals(INTERVALS, window_hours=1)
+        self.polls(12, lambda n: n < 24)
+        hour = self.adaptive._hour(MONDAY)
+        idle = self.vs.profile[self.adaptive.HOURS + hour]
+        self.assertLessEqual(idle, self.adaptive.window)
+        # The early starts halved since, back to polling less
+        self.assertLess(self.vs.profile[hour], 24 / 2)
+        self.assertGreater(self.adaptive.interval(self.vs, 'inactive',
+                                                  MONDAY + 1800), 300)
+
+
+if __name__ == '__main__':
+    unittest.main()
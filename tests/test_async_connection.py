@@ -0,0 +1,167 @@
+"""AsyncConnection and its keep-alive pool against a local server"""
+
+import asyncio
+import gzip
+import json
+import unittest
+
+import teslajson
+from tesla_pollerlib import current_task
+
+CLIENT = {'v1': {'id': 'id', 'secret': 'secret', 'api': '/api/1/',
+                 'baseurl': 'https://owner-api.teslamotors.com'}}
+VEHICLES = {'response': [{'id': 2, 'vin': 'B'}, {'id': 1, 'vin': 'A'}]}
+
+
+class PlainConnection(teslajson._AsyncHTTPSConnection):
+    """The pool's connection without TLS, for a local server"""
+
+    async def connect(self, timings=None):
+        self.reader, self.writer = await asyncio.open_connection(
+            *teslajson._split_hostport(self.pool.host))
+
+
+class PlainPool(teslajson.AsyncConnectionPool):
+
+    def _new_connection(self):
+        self.connections_made += 1
+        return PlainConnection(self)
+
+
+class Server(object):
+    """HTTP/1.1 server answering each path its own way, keeping the
+    requests it got"""
+
+    def __init__(self):
+        self.requests = []
+        self.server = None
+        self.handlers = []
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.serve, '127.0.0.1', 0)
+        return '127.0.0.1:{}'.format(self.server.sockets[0].getsockname()[1])
+
+    async def stop(self):
+        """Stop, once the clients have closed their connections"""
+        self.server.close()
+        await self.server.wait_closed()
+        if self.handlers:
+            await asyncio.wait(self.handlers)
+
+    async def serve(self, reader, writer):
+        self.handlers.append(current_task())
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                lines = head.decode('latin-1').split('\r\n')
+                method, path, version = lines[0].split()
+                headers = dict(line.split(': ', 1) for line in lines[1:]
+                               if line)
+                body = await reader.readexactly(
+                    int(headers.get('Content-Length', 0)))
+                self.requests.append((method, path, headers, body))
+                writer.write(self.answer(method, path, body))
+                await writer.drain()
+                if path.endswith('/close'):
+                    break
+        except asyncio.IncompleteReadError:
+            pass
+        writer.close()
+
+    def answer(self, method, path, body):
+        head = ['HTTP/1.1 200 OK', 'Content-Type: application/json']
+        if path.endswith('/vehicles'):
+            data = json.dumps(VEHICLES).encode('utf-8')
+        else:
+            data = json.dumps({'response': {
+                'method': method, 'path': path,
+                'body': body.decode('utf-8')}}).encode('utf-8')
+        if path.endswith('/close'):
+            head.append('Connection: close')
+        if path.endswith('/chunked'):
+            head.append('Transfer-Encoding: chunked')
+            chunks = [data[i:i + 10] for i in range(0, len(data), 10)]
+            data = b''.join(b'%x\r\n%s\r\n' % (len(chunk), chunk)
+                            for chunk in chunks) + b'0\r\n\r\n'
+        else:
+            if path.endswith('/gzip'):
+                data = gzip.compress(data)
+                head.append('Content-Encoding: gzip')
+            head.append('Content-Length: {}'.format(len(data)))
+        return ('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + data
+
+
+class AsyncConnectionTest(unittest.TestCase):
+
+    def run_server(self, test, maxsize=10):
+        """Run test(connection, server) with a connection to a server"""
+        server = Server()
+
+        async def run():
+            host = await server.start()
+            pool = PlainPool(host, maxsize=maxsize)
+            c = await teslajson.AsyncConnection.create(
+                access_token='token', tesla_client=CLIENT, transport=pool,
+                refresh_ahead=0)
+            try:
+                return await test(c, pool)
+            finally:
+                c.close()
+                pool.close()
+                await server.stop()
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        return server, loop.run_until_complete(run())
+
+    def test_vehicles_and_requests(self):
+        async def test(c, pool):
+            self.assertEqual([v['vin'] for v in c.vehicles], ['A', 'B'])
+            v = c.vehicles[0]
+            return (await v.data_request('charge_state'),
+                    await v.command('honk_horn', {'times': 2}))
+
+        server, (data, command) = self.run_server(test)
+        self.assertEqual(data['path'],
+                         '/api/1/vehicles/1/data_request/charge_state')
+        self.assertEqual(command['response']['method'], 'POST')
+        self.assertEqual(command['response']['body'], 'times=2')
+        method, path, headers, body = server.requests[-1]
+        self.assertEqual(headers['Authorization'], 'Bearer token')
+        self.assertIn('gzip', headers['Accept-Encoding'])
+
+    def test_bodies(self):
+        async def test(c, pool):
+            return [(await c.get(path))['response']['path']
+                    for path in ('plain', 'chunked', 'gzip')]
+
+        server, paths = self.run_server(test)
+        self.assertEqual(paths, ['/api/1/plain', '/api/1/chunked',
+                                 '/api/1/gzip'])
+
+    def test_keep_alive(self):
+        async def test(c, pool):
+            for i in range(3):
+                await c.get('again')
+            # The server closes this one after answering
+            await c.get('close')
+            await c.get('again')
+            return pool.connections_made
+
+        server, made = self.run_server(test)
+        self.assertEqual(made, 2)
+
+    def test_concurrent_requests_share_the_pool(self):
+        async def test(c, pool):
+            results = await asyncio.gather(*[c.get('n/{}'.format(i))
+                                             for i in range(20)])
+            return pool.connections_made, results
+
+        server, (made, results) = self.run_server(test, maxsize=3)
+        self.assertLessEqual(made, 3)
+        self.assertEqual([r['response']['path'] for r in results],
+                         ['/api/1/n/{}'.format(i) for i in range(20)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+"""Cassette recording keeps no credentials, and replays in order"""
+
+import http.client
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import teslajson
+
+SECRET = 'secret-token-value'
+
+
+def response(body, content_type='application/json'):
+    headers = http.client.HTTPMessage()
+    headers['Content-Type'] = content_type
+    headers['Set-Cookie'] = 'session=' + SECRET
+    return teslajson._Response(200, 'OK', headers, body, None)
+
+
+class Pool(object):
+    """Answers with the given responses in turn"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    def request(self, method, path, body=None, headers={}, timings=None):
+        return self.responses.pop(0)
+
+    def close(self):
+        pass
+
+
+class CassetteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def record(self, name, *responses):
+        cassette = teslajson.Cassette(os.path.join(self.directory, name))
+        transport = teslajson.RecordingTransport(Pool(*responses), cassette)
+        for resp in responses:
+            transport.request('POST', '/oauth/token',
+                              json.dumps({'password': SECRET}).encode(),
+                              {'Authorization': 'Bearer ' + SECRET})
+        transport.close()
+        return cassette.filename
+
+    def test_tokens_are_scrubbed(self):
+        body = json.dumps({
+            'access_token': SECRET, 'refresh_token': SECRET,
+            'expires_in': 3888000,
+            'response': [{'id': 1, 'tokens': [SECRET, SECRET],
+                          'nested': {'id_token': SECRET}}]})
+        for name in ('tokens.jsonl', 'tokens.jsonl.gz'):
+            filename = self.record(name, response(body.encode('utf-8')))
+            cassette = teslajson.Cassette(filename)
+            with cassette._open('r') as R:
+                text = R.read()
+            self.assertNotIn(SECRET, text)
+            resp, duration = cassette.load().play('POST', '/oauth/token')
+            data = json.loads(resp.body.decode('utf-8'))
+            self.assertEqual(data['access_token'], cassette.SCRUBBED)
+            self.assertEqual(data['refresh_token'], cassette.SCRUBBED)
+            self.assertEqual(data['expires_in'], 3888000)
+            self.assertEqual(data['response'][0]['tokens'],
+                             cassette.SCRUBBED)
+            self.assertEqual(data['response'][0]['nested']['id_token'],
+                             cassette.SCRUBBED)
+            self.assertEqual(resp.headers['Content-Type'],
+                             'application/json')
+            self.assertIsNone(resp.headers['Set-Cookie'])
+
+    def test_replay_in_order_then_over(self):
+        filename = self.record('order.jsonl', response(b'{"n": 1}'),
+                               response(b'<html>2</html>', 'text/html'))
+        cassette = teslajson.Cassette(filename).load()
+        bodies = [cassette.play('POST', '/oauth/token')[0].body
+                  for i in range(3)]
+        self.assertEqual(bodies, [b'{"n":1}', b'<html>2</html>',
+                                  b'{"n":1}'])
+        resp, duration = cassette.play('GET', '/not/recorded')
+        self.assertEqual(resp.status, 404)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+"""Checkpoint saving and restoring polling state"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import unittest.mock
+from array import array
+
+from tesla_pollerlib import Checkpoint, VehicleState
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.filename = os.path.join(directory, 'checkpoint.json')
+
+    def test_round_trip(self):
+        first = VehicleState({'id': 1}, 'charging')
+        first.last_all = 1700000000
+        first.last_active = 1700000100
+        first.backoff = 4
+        first.last_poll = 1700000200.5
+        first.paused = True
+        first.profile = array('f', [0.5] * 10 + [1800.0] * 10)
+        second = VehicleState({'id': 2}, 'inactive')
+        checkpoint = Checkpoint(self.filename)
+        self.assertEqual(checkpoint.load(), 0)
+        due = {1: 30, 2: None}
+        text = checkpoint.dumps([first, second],
+                                lambda vs: due[vs.vehicle['id']])
+        checkpoint.write(text)
+        self.assertEqual(os.stat(self.filename).st_mode & 0o077, 0)
+
+        checkpoint = Checkpoint(self.filename)
+        self.assertEqual(checkpoint.load(), 2)
+        restored = VehicleState({'id': 1})
+        self.assertAlmostEqual(checkpoint.restore(restored), 30, delta=2)
+        for field in Checkpoint.FIELDS + ('profile',):
+            self.assertEqual(getattr(restored, field), getattr(first, field))
+        self.assertTrue(restored.started)
+        restored = VehicleState({'id': 2})
+        self.assertAlmostEqual(checkpoint.restore(restored), 0, delta=1)
+        self.assertEqual(restored.ourstate, 'inactive')
+        self.assertIsNone(restored.profile)
+        # Saved states are used once, and unknown vehicles have none
+        self.assertIsNone(checkpoint.restore(VehicleState({'id': 2})))
+        self.assertIsNone(checkpoint.restore(VehicleState({'id': 3})))
+
+    def test_unchanged_state_is_not_written_again(self):
+        vs = VehicleState({'id': 1}, 'inactive')
+        checkpoint = Checkpoint(self.filename)
+        with unittest.mock.patch('time.time', return_value=1700000000):
+            text = checkpoint.dumps([vs], lambda vs: 60)
+            checkpoint.write(text)
+            self.assertIsNone(checkpoint.dumps([vs], lambda vs: 60))
+            vs.ourstate = 'recent'
+            self.assertIsNotNone(checkpoint.dumps([vs], lambda vs: 60))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,131 @@
+"""CircuitBreaker trials through Connection and AsyncConnection"""
+
+import asyncio
+import http.client
+import unittest
+
+import teslajson
+
+CLIENT = {'v1': {'id': 'id', 'secret': 'secret', 'api': '/api/1/',
+                 'baseurl': 'https://owner-api.teslamotors.com'}}
+
+
+def response(status, body, content_type='application/json'):
+    headers = http.client.HTTPMessage()
+    headers['Content-Type'] = content_type
+    return teslajson._Response(status, 'Reason', headers, body, None)
+
+
+HEALTHY = response(200, b'{"response": {"state": "online"}}')
+UNAVAILABLE = response(503, b'{"error": "unavailable"}')
+HTML = response(200, b'<html>maintenance</html>', 'text/html')
+NOT_FOUND = response(404, b'{"error": "not_found"}')
+
+
+class Transport(object):
+    """Answers with the given responses, the last one from then on"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    def _next(self):
+        if len(self.responses) > 1:
+            return self.responses.pop(0)
+        return self.responses[0]
+
+    def request(self, method, path, body=None, headers={}, timings=None):
+        return self._next()
+
+    def close(self):
+        pass
+
+
+class AsyncTransport(Transport):
+
+    async def request(self, method, path, body=None, headers={},
+                      timings=None):
+        return self._next()
+
+
+def connection(cls, transport):
+    breaker = teslajson.CircuitBreaker(threshold=2, reset_timeout=0)
+    return cls(access_token='token', tesla_client=CLIENT,
+               transport=transport, circuit_breaker=breaker,
+               refresh_ahead=0)
+
+
+class CircuitBreakerTrialTest(unittest.TestCase):
+
+    def test_undecodable_trial_is_abandoned(self):
+        c = connection(teslajson.Connection,
+                       Transport(UNAVAILABLE, UNAVAILABLE, HTML, HEALTHY))
+        for i in range(2):
+            with self.assertRaises(teslajson.HTTPError):
+                c.get('vehicles/1/vehicle_data')
+        with self.assertRaises(ValueError):
+            c.get('vehicles/1/vehicle_data')
+        self.assertEqual(c.get('vehicles/1/vehicle_data'),
+                         {'response': {'state': 'online'}})
+        self.assertEqual(c.circuit_breaker.metrics()['open'], [])
+
+    def test_cancelled_trial_is_abandoned(self):
+        class Hanging(AsyncTransport):
+            async def request(self, *args, **kwargs):
+                if self.responses[0] is None:
+                    self.responses.pop(0)
+                    await asyncio.sleep(3600)
+                return await super(Hanging, self).request(*args, **kwargs)
+
+        async def run():
+            c = connection(teslajson.AsyncConnection,
+                           Hanging(UNAVAILABLE, UNAVAILABLE, None, HEALTHY))
+            for i in range(2):
+                with self.assertRaises(teslajson.HTTPError):
+                    await c.get('vehicles/1/vehicle_data')
+            trial = asyncio.ensure_future(c.get('vehicles/1/vehicle_data'))
+            await asyncio.sleep(0.01)
+            trial.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await trial
+            return await c.get('vehicles/1/vehicle_data')
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self.assertEqual(loop.run_until_complete(run()),
+                         {'response': {'state': 'online'}})
+
+    def test_client_errors_leave_the_circuit_alone(self):
+        c = connection(teslajson.Connection,
+                       Transport(UNAVAILABLE, NOT_FOUND, UNAVAILABLE,
+                                 NOT_FOUND, HEALTHY))
+        for expected in (503, 404, 503):
+            with self.assertRaises(teslajson.HTTPError) as raised:
+                c.get('vehicles/1/vehicle_data')
+            self.assertEqual(raised.exception.code, expected)
+        # Two failures in a row despite the 404 between
+        self.assertEqual(c.circuit_breaker.metrics()['open'],
+                         ['data 1'])
+        # A 404 trial neither closes the circuit nor keeps it half open
+        with self.assertRaises(teslajson.HTTPError):
+            c.get('vehicles/1/vehicle_data')
+        self.assertEqual(c.circuit_breaker.metrics()['open'],
+                         ['data 1'])
+        self.assertEqual(c.get('vehicles/1/vehicle_data'),
+                         {'response': {'state': 'online'}})
+        self.assertEqual(c.circuit_breaker.metrics()['open'], [])
+
+    def test_only_the_trial_goes_while_half_open(self):
+        breaker = teslajson.CircuitBreaker(threshold=1, reset_timeout=0)
+        endpoint = ('data', '1')
+        breaker.failure(endpoint)
+        self.assertTrue(breaker.allow(endpoint))
+        with self.assertRaises(teslajson.CircuitOpenError):
+            breaker.allow(endpoint)
+        breaker.abandon(endpoint)
+        self.assertTrue(breaker.allow(endpoint))
+        breaker.success(endpoint)
+        self.assertFalse(breaker.allow(endpoint))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+"""Decoding gzip and deflate response bodies as they arrive"""
+
+import gzip
+import http.client
+import io
+import json
+import unittest
+import zlib
+
+import teslajson
+
+BODY = json.dumps({'response': [{'id': i, 'state': 'online'}
+                                for i in range(2000)]}).encode('utf-8')
+
+
+def deflate(data, wbits):
+    compress = zlib.compressobj(9, zlib.DEFLATED, wbits)
+    return compress.compress(data) + compress.flush()
+
+
+ENCODED = {
+    'gzip': gzip.compress(BODY),
+    'x-gzip': gzip.compress(BODY),
+    'deflate': deflate(BODY, zlib.MAX_WBITS),
+}
+
+
+class Response(object):
+    """Enough of an http.client response for _read_body"""
+
+    def __init__(self, body, encoding=None):
+        self.msg = http.client.HTTPMessage()
+        if encoding is not None:
+            self.msg['Content-Encoding'] = encoding
+        self._body = io.BytesIO(body)
+
+    def read(self, size=-1):
+        return self._body.read(size)
+
+
+class ContentEncodingTest(unittest.TestCase):
+
+    def test_encodings(self):
+        for encoding, body in ENCODED.items():
+            resp = Response(body, encoding)
+            data, wire = teslajson._read_body(resp)
+            self.assertEqual(data, BODY)
+            self.assertEqual(wire, len(body))
+            self.assertLess(wire, len(BODY))
+            # The body handed back is no longer encoded
+            self.assertIsNone(resp.msg['Content-Encoding'])
+
+    def test_raw_deflate(self):
+        body = deflate(BODY, -zlib.MAX_WBITS)
+        data, wire = teslajson._read_body(Response(body, 'deflate'))
+        self.assertEqual(data, BODY)
+
+    def test_small_chunks(self):
+        for encoding, body in ENCODED.items():
+            resp = Response(body, encoding)
+            decompressor = teslajson._Decompressor.for_headers(resp.msg)
+            data = b''.join(decompressor.feed(body[i:i + 7])
+                            for i in range(0, len(body), 7))
+            self.assertEqual(data + decompressor.flush(), BODY)
+
+    def test_identity(self):
+        for encoding in (None, 'identity', 'br'):
+            resp = Response(BODY, encoding)
+            self.assertEqual(teslajson._read_body(resp), (BODY, None))
+
+    def test_corrupt_body_raises(self):
+        body = bytearray(ENCODED['gzip'])
+        body[len(body) // 2] ^= 0xff
+        with self.assertRaises(zlib.error):
+            teslajson._read_body(Response(bytes(body), 'gzip'))
+
+    def test_accept_encoding(self):
+        class Pool(object):
+            compress = True
+        headers = {'Authorization': 'Bearer token'}
+        self.assertEqual(teslajson._accept_encoding(Pool, headers),
+                         dict(headers, **{'Accept-Encoding':
+                                          teslajson.ACCEPT_ENCODING}))
+        self.assertNotIn('Accept-Encoding', headers)
+        Pool.compress = False
+        self.assertIs(teslajson._accept_encoding(Pool, headers), headers)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,103 @@
+"""data_select asks only for the sub-states it needs"""
+
+import asyncio
+import http.client
+import json
+import unittest
+import unittest.mock
+from urllib.parse import parse_qs, urlsplit
+
+import teslajson
+
+CLIENT = {'v1': {'id': 'id', 'secret': 'secret', 'api': '/api/1/',
+                 'baseurl': 'https://owner-api.teslamotors.com'}}
+
+
+class Transport(object):
+    """Answers vehicle_data with the sections asked for, numbered by
+    request, keeping the paths asked for"""
+
+    def __init__(self):
+        self.paths = []
+
+    def _answer(self, path):
+        self.paths.append(path)
+        url = urlsplit(path)
+        wanted = parse_qs(url.query).get('endpoints', [''])[0]
+        body = {'id': 1, 'state': 'online'}
+        for section in filter(None, wanted.split(';')):
+            body[section] = {'request': len(self.paths)}
+        headers = http.client.HTTPMessage()
+        headers['Content-Type'] = 'application/json'
+        return teslajson._Response(200, 'OK', headers, json.dumps(
+            {'response': body}).encode('utf-8'), None)
+
+    def request(self, method, path, body=None, headers={}, timings=None):
+        return self._answer(path)
+
+    def close(self):
+        pass
+
+
+class AsyncTransport(Transport):
+
+    async def request(self, method, path, body=None, headers={},
+                      timings=None):
+        return self._answer(path)
+
+
+def vehicle(cls, transport):
+    c = cls(access_token='token', tesla_client=CLIENT, refresh_ahead=0,
+            transport=transport, vehicle_ids=[1])
+    return c.vehicles[0]
+
+
+class DataSelectTest(unittest.TestCase):
+
+    ENDPOINTS = ['charge_state', 'vehicle_config']
+
+    def test_static_sections_are_cached(self):
+        transport = Transport()
+        v = vehicle(teslajson.Connection, transport)
+        first = v.data_select(self.ENDPOINTS)
+        second = v.data_select(self.ENDPOINTS)
+        self.assertEqual(transport.paths, [
+            '/api/1/vehicles/1/vehicle_data?endpoints='
+            'charge_state%3Bvehicle_config',
+            '/api/1/vehicles/1/vehicle_data?endpoints=charge_state'])
+        self.assertEqual(second['charge_state'], {'request': 2})
+        self.assertEqual(second['vehicle_config'], first['vehicle_config'])
+        # Only static sections wanted, and fresh: basic data
+        third = v.data_select(['vehicle_config'])
+        self.assertEqual(transport.paths[-1], '/api/1/vehicles/1')
+        self.assertEqual(third['vehicle_config'], {'request': 1})
+
+    def test_static_sections_expire(self):
+        transport = Transport()
+        v = vehicle(teslajson.Connection, transport)
+        v.data_select(self.ENDPOINTS)
+        later = teslajson.time.time() + v.static_ttl
+        with unittest.mock.patch('teslajson.time.time', return_value=later):
+            data = v.data_select(self.ENDPOINTS)
+        self.assertEqual(data['vehicle_config'], {'request': 2})
+        self.assertIn('vehicle_config', transport.paths[-1])
+
+    def test_async_static_sections_are_cached(self):
+        transport = AsyncTransport()
+        v = vehicle(teslajson.AsyncConnection, transport)
+
+        async def run():
+            await v.data_select(self.ENDPOINTS)
+            return await v.data_select(self.ENDPOINTS)
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        data = loop.run_until_complete(run())
+        self.assertEqual(transport.paths[-1],
+                         '/api/1/vehicles/1/vehicle_data?endpoints='
+                         'charge_state')
+        self.assertEqual(data['vehicle_config'], {'request': 1})
+
+
+if __name__ == '__main__':
+    unittest.main()
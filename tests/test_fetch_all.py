@@ -0,0 +1,144 @@
+"""Connection.fetch_all and AsyncConnection.fetch_all"""
+
+import asyncio
+import http.client
+import json
+import threading
+import time
+import unittest
+
+import teslajson
+
+CLIENT = {'v1': {'id': 'id', 'secret': 'secret', 'api': '/api/1/',
+                 'baseurl': 'https://owner-api.teslamotors.com'}}
+
+
+class Transport(object):
+    """A fleet of vehicles 1-8, each answering after delay seconds,
+    vehicle 3 with not found, counting requests and those at once"""
+
+    def __init__(self, delay=0.05):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.running = self.most = self.count = 0
+
+    def _answer(self, path):
+        headers = http.client.HTTPMessage()
+        headers['Content-Type'] = 'application/json'
+        parts = path.split('/')
+        if parts[-1] == 'vehicles':
+            body = {'response': [{'id': vid} for vid in range(8, 0, -1)]}
+        elif parts[4] == '3':
+            return teslajson._Response(404, 'Not Found', headers,
+                                       b'{"error": "not_found"}', None)
+        else:
+            body = {'response': {'id': int(parts[4]), 'path': parts[5]}}
+        return teslajson._Response(200, 'OK', headers,
+                                   json.dumps(body).encode('utf-8'), None)
+
+    def _start(self):
+        with self.lock:
+            self.running += 1
+            self.count += 1
+            self.most = max(self.most, self.running)
+
+    def _end(self):
+        with self.lock:
+            self.running -= 1
+
+    def request(self, method, path, body=None, headers={}, timings=None):
+        self._start()
+        try:
+            time.sleep(self.delay)
+            return self._answer(path)
+        finally:
+            self._end()
+
+    def close(self):
+        pass
+
+
+class AsyncTransport(Transport):
+
+    async def request(self, method, path, body=None, headers={},
+                      timings=None):
+        self._start()
+        try:
+            await asyncio.sleep(self.delay)
+            return self._answer(path)
+        finally:
+            self._end()
+
+
+def connection(cls, transport):
+    return cls(access_token='token', tesla_client=CLIENT,
+               transport=transport, refresh_ahead=0)
+
+
+class FetchAllTest(unittest.TestCase):
+
+    def check(self, results):
+        results = {result.vehicle['id']: result for result in results}
+        self.assertEqual(sorted(results), list(range(1, 9)))
+        for vid, result in results.items():
+            if vid == 3:
+                self.assertIsNone(result.data)
+                self.assertIsInstance(result.error, teslajson.HTTPError)
+            else:
+                self.assertIsNone(result.error)
+                self.assertEqual(result.data['id'], vid)
+        return results
+
+    def test_fetch_all(self):
+        transport = Transport()
+        c = connection(teslajson.Connection, transport)
+        self.assertEqual([v['id'] for v in c.vehicles], list(range(1, 9)))
+        start = time.monotonic()
+        results = self.check(c.fetch_all(max_workers=4))
+        # Four at a time, not one after another
+        self.assertLess(time.monotonic() - start, 6 * transport.delay)
+        self.assertEqual(transport.most, 4)
+        self.assertEqual(results[1].data['path'], 'data')
+
+    def test_fetch_all_what(self):
+        c = connection(teslajson.Connection, Transport(0))
+        vehicles = c.vehicles[:2]
+        for what, path in (('charge_state', 'data_request'),
+                           (['charge_state'], 'vehicle_data?endpoints='
+                            'charge_state')):
+            results = list(c.fetch_all(vehicles, what))
+            self.assertEqual(sorted(r.data['path'] for r in results),
+                             [path, path])
+        results = list(c.fetch_all(vehicles, lambda v: v['id'] * 10))
+        self.assertEqual(sorted(r.data for r in results), [10, 20])
+
+    def test_fetch_all_stopped_early(self):
+        transport = Transport()
+        c = connection(teslajson.Connection, transport)
+        vehicles = c.vehicles
+        transport.count = 0
+        results = c.fetch_all(vehicles, max_workers=2)
+        next(results)
+        results.close()
+        time.sleep(3 * transport.delay)
+        # Those not started were dropped, of 8
+        self.assertEqual(transport.running, 0)
+        self.assertLessEqual(transport.count, 4)
+
+    def test_async_fetch_all(self):
+        transport = AsyncTransport()
+
+        async def run():
+            c = await teslajson.AsyncConnection.create(
+                access_token='token', tesla_client=CLIENT,
+                transport=transport, refresh_ahead=0)
+            return [result async for result in c.fetch_all(max_workers=4)]
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        self.check(loop.run_until_complete(run()))
+        self.assertEqual(transport.most, 4)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+"""HashRing spreading vehicles over workers and rebalancing"""
+
+import collections
+import unittest
+
+from tesla_pollerlib import HashRing
+
+VIDS = range(10000, 20000)
+
+
+class HashRingTest(unittest.TestCase):
+
+    def assign(self, ring):
+        return {vid: ring.node(vid) for vid in VIDS}
+
+    def test_stable_and_balanced(self):
+        before = self.assign(HashRing(range(4)))
+        self.assertEqual(self.assign(HashRing(range(4))), before)
+        counts = collections.Counter(before.values())
+        self.assertEqual(sorted(counts), [0, 1, 2, 3])
+        for count in counts.values():
+            self.assertGreater(count, len(VIDS) / 4 * 0.75)
+            self.assertLess(count, len(VIDS) / 4 * 1.25)
+
+    def test_adding_a_node_moves_only_its_share(self):
+        before = self.assign(HashRing(range(4)))
+        after = self.assign(HashRing(range(5)))
+        moved = [vid for vid in VIDS if before[vid] != after[vid]]
+        # Only to the new node, about a fifth of them
+        self.assertEqual({after[vid] for vid in moved}, {4})
+        self.assertGreater(len(moved), len(VIDS) / 5 * 0.75)
+        self.assertLess(len(moved), len(VIDS) / 5 * 1.25)
+
+    def test_removing_a_node_moves_only_its_keys(self):
+        before = self.assign(HashRing(range(5)))
+        after = self.assign(HashRing([0, 1, 3, 4]))
+        for vid in VIDS:
+            if before[vid] != 2:
+                self.assertEqual(after[vid], before[vid])
+            else:
+                self.assertNotEqual(after[vid], 2)
+
+    def test_one_node(self):
+        ring = HashRing(['only'])
+        self.assertEqual({ring.node(vid) for vid in VIDS}, {'only'})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""LatencyHistogram quantiles and the RequestHistograms hook"""
+
+import http.client
+import random
+import unittest
+
+import teslajson
+
+CLIENT = {'v1': {'id': 'id', 'secret': 'secret', 'api': '/api/1/',
+                 'baseurl': 'https://owner-api.teslamotors.com'}}
+
+
+class Transport(object):
+
+    def request(self, method, path, body=None, headers={}, timings=None):
+        headers = http.client.HTTPMessage()
+        headers['Content-Type'] = 'application/json'
+        return teslajson._Response(200, 'OK', headers, b'{"response": 1}',
+                                   None)
+
+    def close(self):
+        pass
+
+
+class LatencyHistogramTest(unittest.TestCase):
+
+    def test_quantiles_within_precision(self):
+        h = teslajson.LatencyHistogram()
+        rng = random.Random(1)
+        values = sorted(rng.lognormvariate(-3, 1.5) for i in range(10000))
+        for value in values:
+            h.record(value)
+        for percent in (1, 50, 90, 99, 99.9):
+            exact = values[int(round(percent * len(values) / 100.0)) - 1]
+            self.assertAlmostEqual(h.percentile(percent) / exact, 1,
+                                   delta=1.0 / 32)
+        self.assertEqual(h.percentile(100), values[-1])
+        self.assertAlmostEqual(h.percentile(0), values[0], delta=1e-6)
+
+    def test_small_values_are_exact(self):
+        h = teslajson.LatencyHistogram()
+        for us in range(1, 11):
+            h.record(us / 1e6)
+        self.assertAlmostEqual(h.percentile(50), 5e-6)
+        self.assertAlmostEqual(h.percentile(90), 9e-6)
+
+    def test_snapshot(self):
+        h = teslajson.LatencyHistogram()
+        self.assertEqual(h.snapshot(), {'count': 0})
+        self.assertIsNone(h.percentile(50))
+        for ms in (10, 20, 30, 40):
+            h.record(ms / 1000.0)
+        summary = h.snapshot()
+        self.assertEqual(summary['count'], 4)
+        self.assertEqual(summary['min'], 10)
+        self.assertEqual(summary['mean'], 25)
+        self.assertEqual(summary['max'], 40)
+        self.assertAlmostEqual(summary['p50'], 20, delta=20 / 32.0)
+        self.assertEqual(summary['p99'], 40)
+
+    def test_request_histograms_hook(self):
+        histograms = teslajson.RequestHistograms()
+        c = teslajson.Connection(access_token='token', tesla_client=CLIENT,
+                                 transport=Transport(), refresh_ahead=0)
+        c.add_hook(histograms)
+        for i in range(3):
+            c.get('vehicles/1/vehicle_data')
+        c.get('vehicles/1/wake_up')
+        snapshot = histograms.snapshot()
+        self.assertEqual(snapshot['data']['total']['count'], 3)
+        self.assertEqual(snapshot['data']['decode']['count'], 3)
+        self.assertEqual(snapshot['wake']['total']['count'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+"""jsoncodec gives the same output with either backend"""
+
+import importlib.util
+import json
+import sys
+import unittest
+
+import jsoncodec
+
+
+def stdlib_codec():
+    """A copy of jsoncodec that does not find orjson"""
+    spec = importlib.util.find_spec('jsoncodec')
+    codec = importlib.util.module_from_spec(spec)
+    saved = sys.modules.get('orjson')
+    sys.modules['orjson'] = None
+    try:
+        spec.loader.exec_module(codec)
+    finally:
+        if saved is None:
+            del sys.modules['orjson']
+        else:
+            sys.modules['orjson'] = saved
+    return codec
+
+RECORD = {'id': 1, 'display_name': 'Blåbær 🚗', 'odometer': 1234.5,
+          'retrevial_time': 1700000000, 'state': None}
+
+
+class CodecTest(unittest.TestCase):
+
+    def test_compact_utf8(self):
+        expected = json.dumps(RECORD, separators=(',', ':'),
+                              ensure_ascii=False)
+        for codec in (jsoncodec, stdlib_codec()):
+            self.assertEqual(codec.dumps(RECORD), expected)
+            self.assertEqual(codec.dumpb(RECORD), expected.encode('utf-8'))
+
+    def test_round_trip(self):
+        self.assertEqual(jsoncodec.loads(jsoncodec.dumpb(RECORD)), RECORD)
+        self.assertEqual(jsoncodec.loads(jsoncodec.dumps(RECORD)), RECORD)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""RateLimiter buckets and round robin between vehicles"""
+
+import asyncio
+import threading
+import time
+import unittest
+
+import teslajson
+
+
+class RateLimiterTest(unittest.TestCase):
+
+    def test_vehicles_take_turns(self):
+        limiter = teslajson.RateLimiter({'data': (100, 1)})
+        order = []
+
+        async def request(vid):
+            await limiter.acquire_async('data', vid)
+            order.append(vid)
+
+        async def run():
+            # One busy vehicle queues first, then another
+            await asyncio.wait([asyncio.ensure_future(request(vid))
+                                for vid in 'AAAAABBBBB'])
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        loop.run_until_complete(run())
+        self.assertEqual(''.join(order), 'AABABABABB')
+        metrics = limiter.metrics()
+        self.assertEqual(metrics['waiting'], 0)
+        self.assertEqual(metrics['delayed'], 9)
+
+    def test_threads_take_turns(self):
+        limiter = teslajson.RateLimiter({'data': (20, 1)})
+        limiter.acquire('data', 'A')
+        order = []
+        lock = threading.Lock()
+
+        def request(vid):
+            limiter.acquire('data', vid)
+            with lock:
+                order.append(vid)
+
+        threads = []
+        for vid in 'AAAB':
+            threads.append(threading.Thread(target=request, args=(vid,)))
+            threads[-1].start()
+            # Queue in this order
+            time.sleep(0.005)
+        for thread in threads:
+            thread.join(5)
+        # B is served once A has had its turn, not after all of A's
+        self.assertEqual(''.join(order), 'ABAA')
+
+    def test_classes_without_limits_do_not_wait(self):
+        limiter = teslajson.RateLimiter({'data': (0.001, 1)})
+        limiter.acquire('data', 'A')
+        for i in range(10):
+            self.assertEqual(limiter.acquire('wake', 'A'), 0)
+        self.assertEqual(limiter.metrics()['delayed'], 0)
+
+    def test_burst_then_rate(self):
+        limiter = teslajson.RateLimiter({'data': (20, 5)})
+        start = time.monotonic()
+        for i in range(5):
+            limiter.acquire('data', 'A')
+        self.assertLess(time.monotonic() - start, 0.04)
+        for i in range(4):
+            limiter.acquire('data', 'A')
+        # 4 more at 20/s
+        self.assertGreaterEqual(time.monotonic() - start, 0.15)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""Tokenfile handling: replays leave it alone, refresh ahead is lazy"""
+
+import http.client
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import teslajson
+
+CLIENT = {'v1': {'id': 'id', 'secret': 'secret', 'api': '/api/1/',
+                 'baseurl': 'https://owner-api.teslamotors.com'}}
+
+
+class OAuthTransport(object):
+    """Answers every request with a scrubbed token reply"""
+
+    def request(self, method, path, body=None, headers={}, timings=None):
+        headers = http.client.HTTPMessage()
+        headers['Content-Type'] = 'application/json'
+        return teslajson._Response(200, 'OK', headers, json.dumps({
+            'access_token': teslajson.Cassette.SCRUBBED,
+            'refresh_token': teslajson.Cassette.SCRUBBED,
+            'created_at': int(time.time()), 'expires_in': 3888000,
+        }).encode('utf-8'), None)
+
+    def close(self):
+        pass
+
+
+class ReplayTokenfileTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.tokenfile = os.path.join(self.directory, 'tokens')
+        self.tokens = json.dumps({'access_token': 'real',
+                                  'refresh_token': 'real-refresh',
+                                  'created_at': 0, 'expires_in': 0})
+        with open(self.tokenfile, 'w') as W:
+            W.write(self.tokens)
+
+    def test_refresh_leaves_tokenfile(self):
+        c = teslajson.Connection(tokenfile=self.tokenfile,
+                                 tesla_client=CLIENT,
+                                 transport=OAuthTransport(),
+                                 refresh_ahead=0)
+        c.get('vehicles')
+        self.assertEqual(c.access_token, teslajson.Cassette.SCRUBBED)
+        with open(self.tokenfile) as R:
+            self.assertEqual(R.read(), self.tokens)
+
+
+class RefreshAheadTest(unittest.TestCase):
+
+    def test_refresh_thread_starts_with_the_first_request(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        tokenfile = os.path.join(directory, 'tokens')
+        with open(tokenfile, 'w') as W:
+            json.dump({'access_token': 'token', 'refresh_token': 'refresh',
+                       'created_at': int(time.time()),
+                       'expires_in': 3888000}, W)
+        c = teslajson.Connection(tokenfile=tokenfile, tesla_client=CLIENT,
+                                 transport=OAuthTransport())
+        self.addCleanup(c.close)
+        self.assertNotEqual(c.expiration, float('inf'))
+        self.assertIsNone(c._refresher)
+        c.get('vehicles')
+        self.assertTrue(c._refresher.is_alive())
+        c.close()
+        c._refresher.join(5)
+        self.assertFalse(c._refresher.is_alive())
+
+
+if __name__ == '__main__':
+    unittest.main()
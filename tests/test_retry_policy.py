@@ -0,0 +1,107 @@
+"""RetryPolicy backoff, Retry-After and retries through Connection"""
+
+import email.utils
+import http.client
+import time
+import unittest
+import unittest.mock
+
+import teslajson
+
+CLIENT = {'v1': {'id': 'id', 'secret': 'secret', 'api': '/api/1/',
+                 'baseurl': 'https://owner-api.teslamotors.com'}}
+
+
+def http_error(status, retry_after=None):
+    headers = http.client.HTTPMessage()
+    if retry_after is not None:
+        headers['Retry-After'] = retry_after
+    return teslajson.HTTPError('url', status, 'Reason', headers, None)
+
+
+def response(status, body, retry_after=None):
+    headers = http.client.HTTPMessage()
+    headers['Content-Type'] = 'application/json'
+    if retry_after is not None:
+        headers['Retry-After'] = retry_after
+    return teslajson._Response(status, 'Reason', headers, body, None)
+
+
+class Transport(object):
+    """Answers with the given responses in turn"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+
+    def request(self, method, path, body=None, headers={}, timings=None):
+        return self.responses.pop(0)
+
+    def close(self):
+        pass
+
+
+class RetryPolicyTest(unittest.TestCase):
+
+    def test_jitter_stays_in_bounds(self):
+        policy = teslajson.RetryPolicy(tries=10, base=1, cap=20)
+        e = http_error(503)
+        previous = None
+        delays = []
+        for i in range(1000):
+            delay = policy.delay(e, previous)
+            # Between base and three times the last sleep, capped
+            self.assertGreaterEqual(delay, 1)
+            self.assertLessEqual(delay, min(20, 3 * (previous or 1)))
+            delays.append(delay)
+            previous = delay
+        # Jittered, not a fixed sequence, and growing up to the cap
+        self.assertGreater(len(set(delays)), 100)
+        self.assertEqual(max(delays), 20)
+
+    def test_retry_after_seconds(self):
+        policy = teslajson.RetryPolicy(cap=120)
+        self.assertEqual(policy.delay(http_error(429, '7')), 7)
+        # Capped like any other delay
+        self.assertEqual(policy.delay(http_error(429, '3600')), 120)
+
+    def test_retry_after_date(self):
+        when = email.utils.formatdate(time.time() + 30, usegmt=True)
+        delay = teslajson.RetryPolicy.retry_after(http_error(503, when))
+        self.assertGreater(delay, 25)
+        self.assertLessEqual(delay, 30)
+        self.assertIsNone(teslajson.RetryPolicy.retry_after(
+            http_error(503, 'soon')))
+        self.assertIsNone(teslajson.RetryPolicy.retry_after(
+            http_error(503)))
+
+    def test_retryable(self):
+        policy = teslajson.RetryPolicy()
+        for status in (408, 429, 500, 502, 503, 504):
+            self.assertTrue(policy.retryable(http_error(status)))
+        for status in (400, 401, 404):
+            self.assertFalse(policy.retryable(http_error(status)))
+        self.assertTrue(policy.retryable(teslajson.URLError('timed out')))
+        self.assertFalse(policy.retryable(
+            teslajson.CircuitOpenError('open')))
+
+    def test_connection_sleeps_retry_after(self):
+        c = teslajson.Connection(
+            access_token='token', tesla_client=CLIENT, refresh_ahead=0,
+            retry_policy=teslajson.RetryPolicy(tries=3),
+            transport=Transport(response(429, b'{}', '2'),
+                                response(503, b'{}'),
+                                response(200, b'{"response": 1}'),
+                                response(404, b'{}')))
+        with unittest.mock.patch('time.sleep') as sleep:
+            self.assertEqual(c.get('vehicles/1/vehicle_data'),
+                             {'response': 1})
+            self.assertEqual(sleep.call_count, 2)
+            self.assertEqual(sleep.call_args_list[0][0][0], 2)
+            # Not retried
+            with self.assertRaises(teslajson.HTTPError):
+                c.get('vehicles/1/vehicle_data')
+            self.assertEqual(sleep.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,116 @@
+"""Scheduler stepping items as they come due"""
+
+import asyncio
+import contextlib
+import io
+import time
+import unittest
+
+from tesla_pollerlib import Scheduler
+
+
+class SchedulerTest(unittest.TestCase):
+
+    def run_loop(self, coroutine):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        return loop.run_until_complete(coroutine)
+
+    def test_items_run_in_deadline_order_until_dropped(self):
+        scheduler = Scheduler()
+        steps = []
+        runs = {'a': 3, 'b': 2}
+
+        async def step(item):
+            steps.append(item)
+            runs[item] -= 1
+            return 0.02 if runs[item] else None
+
+        scheduler.schedule('b', 0.01)
+        scheduler.schedule('a', 0)
+        self.run_loop(scheduler.run(step))
+        self.assertEqual(steps, ['a', 'b', 'a', 'b', 'a'])
+        self.assertEqual(len(scheduler), 0)
+
+    def test_reschedule_replaces_the_deadline(self):
+        scheduler = Scheduler()
+        stepped = {}
+
+        async def step(item):
+            stepped[item] = time.monotonic()
+
+        start = time.monotonic()
+        scheduler.schedule('a', 0)
+        scheduler.schedule('a', 0.1)
+        self.assertGreater(scheduler.due('a'), 0.05)
+        self.run_loop(scheduler.run(step))
+        self.assertGreaterEqual(stepped['a'] - start, 0.1)
+        self.assertIsNone(scheduler.due('a'))
+
+    def test_wake_and_remove(self):
+        scheduler = Scheduler()
+        steps = []
+
+        async def step(item):
+            steps.append(item)
+            if item == 'a':
+                # Long wait, woken early
+                return 3600
+            if item == 'b':
+                scheduler.remove('b')
+                return 0
+            if item == 'c':
+                self.assertTrue(scheduler.wake('a'))
+                self.assertFalse(scheduler.wake('c'))
+                return None
+            scheduler.remove('a')
+            return None
+
+        async def run():
+            scheduler.schedule('a', 0)
+            scheduler.schedule('b', 0.01)
+            scheduler.schedule('c', 0.02)
+            # Once a is waiting again
+            scheduler.schedule('d', 0.05)
+            await scheduler.run(step)
+
+        start = time.monotonic()
+        self.run_loop(run())
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(steps, ['a', 'b', 'c', 'a', 'd'])
+        self.assertEqual(scheduler.items(), [])
+
+    def test_time_scale(self):
+        scheduler = Scheduler(time_scale=100)
+        count = []
+
+        async def step(item):
+            count.append(item)
+            return 1 if len(count) < 10 else None
+
+        start = time.monotonic()
+        scheduler.schedule('a', 1)
+        self.assertAlmostEqual(scheduler.due('a'), 1, delta=0.1)
+        self.run_loop(scheduler.run(step))
+        # Ten seconds in a tenth
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertEqual(len(count), 10)
+
+    def test_failing_step_drops_the_item(self):
+        scheduler = Scheduler()
+
+        async def step(item):
+            if item == 'bad':
+                raise ValueError(item)
+
+        scheduler.schedule('bad')
+        scheduler.schedule('good')
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            self.run_loop(scheduler.run(step))
+        self.assertIn('Dropping bad', stderr.getvalue())
+        self.assertEqual(len(scheduler), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
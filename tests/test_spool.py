@@ -0,0 +1,193 @@
+"""Spool recovery and limits, replay order, and outdir repair"""
+
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from writer import Spool, Writer, WriteError
+
+
+class SpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def segment(self):
+        names = [name for name in os.listdir(self.directory)
+                 if name.endswith('.seg')]
+        self.assertEqual(len(names), 1)
+        return os.path.join(self.directory, names[0])
+
+    def test_torn_tail_is_cut_off(self):
+        spool = Spool(self.directory)
+        spool.append([b'a\n', b'b\n', b'c\n'])
+        spool.sync()
+        with open(self.segment(), 'ab') as W:
+            W.write(b'\x00\x00\x00\x09\x00')
+        spool = Spool(self.directory)
+        self.assertEqual((len(spool), spool.corrupt), (3, 1))
+        spool.append(['d\n'])
+        self.assertEqual(spool.read(10), [b'a\n', b'b\n', b'c\n', b'd\n'])
+
+    def test_corrupt_record_cuts_off_the_rest(self):
+        spool = Spool(self.directory)
+        spool.append([b'aaaa', b'bbbb', b'cccc'])
+        spool.sync()
+        with open(self.segment(), 'r+b') as F:
+            # A bit of the second payload
+            F.seek(Spool.FRAME.size * 2 + 4 + 1)
+            byte = F.read(1)
+            F.seek(-1, os.SEEK_CUR)
+            F.write(bytes([byte[0] ^ 1]))
+        spool = Spool(self.directory)
+        self.assertEqual(spool.corrupt, 1)
+        self.assertEqual(spool.read(10), [b'aaaa'])
+
+    def test_reopen_carries_on_from_the_commit(self):
+        spool = Spool(self.directory, segment_bytes=200)
+        spool.append(['r{}\n'.format(i).encode() for i in range(50)])
+        spool.read(7)
+        spool.commit()
+        # Read but not committed, so read again after a restart
+        spool.read(10)
+        spool = Spool(self.directory, segment_bytes=200)
+        self.assertEqual(len(spool), 43)
+        records = []
+        while len(spool):
+            records += spool.read(9)
+            spool.commit()
+        self.assertEqual(records, ['r{}\n'.format(i).encode()
+                                   for i in range(7, 50)])
+        self.assertEqual(len(Spool(self.directory)), 0)
+
+    def test_max_bytes_drops_the_oldest(self):
+        spool = Spool(self.directory, max_bytes=1000, segment_bytes=300)
+        for i in range(300):
+            spool.append(['{:05d}'.format(i).encode()])
+        self.assertGreater(spool.dropped, 0)
+        self.assertLessEqual(spool.bytes, 1000 + 300)
+        self.assertEqual(len(spool) + spool.dropped, 300)
+        self.assertEqual(spool.read(1000), ['{:05d}'.format(i).encode() for i
+                                            in range(spool.dropped, 300)])
+
+
+class Sink(object):
+    """A stream down until told otherwise, then failing one record of
+    the first batch it takes"""
+
+    def __init__(self):
+        self.down = True
+        self.failed = None
+        self.lines = []
+
+    def write(self, data):
+        if self.down:
+            raise IOError('down')
+        lines = data.splitlines(True)
+        if self.failed is None:
+            self.failed = lines[len(lines) // 2]
+            self.lines += [line for line in lines if line != self.failed]
+            raise WriteError('one failed', [self.failed])
+        self.lines += lines
+
+    def flush(self):
+        pass
+
+
+class ReplayTest(unittest.TestCase):
+
+    def test_partial_failure_keeps_the_order(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        W = Writer()
+        W.SPOOL_MIN_DELAY = W.SPOOL_MAX_DELAY = 0
+        W.SPOOL_BATCH = 4
+        sink = Sink()
+        W.add_channel('stream', sink)
+        W.set_spool(directory)
+        records = ['{}\n'.format(i) for i in range(20)]
+        for data in records[:10]:
+            W.write(data)
+        sink.down = False
+        for data in records[10:]:
+            W.write(data)
+        self.assertIsNotNone(sink.failed)
+        # Written at least once, the last time in order
+        last = []
+        for line in reversed(sink.lines):
+            if line not in last:
+                last.insert(0, line)
+        self.assertEqual(last, records)
+        self.assertEqual(len(W.output_channels[0]['spool']), 0)
+
+
+class OutdirRepairTest(unittest.TestCase):
+
+    def test_torn_gzip_member_is_repaired(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        records = [json.dumps({'id': 1, 'retrevial_time': 1700000000 + i,
+                               'n': i}) + '\n' for i in range(40)]
+        W = Writer()
+        W.add_channel('outdir', directory, compress='gzip')
+        for data in records[:20]:
+            W.write(data)
+        W.close()
+        path = os.path.join(directory, '1', '2023-11-14.json.gz')
+        # A crash part way through the next member
+        torn = gzip.compress(''.join(records[20:30]).encode('utf-8'))
+        with open(path, 'ab') as W_:
+            W_.write(torn[:len(torn) * 2 // 3])
+        W = Writer()
+        W.add_channel('outdir', directory, compress='gzip')
+        for data in records[30:]:
+            W.write(data)
+        W.close()
+        with gzip.open(path, 'rt') as R:
+            lines = R.readlines()
+        for line in lines:
+            json.loads(line)
+        self.assertEqual(lines[:20], records[:20])
+        self.assertEqual(lines[-10:], records[30:])
+
+    def test_repair_reads_past_a_chunk(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        # Records that hardly compress, torn members longer than a chunk
+        records = [json.dumps({'id': 1, 'retrevial_time': 1700000000 + i,
+                               'pad': os.urandom(2000).hex()}) + '\n'
+                   for i in range(100)]
+        for compress, name in (('gzip', '2023-11-14.json.gz'),
+                               ('none', '2023-11-14.json')):
+            W = Writer()
+            W.add_channel('outdir', directory, compress=compress)
+            for data in records[:50]:
+                W.write(data)
+            W.close()
+            path = os.path.join(directory, '1', name)
+            torn = ''.join(records[50:90]).encode('utf-8')
+            if compress == 'gzip':
+                torn = gzip.compress(torn)
+            with open(path, 'ab') as W_:
+                W_.write(torn[:len(torn) * 2 // 3])
+            W = Writer()
+            W.add_channel('outdir', directory, compress=compress)
+            for data in records[90:]:
+                W.write(data)
+            W.close()
+            with (gzip.open(path, 'rt') if compress == 'gzip' else
+                  open(path)) as R:
+                lines = R.readlines()
+            for line in lines:
+                json.loads(line)
+            self.assertEqual(lines[:50], records[:50])
+            self.assertEqual(lines[-10:], records[90:])
+            self.assertGreater(len(lines), 60)
+
+
+if __name__ == '__main__':
+    unittest.main()
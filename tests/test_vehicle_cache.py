@@ -0,0 +1,95 @@
+"""Vehicle lists from vehicle_ids, the vehicle_cache or the API"""
+
+import http.client
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+import teslajson
+
+CLIENT = {'v1': {'id': 'id', 'secret': 'secret', 'api': '/api/1/',
+                 'baseurl': 'https://owner-api.teslamotors.com'}}
+
+
+class Transport(object):
+    """Answers every request with a list of vehicles 1 and 2"""
+
+    def __init__(self):
+        self.requests = 0
+
+    def request(self, method, path, body=None, headers={}, timings=None):
+        self.requests += 1
+        headers = http.client.HTTPMessage()
+        headers['Content-Type'] = 'application/json'
+        return teslajson._Response(200, 'OK', headers, json.dumps({
+            'response': [{'id': 2, 'vin': 'B'}, {'id': 1, 'vin': 'A'}],
+        }).encode('utf-8'), None)
+
+    def close(self):
+        pass
+
+
+class VehicleCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.cache = os.path.join(directory, 'vehicles.json')
+        self.transport = Transport()
+
+    def connection(self, **kwargs):
+        return teslajson.Connection(access_token='token',
+                                    tesla_client=CLIENT, refresh_ahead=0,
+                                    transport=self.transport, **kwargs)
+
+    def vins(self, c):
+        return [v['vin'] for v in c.vehicles]
+
+    def test_vehicle_ids_skip_the_list(self):
+        c = self.connection(vehicle_ids=['2', '1'])
+        self.assertEqual([v['id'] for v in c.vehicles], [1, 2])
+        self.assertEqual(self.transport.requests, 0)
+
+    def test_loaded_on_first_use_then_cached(self):
+        c = self.connection(vehicle_cache=self.cache)
+        self.assertEqual(self.transport.requests, 0)
+        self.assertEqual(self.vins(c), ['A', 'B'])
+        self.assertEqual(self.vins(c), ['A', 'B'])
+        self.assertEqual(self.transport.requests, 1)
+        # A new connection finds the fresh cache
+        c = self.connection(vehicle_cache=self.cache)
+        self.assertEqual(self.vins(c), ['A', 'B'])
+        self.assertEqual(self.transport.requests, 1)
+        c.load_vehicles(refresh=True)
+        self.assertEqual(self.transport.requests, 2)
+
+    def test_stale_cache_is_fetched_again(self):
+        self.connection(vehicle_cache=self.cache).vehicles
+        with open(self.cache) as R:
+            cache = json.load(R)
+        cache['fetched'] = time.time() - 120
+        cache['vehicles'] = [{'id': 9, 'vin': 'stale'}]
+        with open(self.cache, 'w') as W:
+            json.dump(cache, W)
+        c = self.connection(vehicle_cache=self.cache, vehicle_cache_ttl=300)
+        self.assertEqual(self.vins(c), ['stale'])
+        c = self.connection(vehicle_cache=self.cache, vehicle_cache_ttl=60)
+        self.assertEqual(self.vins(c), ['A', 'B'])
+        self.assertEqual(self.transport.requests, 2)
+
+    def test_unusable_cache_is_ignored(self):
+        for text in ('not json', '{}', json.dumps({
+                'baseurl': 'https://elsewhere', 'fetched': time.time(),
+                'vehicles': [{'id': 9}]})):
+            with open(self.cache, 'w') as W:
+                W.write(text)
+            c = self.connection(vehicle_cache=self.cache)
+            self.assertEqual(self.vins(c), ['A', 'B'])
+        self.assertEqual(self.transport.requests, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
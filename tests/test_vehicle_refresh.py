@@ -0,0 +1,88 @@
+"""Starting and stopping vehicles as an account's vehicle list changes"""
+
+import argparse
+import asyncio
+import importlib.machinery
+import importlib.util
+import os
+import unittest
+
+import teslajson
+from tesla_pollerlib import Scheduler
+
+CLIENT = {'v1': {'id': 'id', 'secret': 'secret', 'api': '/api/1/',
+                 'baseurl': 'https://owner-api.teslamotors.com'}}
+
+
+def load_poller():
+    """The tesla_poller script as a module"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..',
+                        'tesla_poller')
+    loader = importlib.machinery.SourceFileLoader('tesla_poller', path)
+    spec = importlib.util.spec_from_loader('tesla_poller', loader)
+    poller = importlib.util.module_from_spec(spec)
+    loader.exec_module(poller)
+    return poller
+
+
+class VehicleRefreshTest(unittest.TestCase):
+
+    def setUp(self):
+        self.poller = load_poller()
+        self.poller.args = argparse.Namespace(
+            state='Unknown', rate_limits={'data': (1.0, 20)})
+        self.scheduler = Scheduler()
+        self.account = {'name': 'a', 'token': 'token', 'vids': [1, 2]}
+        self.c = teslajson.AsyncConnection(
+            access_token='token', tesla_client=CLIENT, refresh_ahead=0,
+            transport=teslajson.AsyncReplayTransport(None),
+            vehicle_ids=[1, 2], rate_limiter=teslajson.RateLimiter(
+                self.poller.account_limits(self.account)))
+        self.poller.start_account('a', self.account, self.c, self.scheduler)
+
+    def polled(self):
+        return {vs.vehicle['id']: vs for vs in self.scheduler.items()}
+
+    def test_sync_keeps_vehicles_on_both_lists(self):
+        before = self.polled()
+        self.assertEqual(sorted(before), [1, 2])
+        self.scheduler.schedule(before[2], 600)
+        self.c.vehicles = [teslajson.AsyncVehicle({'id': vid}, self.c)
+                           for vid in (2, 3)]
+        started, stopped = self.poller.sync_vehicles('a', self.scheduler)
+        self.assertEqual((started, stopped), ([3], [1]))
+        after = self.polled()
+        self.assertEqual(sorted(after), [2, 3])
+        # Not woken or polled again
+        self.assertIs(after[2], before[2])
+        self.assertGreater(self.scheduler.due(after[2]), 590)
+        self.assertEqual(self.poller.sync_vehicles('a', self.scheduler),
+                         ([], []))
+
+    def test_reassign_vids_and_rate_share(self):
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        account = dict(self.account, vids=[2, 3], rate_share=0.5)
+        self.assertTrue(loop.run_until_complete(
+            self.poller.reassign_vehicles('a', account, self.scheduler)))
+        self.assertEqual(sorted(self.polled()), [2, 3])
+        self.assertIs(self.poller.accounts['a'][1], self.c)
+        bucket = self.c.rate_limiter.buckets['data']
+        self.assertEqual((bucket.rate, bucket.burst), (0.5, 10))
+        # Anything else changed restarts the account
+        account = dict(account, token='other')
+        self.assertFalse(loop.run_until_complete(
+            self.poller.reassign_vehicles('a', account, self.scheduler)))
+
+    def test_set_limits(self):
+        limiter = teslajson.RateLimiter({'data': (1.0, 20)})
+        limiter.set_limits({'data': (2.0, 5), 'wake': (1.0, 1)})
+        bucket = limiter.buckets['data']
+        self.assertEqual((bucket.rate, bucket.burst, bucket.tokens),
+                         (2.0, 5, 5))
+        # Only the classes it limits
+        self.assertNotIn('wake', limiter.buckets)
+
+
+if __name__ == '__main__':
+    unittest.main()
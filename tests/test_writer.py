@@ -0,0 +1,162 @@
+"""Writer queues and the files outdir channels write"""
+
+import asyncio
+import gzip
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import unittest.mock
+
+from logfile import open_gzip
+from writer import Writer
+
+
+class Hanging(io.StringIO):
+    """A stream whose flush waits until released"""
+
+    def __init__(self):
+        super(Hanging, self).__init__()
+        self.released = threading.Event()
+
+    def flush(self):
+        self.released.wait()
+
+
+class BlockOverflowTest(unittest.TestCase):
+
+    def hanging(self, **options):
+        W = Writer()
+        W.BLOCK_SECONDS = 0.2
+        slow, fast = Hanging(), io.StringIO()
+        W.add_channel('stream', slow)
+        W.add_channel('stream', fast)
+        W.start(queue_size=10, batch_size=5, flush_interval=0.01, **options)
+        self.addCleanup(W.close, 1)
+        self.addCleanup(slow.released.set)
+        return W
+
+    def test_block_waits_once_until_drained(self):
+        W = self.hanging()
+        start = time.monotonic()
+        for i in range(50):
+            W.write('{}\n'.format(i))
+        # One wait of BLOCK_SECONDS, not one for every record after
+        self.assertLess(time.monotonic() - start, 3 * W.BLOCK_SECONDS)
+        channels = W.metrics()['channels']
+        self.assertEqual(channels['0-stream']['state'], 'ok')
+        self.assertGreater(channels['0-stream']['dropped'], 0)
+        self.assertGreater(channels['0-stream']['blocked'], 0)
+
+    def test_block_never_waits_on_an_event_loop(self):
+        W = self.hanging()
+        W.BLOCK_SECONDS = 30
+
+        async def write():
+            for i in range(50):
+                W.write('{}\n'.format(i))
+
+        loop = asyncio.new_event_loop()
+        self.addCleanup(loop.close)
+        start = time.monotonic()
+        loop.run_until_complete(write())
+        self.assertLess(time.monotonic() - start, 1)
+        channels = W.metrics()['channels']
+        self.assertGreater(channels['0-stream']['dropped'], 0)
+        self.assertEqual(channels['0-stream']['blocked'], 0)
+
+    def test_spill_keeps_the_order(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        W = Writer()
+        W.set_spool(directory)
+        out = io.StringIO()
+        W.add_channel('stream', out)
+        W.start(queue_size=10, batch_size=5, flush_interval=0.01,
+                overflow='spill')
+        lines = ['{}\n'.format(i) for i in range(200)]
+        for line in lines:
+            W.write(line)
+        W.close()
+        self.assertGreater(W.metrics()['channels']['0-stream']['spilled'], 0)
+        self.assertEqual(out.getvalue(), ''.join(lines))
+
+    def test_bytes_and_str(self):
+        W = Writer()
+        out = io.StringIO()
+        W.add_channel('stream', out)
+        W.write('caf\u00e9\n')
+        W.write('caf\u00e9\n'.encode('utf-8'))
+        self.assertEqual(out.getvalue(), 'caf\u00e9\n' * 2)
+
+
+class OutdirGzipTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.records = [json.dumps({'id': 1, 'n': i,
+                                    'retrevial_time': 1700000000 + i}) + '\n'
+                        for i in range(20)]
+
+    def test_plain_by_default(self):
+        W = Writer()
+        W.add_channel('outdir', self.directory)
+        for data in self.records:
+            W.write(data)
+        with open(os.path.join(self.directory, '1', 'cur.json')) as R:
+            self.assertEqual(R.readlines(), self.records)
+        W.close()
+
+    def test_keyed_records_are_not_decoded(self):
+        W = Writer()
+        W.add_channel('outdir', self.directory, partition='hour')
+        with unittest.mock.patch('jsoncodec.loads',
+                                 side_effect=AssertionError('decoded')):
+            for i, data in enumerate(self.records):
+                W.write(data, key=(2, 1700000000 + i * 3600))
+        W.close()
+        self.assertEqual(sorted(os.listdir(os.path.join(self.directory,
+                                                        '2')))[:2],
+                         ['2023-11-14T22.json', '2023-11-14T23.json'])
+
+    def test_open_files_are_capped(self):
+        W = Writer()
+        W.add_channel('outdir', self.directory, compress='gzip', max_open=3)
+        now = int(time.time())
+        with unittest.mock.patch.object(Writer, '_Writer__repair') as repair:
+            for i in range(4):
+                for vid in range(10):
+                    W.write(self.records[i], key=(vid, now))
+                    self.assertLessEqual(
+                        W.metrics()['channels']['0-outdir']['open_files'], 3)
+        # Files it closed itself are reopened as they are
+        repair.assert_not_called()
+        W.close()
+        for vid in range(10):
+            path = os.path.join(self.directory, str(vid), 'cur.json.gz')
+            with gzip.open(path, 'rt') as R:
+                self.assertEqual(R.readlines(), self.records[:4])
+
+    def test_live_file_reads_to_the_last_batch(self):
+        W = Writer()
+        W.add_channel('outdir', self.directory, compress='gzip')
+        for data in self.records:
+            W.write(data)
+        path = os.path.join(self.directory, '1', 'cur.json.gz')
+        with self.assertRaises(EOFError):
+            with gzip.open(path, 'rt') as R:
+                R.read()
+        with open_gzip(path) as R:
+            self.assertEqual(R.readlines(), self.records)
+        W.close()
+        with gzip.open(path, 'rt') as R:
+            self.assertEqual(R.readlines(), self.records)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,85 +1,938 @@
+import asyncio
+import gzip
+import os
+import struct
+import sys
 import time
-import subprocess
-import boto3
+import threading
+import traceback
+import zlib
+from collections import OrderedDict, deque
 from threading import Lock
 
+import jsoncodec
+
+
+class WriteError(IOError):
+    """A channel could not write records, those that failed are in
+    records"""
+
+    def __init__(self, message, records):
+        super(WriteError, self).__init__(message)
+        self.records = records
+
+
+class Spool(object):
+    """Segmented, append-only log of records kept in a directory
+
+    append(records) adds records to the newest segment file, starting a
+    new one past segment_bytes and dropping the oldest segments (counted
+    in dropped) to stay within max_bytes.  read(count) returns up to count
+    of the oldest records and commit() removes them, saving the read
+    position so a restart carries on from there: records are delivered at
+    least once.  Each record is framed with its length and CRC32, and
+    opening a spool cuts off a torn or corrupt tail (counted in corrupt)
+    as left by a crash.  Appends reach the disk on sync().
+    """
+
+    FRAME = struct.Struct('>II')
+
+    def __init__(self, directory, max_bytes=1 << 30, segment_bytes=16 << 20):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.segment_bytes = segment_bytes
+        self.count = self.bytes = self.dropped = self.corrupt = 0
+        self._lock = Lock()
+        self._file = None
+        # Records and bytes in each segment, oldest first
+        self._counts = OrderedDict()
+        self._sizes = OrderedDict()
+        # Read position: segment, offset and records before it there
+        self._read = None
+        self._pending = None
+        os.makedirs(directory, exist_ok=True)
+        self.__recover()
+
+    def __len__(self):
+        """Records waiting to be read"""
+        return self.count
+
+    def append(self, records):
+        """Add records (bytes, or str to encode) at the end"""
+        frames = []
+        for payload in records:
+            if isinstance(payload, str):
+                payload = payload.encode('utf-8')
+            frames.append(self.FRAME.pack(len(payload), zlib.crc32(payload)))
+            frames.append(payload)
+        frames = b''.join(frames)
+        with self._lock:
+            last = next(reversed(self._sizes), None)
+            if (self._file is None or
+                    self._sizes[last] >= self.segment_bytes):
+                last = self.__new_segment(last)
+            self._file.write(frames)
+            self._file.flush()
+            self._sizes[last] += len(frames)
+            self._counts[last] += len(records)
+            self.bytes += len(frames)
+            self.count += len(records)
+            while self.bytes > self.max_bytes and len(self._sizes) > 1:
+                self.__drop_oldest()
+
+    def sync(self):
+        """Make the appended records durable"""
+        with self._lock:
+            if self._file is not None:
+                os.fsync(self._file.fileno())
+
+    def read(self, count):
+        """Up to count of the oldest records, as bytes, removed by
+        commit()"""
+        records = []
+        with self._lock:
+            if not self.count:
+                return records
+            segment, offset, before = self._read
+            while len(records) < count:
+                with open(self.__path(segment), 'rb') as R:
+                    R.seek(offset)
+                    while len(records) < count:
+                        header = R.read(self.FRAME.size)
+                        if len(header) < self.FRAME.size:
+                            break
+                        length, crc = self.FRAME.unpack(header)
+                        records.append(R.read(length))
+                        offset += self.FRAME.size + length
+                        before += 1
+                if len(records) == count or segment == next(
+                        reversed(self._sizes)):
+                    break
+                if offset >= self._sizes[segment]:
+                    segment = self.__next_segment(segment)
+                    offset = before = 0
+            self._pending = (segment, offset, before, len(records))
+        return records
+
+    def commit(self):
+        """Remove the records last read"""
+        with self._lock:
+            if self._pending is None:
+                return
+            segment, offset, before, count = self._pending
+            self._pending = None
+            if segment not in self._sizes:
+                # Dropped meanwhile
+                return
+            self._read = (segment, offset, before)
+            self.count -= count
+            if not self.count:
+                # All read, start afresh with the next append
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                self._read = (segment, 0, 0)
+            for old in list(self._sizes):
+                if old >= segment and self.count:
+                    break
+                self.__remove(old)
+            tmpname = os.path.join(self.directory, 'position.tmp')
+            with open(tmpname, 'w') as W:
+                W.write('{} {} {}'.format(*self._read))
+                W.flush()
+                os.fsync(W.fileno())
+            os.replace(tmpname, os.path.join(self.directory, 'position'))
+
+    def metrics(self):
+        """Records and bytes spooled, records dropped and corrupt"""
+        return {'records': self.count, 'bytes': self.bytes,
+                'dropped': self.dropped, 'corrupt': self.corrupt}
+
+    def __path(self, segment):
+        return os.path.join(self.directory, '{:012d}.seg'.format(segment))
+
+    def __next_segment(self, segment):
+        segments = list(self._sizes)
+        return segments[segments.index(segment) + 1]
+
+    def __new_segment(self, last):
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+            self._file.close()
+        segment = 0 if last is None else last + 1
+        if self._read is not None:
+            segment = max(segment, self._read[0])
+        self._file = open(self.__path(segment), 'ab')
+        self._sizes[segment] = self._counts[segment] = 0
+        if self._read is None or self._read[0] not in self._sizes:
+            self._read = (segment, 0, 0)
+        return segment
+
+    def __remove(self, segment):
+        self.bytes -= self._sizes.pop(segment)
+        del self._counts[segment]
+        os.remove(self.__path(segment))
+
+    def __drop_oldest(self):
+        oldest = next(iter(self._sizes))
+        lost = self._counts[oldest]
+        if self._read[0] == oldest:
+            lost -= self._read[2]
+        self.dropped += lost
+        self.count -= lost
+        self.__remove(oldest)
+        self._read = (next(iter(self._sizes)), 0, 0)
+
+    def __recover(self):
+        """Find the segments and read position, cutting off bad tails"""
+        segments = sorted(int(name[:-4]) for name in
+                          os.listdir(self.directory) if name.endswith('.seg'))
+        try:
+            with open(os.path.join(self.directory, 'position')) as R:
+                self._read = tuple(int(x) for x in R.read().split())
+        except (IOError, ValueError):
+            self._read = None
+        if self._read is None or self._read[0] not in segments:
+            self._read = (segments[0], 0, 0) if segments else None
+        for segment in segments:
+            if segment < self._read[0]:
+                os.remove(self.__path(segment))
+                continue
+            count = offset = 0
+            with open(self.__path(segment), 'r+b') as F:
+                while True:
+                    header = F.read(self.FRAME.size)
+                    if not header:
+                        break
+                    if len(header) == self.FRAME.size:
+                        length, crc = self.FRAME.unpack(header)
+                        payload = F.read(length)
+                        if (len(payload) == length and
+                                zlib.crc32(payload) == crc):
+                            count += 1
+                            offset += self.FRAME.size + length
+                            continue
+                    self.corrupt += 1
+                    F.truncate(offset)
+                    break
+            self._sizes[segment] = offset
+            self._counts[segment] = count
+            self.bytes += offset
+            self.count += count
+            if segment == self._read[0]:
+                self.count -= self._read[2]
+
 
 class Writer:
-    """ Class handling different outuput options """
+    """ Class handling different outuput options
+
+    Writes go straight to every channel unless start() has been called,
+    then each channel has a queue and a background thread of its own, so
+    a slow or stuck channel holds up no other.  A channel's thread writes
+    batches of up to batch_size records, or whatever has arrived after
+    flush_interval seconds.  When queue_size records are waiting for a
+    channel, overflow decides what happens to the next: 'block' waits for
+    room, 'drop' discards the oldest waiting record and 'spill' moves the
+    queue to the channel's Spool, which is written out in order after.
+    write() runs on the caller's thread, so it blocks for at most
+    BLOCK_SECONDS in all, after which the records spill, or are dropped
+    without a spool, and go on doing so without waiting until the
+    channel's queue is empty again.  On an event loop's thread write()
+    never waits, and overflow 'block' spills or drops at once.  A channel
+    busy with one write for STUCK_SECONDS is reported as stuck, and its
+    records spill or are dropped straight away until it recovers.
+
+    Firehose channels collect records and send them with PutRecordBatch
+    when FIREHOSE_MAX_RECORDS or FIREHOSE_MAX_BYTES are reached or the
+    oldest has waited the channel's interval (records are sent at once
+    when not queued), retrying just the records that failed.
+
+    After set_spool(), each channel has a Spool of its own: records a
+    channel fails to write go there, as does everything after them while
+    it is not empty, and are replayed in order once the channel works
+    again, retrying after SPOOL_MIN_DELAY doubling up to SPOOL_MAX_DELAY
+    seconds.  A replayed batch leaves the spool only once all of it is
+    written, so records may be written twice but never out of order.
+    Spools survive restarts and are replayed after them.
+    """
+
+    OVERFLOW = ('block', 'drop', 'spill')
+
+    # outdir partition lengths, seconds to keep a partition's file open
+    # after for late records, and most partition files open at once
+    OUTDIR_PARTITIONS = {'hour': 3600, 'day': 86400}
+    OUTDIR_COMPRESS = ('gzip', 'none')
+    OUTDIR_LATE = 60
+    OUTDIR_MAX_OPEN = 256
+
+    # Most seconds write() waits for room with overflow 'block', and
+    # seconds in one write before a channel counts as stuck
+    BLOCK_SECONDS = 0.5
+    STUCK_SECONDS = 30.0
 
-    def add_channel(self, type, location):
+    # Retry delays for a channel with spooled records, and records a replay
+    SPOOL_MIN_DELAY = 1.0
+    SPOOL_MAX_DELAY = 60.0
+    SPOOL_BATCH = 500
+
+    # PutRecordBatch limits
+    FIREHOSE_MAX_RECORDS = 500
+    FIREHOSE_MAX_BYTES = 4 * 1024 * 1024
+    FIREHOSE_ATTEMPTS = 5
+
+    def add_channel(self, type, location, **options):
         """ Add an output channel to the writer """
         ''' Types of channels
             outdir = directory for rotating json - pass in folder to manage
+                options partition ('hour' or 'day', the default), compress
+                ('none', the default, or 'gzip', see logfile.open_gzip),
+                sync_interval (seconds between sync points, default 60) and
+                max_open (partition files kept open, the least recently
+                written are closed past it, default OUTDIR_MAX_OPEN)
             stream = output raw, no file rotation - pass in file handle
             firehose = write to AWS Kinesis firehose - pass in kineisis stream
+                options interval (seconds to collect records for a batch,
+                default 5) and endpoint_url (e.g. a local stand-in)
         '''
-        self.output_channels.append({'type': type,
-                                     'location': location})
+        channel = {'type': type, 'location': location,
+                   'name': '{}-{}'.format(len(self.output_channels), type),
+                   'queue': deque(), 'busy_since': None, 'stuck': False,
+                   'failing': False, 'shedding': False, 'max_queued': 0,
+                   'dropped': 0,
+                   'blocked': 0, 'spilled': 0, 'written': 0, 'batches': 0,
+                   'errors': 0, 'flush_last': 0.0, 'flush_total': 0.0,
+                   'flush_max': 0.0}
+        if type == 'outdir':
+            partition = options.get('partition', 'day')
+            compress = options.get('compress', 'none')
+            if partition not in self.OUTDIR_PARTITIONS:
+                raise ValueError('partition must be one of {}'.format(
+                    tuple(self.OUTDIR_PARTITIONS)))
+            if compress not in self.OUTDIR_COMPRESS:
+                raise ValueError('compress must be one of {}'.format(
+                    self.OUTDIR_COMPRESS))
+            channel.update(
+                period=self.OUTDIR_PARTITIONS[partition], compress=compress,
+                filename=('%Y-%m-%d.json' if partition == 'day' else
+                          '%Y-%m-%dT%H.json') +
+                ('.gz' if compress == 'gzip' else ''),
+                sync_interval=options.get('sync_interval', 60.0),
+                max_open=options.get('max_open', self.OUTDIR_MAX_OPEN),
+                files=OrderedDict(), latest={}, finished={})
+        elif type == 'firehose':
+            channel.update(interval=options.get('interval', 5.0),
+                           endpoint_url=options.get('endpoint_url'),
+                           pending=[], bytes=0, since=None, calls=0,
+                           records=0, retries=0, failed=0)
+        self.output_channels.append(channel)
+        if self.spool_dir:
+            self.__add_spool(len(self.output_channels) - 1)
+        if self._threads:
+            self.__start_channel(len(self.output_channels) - 1)
+
+    def set_spool(self, directory, max_bytes=1 << 30):
+        """Spool what channels fail to write under directory, keeping each
+        channel's spool within max_bytes"""
+        self.spool_dir = directory
+        self.spool_max_bytes = max_bytes
+        for i in range(len(self.output_channels)):
+            self.__add_spool(i)
+
+    def write(self, data, key=None):
+        """Write data, bytes or str, to the known output channels, or
+        queue it for them
+
+        key is the (vehicle id, time) of a record, filing it in outdir
+        channels without decoding it.
+        """
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        if not self._threads:
+            self.records += 1
+            self.__write_batch([data], [key])
+            for i in range(len(self.output_channels)):
+                self.__replay(i)
+            return
+        now = time.monotonic()
+        # Waiting would hold up every coroutine on the loop
+        block_until = now if asyncio._get_running_loop() else (
+            now + self.BLOCK_SECONDS)
+        with self._cond:
+            self.records += 1
+            full = False
+            spilled = []
+            for channel in self.output_channels:
+                if self.__enqueue(channel, data, key, now, block_until):
+                    spilled.append(channel)
+                full = full or len(channel['queue']) >= self.batch_size
+            if full:
+                self._cond.notify_all()
+        for channel in spilled:
+            self.__drain_spills(channel, False)
+
+    def channelcount(self):
+        """ Return number of current channels """
+        return len(self.output_channels)
+
+    def start(self, queue_size=10000, batch_size=500, flush_interval=1.0,
+              overflow='block'):
+        """Queue writes for a background thread per channel from now on"""
+        if overflow not in self.OVERFLOW:
+            raise ValueError('overflow must be one of {}'.format(
+                self.OVERFLOW))
+        if overflow == 'spill' and not self.spool_dir:
+            raise ValueError('overflow spill needs set_spool() first')
+        self.queue_size = queue_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        for i in range(len(self.output_channels)):
+            self.__start_channel(i)
+
+    def close(self, timeout=30):
+        """Write out everything queued, stop the background threads and
+        close the output files"""
+        with self._cond:
+            self._closing = True
+            self._close_by = time.monotonic() + timeout
+            self._cond.notify_all()
+        threads = self._threads or [None] * len(self.output_channels)
+        for thread, channel in zip(threads, self.output_channels):
+            if thread is not None:
+                thread.join(max(0, self._close_by - time.monotonic()))
+            if thread is not None and thread.is_alive():
+                print("# {:.0f} Writer {} did not finish, {} records not "
+                      "written".format(time.time(), channel['name'],
+                                       len(channel['queue'])),
+                      file=sys.stderr)
+            elif channel['type'] == 'outdir':
+                self.__file_maintenance(channel)
+        self._threads = []
+
+    def metrics(self):
+        """Records written, and for each channel its state ('ok',
+        'behind' with records spooled, 'failing' or 'stuck'), queue depth
+        and lag (seconds the oldest has waited), counters, flush times in
+        ms, the records and bytes in its spool, and the PutRecordBatch
+        calls, records sent, retried and failed for a firehose"""
+        now = time.monotonic()
+        with self._cond:
+            return {'records': self.records,
+                    'channels': {channel['name']:
+                                 self.__channel_metrics(channel, now)
+                                 for channel in self.output_channels}}
+
+    def __init__(self):
+        self.output_channels = []
+        self._threads = []
+        self._closing = False
+        self._close_by = None
+        self._cond = threading.Condition()
+        self.spool_dir = None
+        self.spool_max_bytes = None
+        self.records = 0
 
-    def write(self, data):
-        """Write to the known output channels"""
+    def __start_channel(self, channel_index):
+        thread = threading.Thread(
+            target=self.__run, args=(channel_index,), daemon=True,
+            name='writer-' + self.output_channels[channel_index]['name'])
+        self._threads.append(thread)
+        thread.start()
+
+    def __enqueue(self, channel, data, key, now, block_until):
+        """Queue data for channel, as overflow says when it is full,
+        whether it spilled records for __drain_spills()"""
+        queue = channel['queue']
+        while len(queue) >= self.queue_size:
+            overflow = self.overflow
+            if overflow == 'block' and (channel['shedding'] or
+                                        now >= block_until or
+                                        self.__stuck(channel, now)):
+                # Waiting longer would hold up polling and every channel,
+                # until the queue drains
+                channel['shedding'] = True
+                overflow = 'spill' if 'spool' in channel else 'drop'
+            if overflow == 'drop':
+                queue.popleft()
+                channel['dropped'] += 1
+            elif overflow == 'spill':
+                # The queue too, to keep the order
+                records = [entry[1] for entry in queue] + [data]
+                queue.clear()
+                channel['spills'].append(records)
+                channel['spilled'] += len(records)
+                return True
+            else:
+                channel['blocked'] += 1
+                self._cond.wait(block_until - now)
+                now = time.monotonic()
+        queue.append((now, data, key))
+        channel['max_queued'] = max(channel['max_queued'], len(queue))
+        return False
+
+    def __drain_spills(self, channel, wait):
+        """Append the records spilled from channel's queue to its spool
+        in order, outside _cond, unless another thread is at it and not
+        wait"""
+        spills = channel['spills']
+        while spills and channel['spill_lock'].acquire(wait):
+            try:
+                while spills:
+                    # Gone from spills only once in the spool
+                    channel['spool'].append(spills[0])
+                    spills.popleft()
+            finally:
+                channel['spill_lock'].release()
+
+    def __stuck(self, channel, now):
+        """Whether channel has been in one write for STUCK_SECONDS,
+        reporting it the first time"""
+        busy = channel['busy_since']
+        if busy is None or now - busy < self.STUCK_SECONDS:
+            return False
+        if not channel['stuck']:
+            channel['stuck'] = True
+            print("# {:.0f} Writer {} stuck for {:.0f}s, {} records "
+                  "queued".format(time.time(), channel['name'], now - busy,
+                                  len(channel['queue'])), file=sys.stderr)
+        return True
+
+    def __channel_metrics(self, channel, now):
+        queue = channel['queue']
+        spool = channel.get('spool')
+        if self.__stuck(channel, now):
+            state = 'stuck'
+        elif channel['failing'] or channel.get('delay'):
+            state = 'failing'
+        elif spool is not None and (len(spool) or channel['spills']):
+            state = 'behind'
+        else:
+            state = 'ok'
+        metrics = {'type': channel['type'], 'state': state,
+                   'queued': len(queue), 'max_queued': channel['max_queued'],
+                   'lag': round(now - queue[0][0], 1) if queue else 0,
+                   'flush_ms': {
+                       'last': round(channel['flush_last'] * 1000, 1),
+                       'mean': round(channel['flush_total'] * 1000 /
+                                     max(1, channel['batches']), 1),
+                       'max': round(channel['flush_max'] * 1000, 1)}}
+        metrics.update((key, channel[key]) for key in
+                       ('dropped', 'blocked', 'spilled', 'written', 'batches',
+                        'errors'))
+        if spool is not None:
+            metrics['spool'] = dict(spool.metrics(),
+                                    replayed=channel['replayed'])
+        if channel['type'] == 'firehose':
+            metrics['firehose'] = {key: channel[key] for key in
+                                   ('calls', 'records', 'retries', 'failed')}
+        elif channel['type'] == 'outdir':
+            metrics['open_files'] = len(channel['files'])
+        return metrics
+
+    def __write_channel(self, batch, channel_index, keys=None):
+        if self.output_channels[channel_index]['type'] == 'outdir':
+            # The only type filing records by key
+            self.__write_to_file(batch, channel_index, keys)
+            return
         # Map functions to known output types
         options = {'outdir': self.__write_to_file,
                    'stream': self.__write_to_stream,
                    'firehose': self.__write_to_firehose
                    }
+        options[self.output_channels[channel_index]['type']](
+            batch, channel_index)
+
+    def __deliver(self, batch, channel_index, keys=None):
+        """Write batch to a channel, or its spool, the records written"""
+        spool = self.output_channels[channel_index].get('spool')
+        if spool is not None and len(spool):
+            # Keep the order, the spool goes out first
+            self.__spool(channel_index, batch)
+            return 0
+        try:
+            self.__write_channel(batch, channel_index, keys)
+        except Exception as e:
+            if spool is None:
+                raise
+            failed = getattr(e, 'records', batch)
+            self.__spool(channel_index, failed, e)
+            return len(batch) - len(failed)
+        return len(batch)
+
+    def __write_batch(self, batch, keys):
         # For each channel, call theh appropriate writer for the type
         # using a while with index, safe way to modify the list whle being
         # iterated on
         for i in range(len(self.output_channels)):
-            options[self.output_channels[i]['type']](data, i)
+            self.output_channels[i]['written'] += self.__deliver(batch, i,
+                                                                 keys)
 
-    def channelcount(self):
-        """ Return number of current channels """
-        return len(self.output_channels)
+    def __add_spool(self, channel_index):
+        channel = self.output_channels[channel_index]
+        channel.update(
+            spool=Spool(os.path.join(self.spool_dir, channel['name']),
+                        self.spool_max_bytes),
+            retry_at=0, delay=0, replayed=0, spills=deque(),
+            spill_lock=Lock())
 
-    def __init__(self):
-        self.output_channels = []
-        self.nexthour = 0
-        self.master_lock = Lock()
-
-    def __write_to_file(self, data, channel_index):
-        # do maint and determine the current filehandle & update the record
-        filehandle = self.__output_maintenance(
-            self.output_channels[channel_index]['location'],
-            self.output_channels[channel_index].get('handle'))
-        self.output_channels[channel_index].update({'handle': filehandle})
-        filehandle.write(data)
-        filehandle.flush()
-
-    def __write_to_stream(self, data, channel_index):
+    def __spool(self, channel_index, records, error=None):
+        """Keep records channel_index could not write for replay"""
+        channel = self.output_channels[channel_index]
+        channel['spool'].append(records)
+        channel['spool'].sync()
+        if error is not None:
+            self.__back_off(channel, 'spooled', len(records), error)
+
+    def __back_off(self, channel, what, count, error):
+        """Put off channel's next replay, doubling the delay"""
+        channel['delay'] = min(self.SPOOL_MAX_DELAY,
+                               max(self.SPOOL_MIN_DELAY, channel['delay'] * 2))
+        channel['retry_at'] = time.monotonic() + channel['delay']
+        print("# {:.0f} Writer {} {} records for {}, retry in {:.0f}s:"
+              " {}".format(time.time(), what, count, channel['name'],
+                           channel['delay'], error), file=sys.stderr)
+
+    def __replay(self, channel_index, until=None):
+        """Write out channel_index's spool, once it is due a retry, until
+        empty or the until time, backing off on failure"""
+        channel = self.output_channels[channel_index]
+        spool = channel.get('spool')
+        if spool is None or time.monotonic() < channel['retry_at']:
+            return
+        while len(spool):
+            records = spool.read(self.SPOOL_BATCH)
+            try:
+                self.__write_channel(records, channel_index)
+                if channel['type'] == 'firehose':
+                    self.__send_firehose(channel, True)
+            except Exception as e:
+                # Not committed, so the whole batch is replayed again,
+                # failures still ahead of everything spooled after them
+                failed = getattr(e, 'records', records)
+                self.__back_off(channel, 'could not replay', len(failed), e)
+                return
+            spool.commit()
+            channel['delay'] = 0
+            channel['replayed'] += len(records)
+            if until is None or time.monotonic() >= until:
+                return
+
+    def __flush(self, channel_index, batch, keys, force=False):
+        channel = self.output_channels[channel_index]
+        start = time.monotonic()
+        written = 0
+        try:
+            if batch:
+                written = self.__deliver(batch, channel_index, keys)
+            if channel['type'] == 'firehose':
+                # Send records that are due, or all of them
+                try:
+                    self.__send_firehose(channel, force)
+                except WriteError as e:
+                    if 'spool' not in channel:
+                        raise
+                    self.__spool(channel_index, e.records, e)
+            channel['failing'] = False
+        except Exception:
+            # Nowhere better to report it, and the poller must go on
+            channel['errors'] += 1
+            channel['failing'] = True
+            print("# {:.0f} Writer could not write {} records to {}".format(
+                time.time(), len(batch), channel['name']), file=sys.stderr)
+            traceback.print_exc()
+        if not batch:
+            return
+        elapsed = time.monotonic() - start
+        channel['written'] += written
+        channel['batches'] += 1
+        channel['flush_last'] = elapsed
+        channel['flush_total'] += elapsed
+        channel['flush_max'] = max(channel['flush_max'], elapsed)
+
+    def __run(self, channel_index):
+        """Background thread writing out one channel's queue"""
+        channel = self.output_channels[channel_index]
+        queue = channel['queue']
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while len(queue) < self.batch_size and not self._closing:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                entries = [queue.popleft() for i in
+                           range(min(len(queue), self.batch_size))]
+                if not queue:
+                    channel['shedding'] = False
+                # Room for blocked writers
+                self._cond.notify_all()
+                done = self._closing and not queue
+                channel['busy_since'] = time.monotonic()
+            if 'spool' in channel:
+                # Spilled before the entries, so ahead of them
+                self.__drain_spills(channel, True)
+            self.__flush(channel_index, [entry[1] for entry in entries],
+                         [entry[2] for entry in entries], force=done)
+            if 'spool' in channel:
+                # Also what spilled from the queue
+                channel['spool'].sync()
+                self.__replay(channel_index, until=self._close_by if done
+                              else time.monotonic() + self.flush_interval)
+            with self._cond:
+                if channel['stuck']:
+                    print("# {:.0f} Writer {} recovered after {:.0f}s".format(
+                        time.time(), channel['name'],
+                        time.monotonic() - channel['busy_since']),
+                        file=sys.stderr)
+                channel['busy_since'] = None
+                channel['stuck'] = False
+            if done:
+                return
+
+    def __write_to_file(self, batch, channel_index, keys=None):
+        """Append batch to the partition files of its records"""
+        channel = self.output_channels[channel_index]
+        now = time.time()
+        self.__file_maintenance(channel, now)
+        partitions = {}
+        for data, key in zip(batch, keys or [None] * len(batch)):
+            partitions.setdefault(self.__partition(channel, data, key, now),
+                                  []).append(data)
+        for (vid, start), records in partitions.items():
+            self.__append(channel, self.__partition_file(channel, vid, start),
+                          b''.join(records), now)
+
+    def __write_to_stream(self, batch, channel_index):
         # For streams (e.g. stdout), filehandle is passed as location
         stream = self.output_channels[channel_index].get('location')
-        stream.write(data)
+        stream.write(b''.join(batch).decode('utf-8'))
         stream.flush()
 
-    def __write_to_firehose(self, data, channel_index):
-        firehose = self.output_channels[channel_index].get('firehose')
+    def __write_to_firehose(self, batch, channel_index):
+        channel = self.output_channels[channel_index]
+        if not channel['pending']:
+            channel['since'] = time.monotonic()
+        channel['pending'].extend(batch)
+        channel['bytes'] += sum(len(data) for data in batch)
+        if not self._threads:
+            self.__send_firehose(channel, True)
+
+    def __send_firehose(self, channel, force=False):
+        """Send a firehose channel's records if due, or force"""
+        if not channel['pending']:
+            return
+        if not (force or
+                len(channel['pending']) >= self.FIREHOSE_MAX_RECORDS or
+                channel['bytes'] >= self.FIREHOSE_MAX_BYTES or
+                time.monotonic() - channel['since'] >= channel['interval']):
+            return
+        pending = channel['pending']
+        channel.update(pending=[], bytes=0, since=None)
+        chunks = [[]]
+        size = 0
+        for data in pending:
+            length = len(data)
+            if chunks[-1] and (len(chunks[-1]) == self.FIREHOSE_MAX_RECORDS
+                               or size + length > self.FIREHOSE_MAX_BYTES):
+                chunks.append([])
+                size = 0
+            chunks[-1].append(data)
+            size += length
+        errors = []
+        failed = []
+        for chunk in chunks:
+            try:
+                self.__put_firehose_batch(channel, chunk)
+            except Exception as e:
+                errors.append(str(e))
+                failed.extend(getattr(e, 'records', chunk))
+        if errors:
+            raise WriteError('; '.join(errors), failed)
+
+    def __put_firehose_batch(self, channel, records):
+        """PutRecordBatch records, retrying just those that fail"""
+        firehose = channel.get('firehose')
         if not firehose:
-            firehose = boto3.client('firehose')
-            self.output_channels[channel_index].update({'firehose': firehose})
-        response = firehose.put_record(
-            DeliveryStreamName=self.output_channels[channel_index].get(
-                'location'),
-            Record={'Data': data}
-        )
-
-    def __output_maintenance(self, outdir, outfile):
-        """Move to the next output file when time, close/reopen every hour"""
-        cur = time.time()
-
-        # Ensure we don't have multi-vehicle output direct race conditions
-        with self.master_lock:
-            if cur < self.nexthour:
-                return outfile
-            if outfile is not None:
-                outfile.close()
-            self.nexthour = (int(cur / 3600) + 1) * 3600
-            fname = time.strftime("%Y-%m-%d.json", time.gmtime(cur))
-            pname = "{}/{}".format(outdir, fname)
-            # W = open(pname, "a", 0)
-            outfile = open(pname, "a")
-            subprocess.call(["ln", "-sf", fname,
-                             "{}/cur.json".format(outdir)])
-            return outfile
+            # Only needed for firehose output
+            import boto3
+            firehose = boto3.client('firehose',
+                                    endpoint_url=channel['endpoint_url'])
+            channel['firehose'] = firehose
+        delay = 0.5
+        error = None
+        for attempt in range(self.FIREHOSE_ATTEMPTS):
+            if attempt:
+                time.sleep(delay)
+                delay *= 2
+                channel['retries'] += len(records)
+            try:
+                response = firehose.put_record_batch(
+                    DeliveryStreamName=channel['location'],
+                    Records=[{'Data': data} for data in records])
+            except Exception as e:
+                error = e
+                continue
+            channel['calls'] += 1
+            if not response.get('FailedPutCount'):
+                channel['records'] += len(records)
+                return
+            failed = [(data, result) for data, result in
+                      zip(records, response['RequestResponses'])
+                      if result.get('ErrorCode')]
+            channel['records'] += len(records) - len(failed)
+            if not failed:
+                return
+            records = [data for data, result in failed]
+            error = failed[0][1]['ErrorCode']
+        channel['failed'] += len(records)
+        raise WriteError('Firehose {} failed {} records: {}'.format(
+            channel['location'], len(records), error), records)
+
+    def __partition(self, channel, data, key, now):
+        """The vehicle id and partition start time data belongs under,
+        from its key or else its id and retrevial_time"""
+        vid, when = 'poller', now
+        if key is not None:
+            vid, when = str(key[0]), key[1]
+        elif data.startswith(b'{'):
+            try:
+                record = jsoncodec.loads(data)
+                vid = str(record['id'])
+                when = record.get('retrevial_time', now)
+            except (ValueError, KeyError, TypeError):
+                pass
+        period = channel['period']
+        return vid, int(when // period) * period
+
+    def __partition_file(self, channel, vid, start):
+        """The open file of a partition, pointing cur at the latest"""
+        files = channel['files']
+        part = files.get((vid, start))
+        if part is not None:
+            files.move_to_end((vid, start))
+            return part
+        while len(files) >= channel['max_open']:
+            self.__close_partition(channel, next(iter(files)))
+        directory = os.path.join(channel['location'], vid)
+        os.makedirs(directory, exist_ok=True)
+        fname = time.strftime(channel['filename'], time.gmtime(start))
+        path = os.path.join(directory, fname)
+        if (vid not in channel['finished'].get(start, ()) and
+                os.path.exists(path)):
+            # Not closed by us, maybe torn by a crash
+            self.__repair(channel, path)
+        part = {'handle': open(path, 'ab'), 'deflate': None,
+                'synced': time.time(), 'until': start + channel['period']}
+        files[(vid, start)] = part
+        latest = channel['latest'].get(vid)
+        if latest is None or start > latest:
+            channel['latest'][vid] = start
+            cur = os.path.join(directory, 'cur' + fname[fname.index('.'):])
+            # Swap in a new link, never leaving none
+            if os.path.lexists(cur + '.tmp'):
+                os.remove(cur + '.tmp')
+            os.symlink(fname, cur + '.tmp')
+            os.replace(cur + '.tmp', cur)
+        return part
+
+    def __append(self, channel, part, data, now):
+        """Write to a partition file, decodable up to here, and at a sync
+        point every sync_interval seconds"""
+        sync = now - part['synced'] >= channel['sync_interval']
+        if channel['compress'] == 'gzip' and (data or part['deflate']):
+            if part['deflate'] is None:
+                # A new gzip member, gzip reads them as one
+                part['deflate'] = zlib.compressobj(6, zlib.DEFLATED, 31)
+            data = part['deflate'].compress(data) + part['deflate'].flush(
+                zlib.Z_FINISH if sync else zlib.Z_SYNC_FLUSH)
+            if sync:
+                part['deflate'] = None
+        part['handle'].write(data)
+        part['handle'].flush()
+        if sync:
+            os.fsync(part['handle'].fileno())
+            part['synced'] = now
+
+    def __close_partition(self, channel, key):
+        """Close a partition's file, finishing it"""
+        part = channel['files'].pop(key)
+        self.__append(channel, part, b'', float('inf'))
+        part['handle'].close()
+        channel['finished'].setdefault(key[1], set()).add(key[0])
+
+    def __file_maintenance(self, channel, now=None):
+        """Close the files of partitions OUTDIR_LATE seconds past their
+        end, or all of them, and sync those due"""
+        for key, part in list(channel['files'].items()):
+            if now is None or now >= part['until'] + self.OUTDIR_LATE:
+                self.__close_partition(channel, key)
+            elif (part['deflate'] is not None and
+                  now - part['synced'] >= channel['sync_interval']):
+                self.__append(channel, part, b'', now)
+        if now is not None:
+            # A record later still checks the file before appending
+            for start in [start for start in channel['finished'] if
+                          now >= start + 2 * channel['period']]:
+                del channel['finished'][start]
+
+    def __repair(self, channel, path):
+        """Cut off a torn tail left in a partition file by a crash, keeping
+        the whole records in it, reading it a chunk at a time"""
+        size = os.path.getsize(path)
+        good = 0
+        salvage = b''
+        with open(path, 'rb') as R:
+            if channel['compress'] == 'gzip':
+                # good is the end of the last whole member, text that of
+                # the member after it so far
+                inflate = zlib.decompressobj(31)
+                text = []
+                end = 0
+                step = 1 << 16
+                pending = b''
+                while True:
+                    if not pending:
+                        pending = R.read(1 << 16)
+                        if not pending:
+                            break
+                    chunk, pending = pending[:step], pending[step:]
+                    before = inflate.copy() if len(chunk) > 1 else None
+                    try:
+                        text.append(inflate.decompress(chunk))
+                    except zlib.error:
+                        if before is None:
+                            break
+                        # Again a byte at a time, up to where it goes bad
+                        inflate, pending, step = before, chunk + pending, 1
+                        continue
+                    end += len(chunk)
+                    if inflate.eof:
+                        pending = inflate.unused_data + pending
+                        end = good = end - len(inflate.unused_data)
+                        inflate = zlib.decompressobj(31)
+                        text = []
+                        step = 1 << 16
+                text = b''.join(text)
+                salvage = text[:text.rfind(b'\n') + 1]
+                if salvage:
+                    salvage = gzip.compress(salvage)
+            else:
+                # Back from the end to the last newline
+                end = size
+                while end > 0:
+                    start = max(0, end - (1 << 16))
+                    R.seek(start)
+                    chunk = R.read(end - start)
+                    if b'\n' in chunk:
+                        good = start + chunk.rfind(b'\n') + 1
+                        break
+                    end = start
+        if good == size:
+            return
+        print("# {:.0f} Writer repaired {}, keeping {} of {} bytes".format(
+            time.time(), path, good, size), file=sys.stderr)
+        with open(path, 'r+b') as F:
+            F.truncate(good)
+            F.seek(good)
+            F.write(salvage)